@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+"""
+AlignCheckpoint.py
+This script is a part of piTargetClassifier project.
+This script contains the AlignCheckpoint class, which periodically records the progress of an Align run in
+ Prefix.Checkpoint.json, so that an interrupted run can be resumed (--resume) instead of starting over.
+Checkpoints are only made on request (--checkpoint, or --resume).
+For each RNA set, the checkpoint records the number of RNAs finished, the size of the 4 output files at that point,
+ and the state of the summary accumulator. It is keyed by a hash of the input FASTA files and the weights, and by
+ the alignment options which change the output files.
+Yu Sun, ysun43@ur.rochester.edu, 2018-11
+"""
+
+import os
+import json
+import time
+import hashlib
+from bin import AlignmentOutputWriter
+
+#Default number of seconds between two checkpoints, with --resume alone
+CheckpointInterval = 300
+
+#This function hashes the contents of the input files and the weights.
+#Inputs already identified by a checksum (e.g. TranscriptomeIndex sets) are given as Checksums, and are not read.
+def InputsHasher(Files, Weights, Checksums=()):
+    Hasher = hashlib.sha256()
+    for File in Files:
+        fi = open(File, "rb")
+        for Block in iter(lambda: fi.read(1 << 24), b""):
+            Hasher.update(Block)
+        fi.close()
+        Hasher.update(b"\0")
+    for Checksum in Checksums:
+        Hasher.update(Checksum.encode() + b"\0")
+    Hasher.update(json.dumps(Weights, sort_keys=True).encode())
+    return Hasher.hexdigest()
+
+#This class stores the checkpoint of an Align run. Sets are identified by their output file prefix.
+#Hash identifies the inputs and weights (see InputsHasher), and Options is a dictionary of the alignment options which
+# change the output files (e.g. {"--nms": 0}). Both are recorded in every checkpoint.
+class AlignCheckpoint:
+    def __init__(self, Prefix, Hash, Interval=CheckpointInterval, Options=None):
+        self.File = Prefix + ".Checkpoint.json"
+        self.Hash = Hash
+        self.Interval = Interval
+        self.Options = {} if Options is None else Options
+        self.Sets = {}
+        self.LastTime = time.time()
+
+    #Returns why the checkpoint file can not be resumed by this run: it was made with other inputs, weights or
+    # alignment options. None if it is missing, or if it matches.
+    def Mismatch(self):
+        if not os.path.exists(self.File):
+            return None
+        fi = open(self.File, "r")
+        Checkpoint = json.load(fi)
+        fi.close()
+        Options = Checkpoint.get("Options", {})
+        Changed = [Name + " " + str(Options.get(Name)) + " -> " + str(self.Options.get(Name)) \
+                   for Name in sorted(set(Options) | set(self.Options)) if Options.get(Name) != self.Options.get(Name)]
+        if len(Changed) > 0:
+            return "the alignment options have changed (" + ", ".join(Changed) + ")"
+        if Checkpoint.get("Hash") != self.Hash:
+            return "the input files or the weights have changed"
+        return None
+
+    #Load the checkpoint file. Returns False if it is missing, was made with other inputs, weights or options (see
+    # Mismatch), or if an output file is shorter than recorded (e.g. lost buffers); in these cases the run has to start over.
+    def Load(self):
+        if not os.path.exists(self.File) or self.Mismatch() is not None:
+            return False
+        fi = open(self.File, "r")
+        Checkpoint = json.load(fi)
+        fi.close()
+        for OutputFilePrefix, State in Checkpoint["Sets"].items():
+            for OutputFile, Offset in zip(OutputFilesNames(OutputFilePrefix), State["Offsets"]):
+                if not os.path.exists(OutputFile) or os.path.getsize(OutputFile) < Offset:
+                    return False
+        self.Sets = Checkpoint["Sets"]
+        return True
+
+    #The state of a set: {"Done": RNAs finished, "Offsets": sizes of the output files, "Summary": accumulator state}
+    def SetState(self, OutputFilePrefix):
+        return self.Sets.get(OutputFilePrefix)
+
+    def UpdateSet(self, OutputFilePrefix, Done, Offsets, Summary):
+        self.Sets[OutputFilePrefix] = {"Done": Done, "Offsets": Offsets, "Summary": Summary}
+
+    #Whether the next checkpoint is due
+    def Due(self):
+        return self.Interval > 0 and time.time() - self.LastTime >= self.Interval
+
+    #Write the checkpoint file atomically
+    def Save(self):
+        TempFile = self.File + ".tmp"
+        fo = open(TempFile, "w")
+        json.dump({"Hash": self.Hash, "Options": self.Options, "Sets": self.Sets}, fo)
+        fo.flush()
+        os.fsync(fo.fileno())
+        fo.close()
+        os.replace(TempFile, self.File)
+        self.LastTime = time.time()
+
+#The output files of a set, in the order of AlignmentOutputWriter.AlignmentOutputSink (the Hits file is only recorded
+# when it is written)
+def OutputFilesNames(OutputFilePrefix):
+    return [OutputFilePrefix + Suffix for Suffix in AlignmentOutputWriter.OutputFilesSuffixes + (AlignmentOutputWriter.HitsFileSuffix,)]
+
+#This function trims the output files of a set to the recorded sizes, which removes partially written records.
+def OutputFilesTruncator(OutputFilePrefix, Offsets):
+    for OutputFile, Offset in zip(OutputFilesNames(OutputFilePrefix), Offsets):
+        fo = open(OutputFile, "a")
+        fo.truncate(Offset)
+        fo.close()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+"""
+AlignmentCache.py
+This script is a part of piTargetClassifier project.
+This script contains the AlignmentCache class, an on-disk (SQLite) cache of the top 3 alignments of piRNA-RNA pairs,
+ so that repeated runs (e.g. overlapping piRNA panels against the same transcriptome) reuse the pairs already aligned.
+Pairs are addressed by their content: the target sequence, the (reversed) piRNA sequence and the weights (and the
+ suppression distance, see SequencesAligner.HitsSelector, and the scan window, which orders the tied alignments of
+ long targets, see SequencesAligner.PairingTopEndsScanner), not by names.
+The cache has a size limit, and the least recently used targets are evicted first.
+Requied packages: numpy
+Yu Sun, ysun43@ur.rochester.edu, 2018-11
+"""
+
+import time
+import sqlite3
+import hashlib
+import numpy as np
+from bin import SequencesAligner
+
+#Default size limit of the cache (MB of stored results), and the number of RNAs between two commits
+AlignCacheSizeLimit = 1024
+CommitInterval = 256
+
+#This class looks up and stores the pairs of a SequencesAligner.piRNAPanel. Each pair is stored as one int32 row:
+# Starts (3), Ends (3), Scores (3), BinPos (3), then the 3 patterns of the piRNA length.
+#Only the main process uses the cache: RNAs are looked up before being aligned (Lookup), and only the missing
+# unique piRNAs are aligned (see SequencesAligner.PairingPanelAligner), then merged and stored (Merge).
+class AlignmentCache:
+    def __init__(self, File, Panel, WeightsTable, SizeLimit=AlignCacheSizeLimit, Distance=0, \
+                 ScanWindow=SequencesAligner.ScanWindowLength):
+        self.File = File
+        self.Panel = Panel
+        self.SizeLimit = SizeLimit * (1 << 20)
+        self.WeightsKey = hashlib.sha256(WeightsTable.astype(np.int64).tobytes()).digest()
+        if Distance > 0:
+            self.WeightsKey = hashlib.sha256(self.WeightsKey + b"Distance" + str(Distance).encode()).digest()
+        #The scan window changes the order of tied alignments, the scoring engines do not (they give the same scores)
+        if ScanWindow != SequencesAligner.ScanWindowLength:
+            self.WeightsKey = hashlib.sha256(self.WeightsKey + b"ScanWindow" + str(ScanWindow).encode()).digest()
+        self.UniqueIndex = {Panel.Sequences[i]: i for i in Panel.Unique.tolist()}
+        self.Uncommitted = 0
+        self.Reused = 0
+        self.Aligned = 0
+        self.Connection = sqlite3.connect(File)
+        self.Connection.execute("PRAGMA journal_mode=WAL")
+        self.Connection.execute("PRAGMA synchronous=NORMAL")
+        self.Connection.execute("CREATE TABLE IF NOT EXISTS Pairs (TargetKey BLOB NOT NULL, piRNASeq TEXT NOT NULL, " + \
+                                "Result BLOB NOT NULL, LastUsed REAL NOT NULL, PRIMARY KEY (TargetKey, piRNASeq)) WITHOUT ROWID")
+        #Size of the stored results (bytes), kept up to date by Merge and Evict
+        self.Size = self.Connection.execute("SELECT COALESCE(SUM(LENGTH(Result)), 0) FROM Pairs").fetchone()[0]
+        self.Evicted = 0
+
+    #The key of a target sequence, for the weights of this run
+    def TargetKey(self, Sequence):
+        return hashlib.sha256(self.WeightsKey + Sequence.encode()).digest()[:16]
+
+    #Returns (Found, Cached): a boolean mask of the piRNAs found in the cache, and a SequencesAligner.PanelPairing
+    # object holding their results (the other rows are 0). Duplicate piRNAs get the result of their representative.
+    def Lookup(self, Sequence):
+        Panel = self.Panel
+        piRNANum = len(Panel.Names)
+        Starts = np.zeros((piRNANum, 3), dtype=np.int64)
+        Ends = np.zeros((piRNANum, 3), dtype=np.int64)
+        Scores = np.zeros((piRNANum, 3), dtype=np.int64)
+        BinPos = np.zeros((piRNANum, 3), dtype=np.int64)
+        Patterns = np.zeros((piRNANum, 3, Panel.MaxLength), dtype=np.int64)
+        Found = np.zeros(piRNANum, dtype=bool)
+        Key = self.TargetKey(Sequence)
+        Rows = {}
+        for piRNASeq, Result in self.Connection.execute("SELECT piRNASeq, Result FROM Pairs WHERE TargetKey = ?", (Key,)):
+            piIndex = self.UniqueIndex.get(piRNASeq)
+            if piIndex is not None:
+                Rows.setdefault(len(piRNASeq), ([], []))
+                Rows[len(piRNASeq)][0].append(piIndex)
+                Rows[len(piRNASeq)][1].append(Result)
+        for piRNALength, (Index, Results) in Rows.items():
+            Data = np.frombuffer(b"".join(Results), dtype=np.int32).reshape(len(Index), 12 + 3 * piRNALength)
+            Starts[Index] = Data[:, 0:3]
+            Ends[Index] = Data[:, 3:6]
+            Scores[Index] = Data[:, 6:9]
+            BinPos[Index] = Data[:, 9:12]
+            Patterns[Index, :, :piRNALength] = Data[:, 12:].reshape(len(Index), 3, piRNALength)
+            Found[Index] = True
+        if len(Rows) > 0:
+            self.Connection.execute("UPDATE Pairs SET LastUsed = ? WHERE TargetKey = ?", (time.time(), Key))
+        if Panel.HasDuplicates:
+            Starts = Starts[Panel.Representatives]
+            Ends = Ends[Panel.Representatives]
+            Scores = Scores[Panel.Representatives]
+            BinPos = BinPos[Panel.Representatives]
+            Patterns = Patterns[Panel.Representatives]
+            Found = Found[Panel.Representatives]
+        Cached = SequencesAligner.PanelPairing(None, Sequence, len(Sequence), Starts, Ends, Scores, BinPos, Patterns)
+        return Found, Cached
+
+    #Fill the rows of PanelResult (aligned for the piRNAs not Found) with the Cached results, and store the new pairs.
+    #The pairs skipped by the seed index (Pruned) have not been aligned, so they are not stored.
+    def Merge(self, PanelResult, Found, Cached):
+        Panel = self.Panel
+        for Name in ("Starts", "Ends", "Scores", "BinPos", "Patterns"):
+            getattr(PanelResult, Name)[Found] = getattr(Cached, Name)[Found]
+        New = Panel.Unique[~Found[Panel.Unique]]
+        self.Reused = self.Reused + len(Panel.Unique) - len(New)
+        if PanelResult.Pruned is not None:
+            New = New[~PanelResult.Pruned[New]]
+        self.Aligned = self.Aligned + len(New)
+        Key = self.TargetKey(Cached.TargetSeq)
+        Now = time.time()
+        Records = []
+        for piRNALength in np.unique(Panel.Lengths[New]).tolist():
+            Index = New[Panel.Lengths[New] == piRNALength]
+            Data = np.concatenate([PanelResult.Starts[Index], PanelResult.Ends[Index], PanelResult.Scores[Index], \
+                                   PanelResult.BinPos[Index], \
+                                   PanelResult.Patterns[Index, :, :piRNALength].reshape(len(Index), -1)], axis=1)
+            Records += [(Key, Panel.Sequences[piIndex], Row.tobytes(), Now) \
+                        for piIndex, Row in zip(Index.tolist(), Data.astype(np.int32))]
+        if len(Records) > 0:
+            self.Connection.executemany("INSERT OR REPLACE INTO Pairs VALUES (?, ?, ?, ?)", Records)
+            self.Size = self.Size + sum(len(Record[2]) for Record in Records)
+        self.Uncommitted = self.Uncommitted + 1
+        if self.Uncommitted >= CommitInterval:
+            self.Evict()
+            self.Connection.commit()
+            self.Uncommitted = 0
+
+    #Remove the least recently used targets until the stored results fit in the size limit. It runs at every commit of
+    # Merge, so the limit holds during the run too. Freed pages are reused by SQLite, the file itself does not shrink.
+    def Evict(self):
+        if self.Size <= self.SizeLimit:
+            return 0
+        Keys = []
+        for Key, KeySize in self.Connection.execute("SELECT TargetKey, SUM(LENGTH(Result)) FROM Pairs " + \
+                                                    "GROUP BY TargetKey ORDER BY MAX(LastUsed)").fetchall():
+            if self.Size <= self.SizeLimit:
+                break
+            Keys.append((Key,))
+            self.Size = self.Size - KeySize
+        self.Connection.executemany("DELETE FROM Pairs WHERE TargetKey = ?", Keys)
+        self.Evicted = self.Evicted + len(Keys)
+        return len(Keys)
+
+    def Close(self):
+        self.Evict()
+        self.Connection.commit()
+        self.Connection.close()
+        print(">>> Alignment cache " + self.File + ": " + str(self.Reused) + " pairs reused, " + str(self.Aligned) + \
+              " pairs aligned, " + str(self.Evicted) + " targets evicted")
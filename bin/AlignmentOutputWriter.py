@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+"""
+AlignmentOutputWriter.py
+This script is a part of piTargetClassifier project.
+This script formats the alignment results and writes the *Alignment.txt and *AlignmentPattern.txt files, and the
+ *Hits.txt file when hits are reported (see SequencesAligner.HitsSelector).
+The 4 files of a RNA set are opened once and kept open (buffered) for the whole run, and all the records of
+ one RNA are formatted and written in bulk. Optionally, the writing is done by a background thread.
+Requied packages: numpy
+Yu Sun, ysun43@ur.rochester.edu, 2018-11
+"""
+
+import os
+import queue
+import threading
+import numpy as np
+
+#Buffer size of each output file, and the number of pending writes allowed for the background writer.
+WriterBufferSize = 1 << 20
+WriterQueueSize = 64
+#The 4 output files of a RNA set
+OutputFilesSuffixes = (".BestAlignment.txt", ".BestAlignmentPattern.txt", ".AllAlignment.txt", ".AllAlignmentPattern.txt")
+#The optional 5th file, with the hits of each pair
+HitsFileSuffix = ".Hits.txt"
+
+#This function converts a (n x m) array of raw matching scores into n scoring strings, and n matching strings.
+#Non-positive scores are written as '0' (no matching, ' ' in the matching string).
+def PatternStringsGenerator(Patterns):
+    Positive = Patterns > 0
+    Clipped = np.where(Positive, Patterns, 0)
+    Matchings = np.where(Positive, 124, 32).astype(np.uint8)   # '|' or ' '
+    if Clipped.shape[0] == 0 or Clipped.shape[1] == 0:
+        return [""] * Clipped.shape[0], [""] * Clipped.shape[0]
+    MatchingStrings = [Row.tobytes().decode() for Row in Matchings]
+    if Clipped.max() < 10:
+        ScoringStrings = [Row.tobytes().decode() for Row in (Clipped + 48).astype(np.uint8)]
+    else:
+        ScoringStrings = ["".join(str(Score) for Score in Row) for Row in Clipped.tolist()]
+    return ScoringStrings, MatchingStrings
+
+#This function formats one alignment record of the *Alignment.txt file.
+#TargetWindow is the aligned part of the target, padded with 'E' for partial matching.
+def AlignmentRecordFormatter(TargetName, TargetWindow, piRNAName, piRNASeq, piRNALength, TopID, Start, End, Score, \
+                             ScoringString, MatchingString):
+    return "Target RNA: " + TargetName + "; " + str(Start + 1) + " - " + str(End + 1) + "\n" + \
+           TargetWindow + "\n" + MatchingString + "\n" + piRNASeq + "\n" + ScoringString + "\n" + \
+           "piRNA: " + piRNAName + "; " + str(piRNALength) + " - 1 ; m" + str(TopID) + ", Score: " + str(Score) + "\n\n"
+
+#This function formats one record of the *AlignmentPattern.txt file. The pattern is in piRNA 5'->3' direction.
+def PatternRecordFormatter(TargetName, piRNAName, TopID, ScoringString, BinPos):
+    return TargetName + "\t" + piRNAName + "\t" + "m" + str(TopID) + "\t" + ScoringString[::-1] + "\t" + str(BinPos) + "\n"
+
+#This function formats one record of the *Hits.txt file: the rank of the hit, its 1 based positions on the target, its
+# score and its pattern (piRNA 5'->3' direction).
+def HitRecordFormatter(TargetName, piRNAName, HitID, Start, End, Score, ScoringString):
+    return TargetName + "\t" + piRNAName + "\t" + "h" + str(HitID) + "\t" + str(Start + 1) + "\t" + str(End + 1) + "\t" + \
+           str(Score) + "\t" + ScoringString[::-1] + "\n"
+
+#This function formats the *Hits.txt records of one RNA (the PanelHits of a SequencesAligner.PanelPairing object).
+def PanelHitsFormatter(PanelResult, Panel, Reported=None):
+    Hits = PanelResult.Hits
+    piRNANum, HitNum = Hits.Valid.shape
+    ScoringStrings = PatternStringsGenerator(Hits.Patterns.reshape(piRNANum * HitNum, -1))[0]
+    Valid = Hits.Valid if Reported is None else Hits.Valid & Reported[:, None]
+    Starts = Hits.Starts.tolist()
+    Ends = Hits.Ends.tolist()
+    Scores = Hits.Scores.tolist()
+    Lengths = Panel.Lengths.tolist()
+    Records = []
+    for piIndex, HitIndex in zip(*np.nonzero(Valid)):
+        Records.append(HitRecordFormatter(PanelResult.TargetName, Panel.Names[piIndex], HitIndex + 1, \
+                                          Starts[piIndex][HitIndex], Ends[piIndex][HitIndex], Scores[piIndex][HitIndex], \
+                                          ScoringStrings[piIndex * HitNum + HitIndex][:Lengths[piIndex]]))
+    return "".join(Records)
+
+#This function returns the part of the target aligned from Start to End (0-based, inclusive), padded with 'E' where
+# the alignment goes beyond the target, without building a padded copy of the whole target.
+def TargetWindowFormatter(TargetSeq, Start, End):
+    TargetLength = len(TargetSeq)
+    return "E" * max(0, -Start) + TargetSeq[max(Start, 0):min(End + 1, TargetLength)] + "E" * max(0, End + 1 - TargetLength)
+
+#This function formats all the records of one RNA (a SequencesAligner.PanelPairing object against a piRNAPanel).
+#Returns the texts of the Best alignment, Best pattern, All alignment and All pattern files.
+#If Reported (a boolean mask of the piRNAs, see SequencesAligner.PanelPairingReported) is given, only these are written.
+def PanelPairingFormatter(PanelResult, Panel, Reported=None):
+    piRNANum = len(Panel.Names)
+    TopNum = PanelResult.Starts.shape[1]
+    ScoringStrings, MatchingStrings = PatternStringsGenerator(PanelResult.Patterns.reshape(piRNANum * TopNum, -1))
+    Starts = PanelResult.Starts.tolist()
+    Ends = PanelResult.Ends.tolist()
+    Scores = PanelResult.Scores.tolist()
+    BinPos = PanelResult.BinPos.tolist()
+    Lengths = Panel.Lengths.tolist()
+    Reported = [True] * piRNANum if Reported is None else Reported.tolist()
+    BestAln = []
+    BestPattern = []
+    AllAln = []
+    AllPattern = []
+    for piIndex in range(piRNANum):
+        if Reported[piIndex] == False:
+            continue
+        piRNALength = Lengths[piIndex]
+        for TopIndex in range(TopNum):
+            Row = piIndex * TopNum + TopIndex
+            Start = Starts[piIndex][TopIndex]
+            End = Ends[piIndex][TopIndex]
+            ScoringString = ScoringStrings[Row][:piRNALength]
+            AlnRecord = AlignmentRecordFormatter(PanelResult.TargetName, \
+                                                 TargetWindowFormatter(PanelResult.TargetSeq, Start, End), \
+                                                 Panel.Names[piIndex], Panel.Sequences[piIndex], piRNALength, TopIndex + 1, \
+                                                 Start, End, Scores[piIndex][TopIndex], ScoringString, \
+                                                 MatchingStrings[Row][:piRNALength])
+            PatternRecord = PatternRecordFormatter(PanelResult.TargetName, Panel.Names[piIndex], TopIndex + 1, \
+                                                   ScoringString, BinPos[piIndex][TopIndex])
+            if TopIndex == 0:
+                BestAln.append(AlnRecord)
+                BestPattern.append(PatternRecord)
+            AllAln.append(AlnRecord)
+            AllPattern.append(PatternRecord)
+    return "".join(BestAln), "".join(BestPattern), "".join(AllAln), "".join(AllPattern)
+
+#This class keeps the 4 output files of a RNA set open: Best alignment, Best pattern, All alignment and All pattern,
+# and the Hits file with Hits=True.
+#Files are opened in append mode, the same as before (OutputAlignFilesFlusher cleans them up first).
+#With BackgroundWriter=True, texts are queued and written by a separate thread, so that the formatting and the disk
+# I/O overlap with the alignment. Close() must be called to flush everything.
+class AlignmentOutputSink:
+    def __init__(self, OutputFilePrefix, BackgroundWriter=False, Hits=False):
+        self.Files = [open(OutputFilePrefix + Suffix, "a", buffering=WriterBufferSize) for Suffix in OutputFilesSuffixes]
+        if Hits == True:
+            self.Files.append(open(OutputFilePrefix + HitsFileSuffix, "a", buffering=WriterBufferSize))
+        self.Queue = None
+        self.Thread = None
+        self.Error = None
+        if BackgroundWriter == True:
+            self.Queue = queue.Queue(maxsize=WriterQueueSize)
+            self.Thread = threading.Thread(target=self.BackgroundWriterLoop, daemon=True)
+            self.Thread.start()
+
+    def BackgroundWriterLoop(self):
+        while True:
+            Texts = self.Queue.get()
+            if Texts is None:
+                self.Queue.task_done()
+                break
+            if self.Error is None:
+                try:
+                    self.WriteTexts(Texts)
+                except Exception as Error:
+                    self.Error = Error
+            self.Queue.task_done()
+
+    def WriteTexts(self, Texts):
+        for File, Text in zip(self.Files, Texts):
+            File.write(Text)
+
+    #Write all the records of one RNA (a SequencesAligner.PanelPairing object)
+    def WritePanelPairing(self, PanelResult, Panel, Reported=None):
+        Texts = PanelPairingFormatter(PanelResult, Panel, Reported)
+        if PanelResult.Hits is not None:
+            Texts = Texts + (PanelHitsFormatter(PanelResult, Panel, Reported),)
+        if self.Queue is None:
+            self.WriteTexts(Texts)
+        else:
+            if self.Error is not None:
+                raise self.Error
+            self.Queue.put(Texts)
+
+    #Write everything queued so far to the files (and to the disk with Sync=True), e.g. before a checkpoint
+    def Flush(self, Sync=False):
+        if self.Queue is not None:
+            self.Queue.join()
+        if self.Error is not None:
+            raise self.Error
+        for File in self.Files:
+            File.flush()
+            if Sync == True:
+                os.fsync(File.fileno())
+
+    #Sizes of the files, only meaningful after Flush()
+    def Offsets(self):
+        return [File.tell() for File in self.Files]
+
+    def Close(self):
+        if self.Thread is not None:
+            self.Queue.put(None)
+            self.Thread.join()
+            self.Thread = None
+        for File in self.Files:
+            File.close()
+        if self.Error is not None:
+            raise self.Error
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+"""
+AlignmentResultStore.py
+This script is a part of piTargetClassifier project.
+This script contains the AlignmentResultStore class, which stores the top 3 alignments of all piRNA-RNA pairs as
+ typed numpy arrays (one row per pair), instead of a numpy object matrix of Pairing objects.
+Pairs are stored RNA by RNA: the pair of RNA i and piRNA j is the row i * piRNA number + j.
+Requied packages: numpy
+Yu Sun, ysun43@ur.rochester.edu, 2018-11
+"""
+
+import numpy as np
+from bin import SequencesAligner
+
+#This function picks the smallest dtype that holds every raw matching score of the weights table.
+def PatternDtypeSelector(WeightsTable):
+    if WeightsTable.min() >= 0 and WeightsTable.max() <= 255:
+        return np.uint8
+    else:
+        return np.int32
+
+#This class stores the alignment results of RNANum RNAs against a SequencesAligner.piRNAPanel.
+#TargetNames and piRNANames are the shared name tables; TargetIndex and piRNAIndex map each pair to them.
+#Starts, Ends and Scores are (pairs x TopNum) int32 arrays, BinPos is (pairs x TopNum) uint8, and Patterns is a
+# (pairs x TopNum x MaxLength) array in the reversed piRNA direction (as Matching*_Pattern of Pairing objects).
+#Reported marks the pairs reaching the minimum score, if any (see SequencesAligner.PanelPairingReported).
+class AlignmentResultStore:
+    def __init__(self, RNANum, Panel, PatternDtype=np.uint8, TopNum=3):
+        piRNANum = len(Panel.Names)
+        PairNum = RNANum * piRNANum
+        self.shape = (RNANum, piRNANum)
+        self.TopNum = TopNum
+        self.TargetNames = [None] * RNANum
+        self.TargetLengths = np.zeros(RNANum, dtype=np.int32)
+        self.piRNANames = Panel.Names
+        self.piRNASeqs = Panel.Sequences
+        self.piRNALengths = Panel.Lengths.astype(np.int32)
+        self.TargetIndex = np.repeat(np.arange(RNANum, dtype=np.int32), piRNANum)
+        self.piRNAIndex = np.tile(np.arange(piRNANum, dtype=np.int32), RNANum)
+        self.Starts = np.zeros((PairNum, TopNum), dtype=np.int32)
+        self.Ends = np.zeros((PairNum, TopNum), dtype=np.int32)
+        self.Scores = np.zeros((PairNum, TopNum), dtype=np.int32)
+        self.BinPos = np.zeros((PairNum, TopNum), dtype=np.uint8)
+        self.Patterns = np.zeros((PairNum, TopNum, Panel.MaxLength), dtype=PatternDtype)
+        self.Reported = np.ones(PairNum, dtype=bool)
+
+    #Store the SequencesAligner.PanelPairing object of the RNA rnaIndex
+    def AddPanelPairing(self, rnaIndex, PanelResult):
+        piRNANum = self.shape[1]
+        Rows = slice(rnaIndex * piRNANum, (rnaIndex + 1) * piRNANum)
+        self.TargetNames[rnaIndex] = PanelResult.TargetName
+        self.TargetLengths[rnaIndex] = PanelResult.TargetLength
+        self.Starts[Rows] = PanelResult.Starts
+        self.Ends[Rows] = PanelResult.Ends
+        self.Scores[Rows] = PanelResult.Scores
+        self.BinPos[Rows] = PanelResult.BinPos
+        self.Patterns[Rows] = PanelResult.Patterns
+        Reported = SequencesAligner.PanelPairingReported(PanelResult)
+        if Reported is not None:
+            self.Reported[Rows] = Reported
+
+    #Patterns of the best (top 1) alignments, one row per pair
+    def BestPatterns(self):
+        return self.Patterns[:, 0, :]
+
+    #Patterns of all alignments, top 1, 2, 3 of the first pair, then of the second pair, etc.
+    def AllPatterns(self):
+        return self.Patterns.reshape(-1, self.Patterns.shape[2])
+
+    #Features of the classifier (see MachineLearningDataParser), the same as parsed from the *AlignmentPattern.txt files:
+    # the patterns of the reported pairs, in piRNA 5'->3' direction, non-positive weights as 0. Mode is "Best" or "All".
+    #This needs piRNAs of the same length, and single digit weights.
+    def Features(self, Mode):
+        if len(np.unique(self.piRNALengths)) > 1 or self.Patterns.max(initial=0) > 9:
+            raise ValueError("The features need piRNAs of the same length and single digit weights")
+        Patterns = self.Patterns[self.Reported]
+        if Mode == "Best":
+            Patterns = Patterns[:, :1, :]
+        return np.clip(Patterns, 0, None)[:, :, ::-1].reshape(-1, Patterns.shape[2]).astype(np.uint8)
+
+    def BestBinPos(self):
+        return self.BinPos[:, 0]
+
+    def AllBinPos(self):
+        return self.BinPos.reshape(-1)
+
+    #Rebuild the Pairing object of one pair. The target sequence is not stored, so TargetSeq is None.
+    def GetPairing(self, rnaIndex, piIndex):
+        Pair = rnaIndex * self.shape[1] + piIndex
+        piRNALength = int(self.piRNALengths[piIndex])
+        TopResults = []
+        for TopID in range(self.TopNum):
+            TopResults += [int(self.Starts[Pair, TopID]), int(self.Ends[Pair, TopID]), \
+                           self.Patterns[Pair, TopID, :piRNALength].tolist(), int(self.Scores[Pair, TopID]), \
+                           int(self.BinPos[Pair, TopID])]
+        return SequencesAligner.Pairing(self.TargetNames[rnaIndex], None, int(self.TargetLengths[rnaIndex]), \
+                                        self.piRNANames[piIndex], self.piRNASeqs[piIndex], piRNALength, *TopResults)
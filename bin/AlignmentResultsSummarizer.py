@@ -3,19 +3,24 @@
 """
 AlignmentResultsSummarizer.py
 This script is a part of piTargetClassifier project.
-This script takes the output from ObjectsMatrixGenerator (an object matrix) and provides a summary.
+This script takes the output from ObjectsMatrixGenerator (an AlignmentResultStore, or an object matrix of Pairing
+ objects) and provides a summary.
+The AlignmentSummaryAccumulator class builds the same summary incrementally, from batches of alignments, so that the
+ patterns of all pairings never need to be in memory at once.
 Requied packages: numpy
 Yu Sun, ysun43@ur.rochester.edu, 2018-11
 """
 
 import numpy as np
+from bin import AlignmentResultStore
 
 #This class provides a summary of alignment results.
 class AlignmentSummary:
     def __init__(self, AlignBestPatterns, AlignBestPatternsSum, AlignBestPatternsAve, \
                  AlignBestScores, AlignBestScoresFreqDict, AlignBestMatchings, AlignBestMatchingsSum, AlignBestMatchingsAve, AlignBestPosList, \
                  AlignAllPatterns, AlignAllPatternsSum, AlignAllPatternsAve, \
-                 AlignAllScores, AlignAllScoresFreqDict, AlignAllMatchings, AlignAllMatchingsSum, AlignAllMatchingsAve, AlignAllPosList):
+                 AlignAllScores, AlignAllScoresFreqDict, AlignAllMatchings, AlignAllMatchingsSum, AlignAllMatchingsAve, AlignAllPosList, \
+                 AlignBestPosFreqDict=None, AlignAllPosFreqDict=None):
         self.AlignBestPatterns = AlignBestPatterns
         self.AlignBestPatternsSum = AlignBestPatternsSum
         self.AlignBestPatternsAve=AlignBestPatternsAve
@@ -34,56 +39,143 @@ class AlignmentSummary:
         self.AlignAllMatchingsSum=AlignAllMatchingsSum
         self.AlignAllMatchingsAve=AlignAllMatchingsAve
         self.AlignAllPosList=AlignAllPosList
+        self.AlignBestPosFreqDict=AlignBestPosFreqDict
+        self.AlignAllPosFreqDict=AlignAllPosFreqDict
 
 #This function gets the best matching (rather than pattern) from an numpy pattern array.
 #It will change all non-zero values to 1, and keeps all zero values.
 def GetMatching(Array):
-    list = []
-    for i in Array:
-        rows = []
-        for j in i:
-            if j != 0:
-                z = 1
-            else:
-                z = 0
-            rows.append(z)
-        list.append(rows)
-    return np.array(list)
+    return (np.asarray(Array) != 0).astype(np.int64)
+
+#This function counts the occurrences of each value of an integer array, and returns a {value: count} dictionary.
+def GetFreqDict(Array):
+    Values, Counts = np.unique(np.asarray(Array), return_counts=True)
+    return dict(zip(Values.tolist(), Counts.tolist()))
+
+#This class accumulates the summary of a stream of patterns: number of patterns, sums of weights and matchings
+# per position, the frequency of each score and of each binned position on the target RNA.
+class PatternsAccumulator:
+    def __init__(self):
+        self.Num = 0
+        self.PatternsSum = None
+        self.MatchingsSum = None
+        self.ScoresFreqDict = {}
+        self.PosCounts = np.zeros(100, dtype=np.int64)
+
+    #Patterns is a (n x m) array, BinPos a length n array
+    def Update(self, Patterns, BinPos):
+        if Patterns.shape[0] == 0:
+            return
+        if self.PatternsSum is None:
+            self.PatternsSum = np.zeros(Patterns.shape[1], dtype=np.int64)
+            self.MatchingsSum = np.zeros(Patterns.shape[1], dtype=np.int64)
+        self.Num = self.Num + Patterns.shape[0]
+        self.PatternsSum += np.sum(Patterns, axis=0, dtype=np.int64)
+        self.MatchingsSum += np.count_nonzero(Patterns, axis=0)
+        for Score, Count in GetFreqDict(np.sum(Patterns, axis=1, dtype=np.int64)).items():
+            self.ScoresFreqDict[Score] = self.ScoresFreqDict.get(Score, 0) + Count
+        PosCounts = np.bincount(np.asarray(BinPos, dtype=np.int64), minlength=100)
+        if PosCounts.shape[0] > self.PosCounts.shape[0]:
+            PosCounts[:self.PosCounts.shape[0]] += self.PosCounts
+            self.PosCounts = PosCounts
+        else:
+            self.PosCounts[:PosCounts.shape[0]] += PosCounts
+
+    #The state of the accumulator as a JSON-compatible dictionary, e.g. for AlignCheckpoint
+    def State(self):
+        return {"Num": self.Num, \
+                "PatternsSum": None if self.PatternsSum is None else self.PatternsSum.tolist(), \
+                "MatchingsSum": None if self.MatchingsSum is None else self.MatchingsSum.tolist(), \
+                "ScoresFreqDict": [[Score, Count] for Score, Count in self.ScoresFreqDict.items()], \
+                "PosCounts": self.PosCounts.tolist()}
+
+    def LoadState(self, State):
+        self.Num = State["Num"]
+        self.PatternsSum = None if State["PatternsSum"] is None else np.array(State["PatternsSum"], dtype=np.int64)
+        self.MatchingsSum = None if State["MatchingsSum"] is None else np.array(State["MatchingsSum"], dtype=np.int64)
+        self.ScoresFreqDict = {Score: Count for Score, Count in State["ScoresFreqDict"]}
+        self.PosCounts = np.array(State["PosCounts"], dtype=np.int64)
+
+    def PosFreqDict(self):
+        Pos = np.flatnonzero(self.PosCounts)
+        return dict(zip(Pos.tolist(), self.PosCounts[Pos].tolist()))
+
+#This class accumulates the summary of the best and all alignments, from batches of alignments.
+#Update() takes a (pairs x 3 x m) pattern array and a (pairs x 3) binned position array, e.g. the Patterns and BinPos
+# of a SequencesAligner.PanelPairing object. Summary() returns an AlignmentSummary object, with the same sums,
+# averages and frequencies as SummairzeObjectsMatrix; the per-pairing lists and arrays are not kept (None).
+class AlignmentSummaryAccumulator:
+    def __init__(self):
+        self.Best = PatternsAccumulator()
+        self.All = PatternsAccumulator()
+
+    def Update(self, Patterns, BinPos):
+        self.Best.Update(Patterns[:, 0, :], BinPos[:, 0])
+        self.All.Update(Patterns.reshape(-1, Patterns.shape[2]), BinPos.reshape(-1))
+
+    def State(self):
+        return {"Best": self.Best.State(), "All": self.All.State()}
+
+    def LoadState(self, State):
+        self.Best.LoadState(State["Best"])
+        self.All.LoadState(State["All"])
+
+    #Update from an AlignmentResultStore, BatchSize pairs at a time
+    def UpdateFromResultStore(self, Store, BatchSize=65536):
+        for Start in range(0, Store.Patterns.shape[0], BatchSize):
+            self.Update(Store.Patterns[Start:Start + BatchSize], Store.BinPos[Start:Start + BatchSize])
+
+    def Summary(self):
+        Results = []
+        for Acc in (self.Best, self.All):
+            if Acc.Num == 0:
+                Results += [None, [], [], None, {}, None, [], [], None]
+                continue
+            Results += [None, Acc.PatternsSum.tolist(), (Acc.PatternsSum / Acc.Num).tolist(), None, dict(Acc.ScoresFreqDict), \
+                        None, Acc.MatchingsSum.tolist(), (Acc.MatchingsSum / Acc.Num).tolist(), None]
+        return AlignmentSummary(*Results, AlignBestPosFreqDict=self.Best.PosFreqDict(), AlignAllPosFreqDict=self.All.PosFreqDict())
 
 #This function provides a summary of piRNA-RNA alignment object matrix, by reporting the sum, ave, scores of all pairings
+#The input is either an AlignmentResultStore, which already holds the patterns as arrays, or an object matrix.
 def SummairzeObjectsMatrix(Matrix):
-    AlignBestPatternsList = []
-    AlignAllPatternsList = []
-    AlignBestPosList=[]
-    AlignAllPosList=[]
-    for i in range(Matrix.shape[0]):
-        for j in range(Matrix.shape[1]):
-            CurrObj = Matrix[i, j]
-            #print(CurrObj.TargetName, CurrObj.piRNAName)
-            #print(CurrObj.Matching1_Pattern, CurrObj.Matching1_Score)
-            AlignBestPatternsList.append(CurrObj.Matching1_Pattern)  # Append to list, and finally convert to array
-            AlignAllPatternsList.append(CurrObj.Matching1_Pattern)
-            AlignAllPatternsList.append(CurrObj.Matching2_Pattern)
-            AlignAllPatternsList.append(CurrObj.Matching3_Pattern)
-            AlignBestPosList.append(CurrObj.Matching1_BinPos)
-            AlignAllPosList.append(CurrObj.Matching1_BinPos)
-            AlignAllPosList.append(CurrObj.Matching2_BinPos)
-            AlignAllPosList.append(CurrObj.Matching3_BinPos)
-    AlignBestPatterns = np.array(AlignBestPatternsList)  # Convert to numpy array
-    AlignBestPatternsSum = np.sum(AlignBestPatterns, axis=0).tolist()
+    if isinstance(Matrix, AlignmentResultStore.AlignmentResultStore):
+        AlignBestPatterns = Matrix.BestPatterns()
+        AlignAllPatternsList = Matrix.AllPatterns()
+        AlignBestPosList = Matrix.BestBinPos().tolist()
+        AlignAllPosList = Matrix.AllBinPos().tolist()
+    else:
+        AlignBestPatternsList = []
+        AlignAllPatternsList = []
+        AlignBestPosList=[]
+        AlignAllPosList=[]
+        for i in range(Matrix.shape[0]):
+            for j in range(Matrix.shape[1]):
+                CurrObj = Matrix[i, j]
+                #print(CurrObj.TargetName, CurrObj.piRNAName)
+                #print(CurrObj.Matching1_Pattern, CurrObj.Matching1_Score)
+                AlignBestPatternsList.append(CurrObj.Matching1_Pattern)  # Append to list, and finally convert to array
+                AlignAllPatternsList.append(CurrObj.Matching1_Pattern)
+                AlignAllPatternsList.append(CurrObj.Matching2_Pattern)
+                AlignAllPatternsList.append(CurrObj.Matching3_Pattern)
+                AlignBestPosList.append(CurrObj.Matching1_BinPos)
+                AlignAllPosList.append(CurrObj.Matching1_BinPos)
+                AlignAllPosList.append(CurrObj.Matching2_BinPos)
+                AlignAllPosList.append(CurrObj.Matching3_BinPos)
+        AlignBestPatterns = np.array(AlignBestPatternsList)  # Convert to numpy array
+    AlignBestPatternsSum = np.sum(AlignBestPatterns, axis=0, dtype=np.int64).tolist()
     AlignBestPatternsAve = np.mean(AlignBestPatterns, axis=0).tolist()
-    AlignBestScores = np.sum(AlignBestPatterns, axis=1).tolist()
-    AlignBestScoresFreqDict = {item: AlignBestScores.count(item) for item in set(AlignBestScores)}
+    AlignBestScores = np.sum(AlignBestPatterns, axis=1, dtype=np.int64).tolist()
+    AlignBestScoresFreqDict = GetFreqDict(AlignBestScores)
 
     AlignBestMatchings = GetMatching(AlignBestPatterns)
     AlignBestMatchingsSum = np.sum(AlignBestMatchings, axis=0).tolist()
     AlignBestMatchingsAve = np.mean(AlignBestMatchings, axis=0).tolist()
 
-    AlignAllPatterns = np.array(AlignAllPatternsList)  # Convert to numpy array
-    AlignAllPatternsSum = np.sum(AlignAllPatternsList, axis=0).tolist()
-    AlignAllPatternsAve = np.mean(AlignAllPatternsList, axis=0).tolist()
-    AlignAllScores = np.sum(AlignAllPatternsList, axis=1).tolist()
-    AlignAllScoresFreqDict = {item: AlignAllScores.count(item) for item in set(AlignAllScores)}
+    AlignAllPatterns = np.asarray(AlignAllPatternsList)  # Convert to numpy array
+    AlignAllPatternsSum = np.sum(AlignAllPatterns, axis=0, dtype=np.int64).tolist()
+    AlignAllPatternsAve = np.mean(AlignAllPatterns, axis=0).tolist()
+    AlignAllScores = np.sum(AlignAllPatterns, axis=1, dtype=np.int64).tolist()
+    AlignAllScoresFreqDict = GetFreqDict(AlignAllScores)
 
     AlignAllMatchings = GetMatching(AlignAllPatterns)
     AlignAllMatchingsSum = np.sum(AlignAllMatchings, axis=0).tolist()
@@ -92,5 +184,6 @@ def SummairzeObjectsMatrix(Matrix):
     Results=AlignmentSummary(AlignBestPatterns,AlignBestPatternsSum,AlignBestPatternsAve,AlignBestScores,AlignBestScoresFreqDict, \
                              AlignBestMatchings, AlignBestMatchingsSum, AlignBestMatchingsAve, AlignBestPosList, \
                              AlignAllPatterns,AlignAllPatternsSum,AlignAllPatternsAve,AlignAllScores,AlignAllScoresFreqDict, \
-                             AlignAllMatchings, AlignAllMatchingsSum, AlignAllMatchingsAve, AlignAllPosList)
+                             AlignAllMatchings, AlignAllMatchingsSum, AlignAllMatchingsAve, AlignAllPosList, \
+                             AlignBestPosFreqDict=GetFreqDict(AlignBestPosList), AlignAllPosFreqDict=GetFreqDict(AlignAllPosList))
     return Results
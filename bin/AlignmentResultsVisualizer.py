@@ -4,119 +4,188 @@
 AlignmentResultsVisualizer.py
 This script is a part of piTargetClassifier project.
 This script takes the summarized output, and performs paired visualization between piRNA-Target, piRNA-Control.
-After running VisualizePairedSummary(), you will get 10 paired plots.
-Requied packages: numpy, matplotlib
+After running VisualizePairedSummary(), you will get 12 paired plots (or one PDF of 12 pages).
+Requied packages: numpy, matplotlib (only imported when the figures are drawn)
 Yu Sun, ysun43@ur.rochester.edu, 2018-11
 """
 
+import os
+import json
+import pickle
+import hashlib
+import collections
 import numpy as np
-import matplotlib.pyplot as plt
-plt.switch_backend('agg')  #This is required for Linux system to plot figures (MacOS doesn't require)
+from concurrent.futures import ProcessPoolExecutor
 from bin import MultiSequencesAligner
 
+#The histogram data can be a list of values, or a {value: count} frequency dictionary (from the summary).
+#This function returns the values and the weights to pass to plt.hist.
+def HistogramInputs(Data):
+    if isinstance(Data, dict):
+        return list(Data.keys()), list(Data.values())
+    else:
+        return Data, None
+
 #Plot paired histograms
-def PairedPlotHist(Left, Right, Types, Label, OutputPDFName):
-    plt.figure(figsize=(16, 9))
-    x1=plt.subplot(1, 2, 1)
-    plt.hist(Left)
-    plt.xlabel("Scores")
-    plt.ylabel("piRNA : Control RNA, " + Label)
-    plt.title("piRNA: Control RNA")
-
-    plt.subplot(1, 2, 2, sharey=x1)
-    plt.hist(Right)
-    plt.xlabel("Scores")
-    plt.ylabel("piRNA : Target RNA, " + Label)
-    plt.suptitle(Types + ", " + Label)
-    plt.title("piRNA: Target RNA")
-    plt.savefig(OutputPDFName)
+def PairedPlotHist(Figure, Left, Right, Types, Label):
+    x1 = Figure.add_subplot(1, 2, 1)
+    Values, Weights = HistogramInputs(Left)
+    x1.hist(Values, weights=Weights)
+    x1.set_xlabel("Scores")
+    x1.set_ylabel("piRNA : Control RNA, " + Label)
+    x1.set_title("piRNA: Control RNA")
+
+    x2 = Figure.add_subplot(1, 2, 2, sharey=x1)
+    Values, Weights = HistogramInputs(Right)
+    x2.hist(Values, weights=Weights)
+    x2.set_xlabel("Scores")
+    x2.set_ylabel("piRNA : Target RNA, " + Label)
+    Figure.suptitle(Types + ", " + Label)
+    x2.set_title("piRNA: Target RNA")
 
 #Plot paired barplots
-def PairedPlot(Left, Right, Types, Label, OutputPDFName):
-    plt.figure(figsize=(16, 9))
-    #plt.title(Types+","+Label)
-    x1=plt.subplot(1, 2, 1)
-    plt.bar(np.arange(len(Left)), Left)
-    plt.xticks(np.arange(len(Left)),range(1, len(Left) + 1))
-    plt.xlabel("Positions")
-    plt.ylabel("piRNA : Control RNA, "+Label)
-    plt.title("piRNA: Control RNA")
-
-    plt.subplot(1, 2, 2, sharey=x1)
-    plt.bar(np.arange(len(Right)), Right)
-    plt.xticks(np.arange(len(Right)),range(1, len(Right) + 1))
-    plt.xlabel("Positions")
-    plt.ylabel("piRNA : Target RNA, " + Label)
-    plt.title("piRNA: Target RNA")
-    plt.suptitle(Types + ", " + Label)
-    plt.savefig(OutputPDFName)
-
-def PairedPlotPosHist(Left, Right, Types, Label, OutputPDFName):
-    plt.figure(figsize=(16, 9))
-    x1=plt.subplot(2, 1, 1)
-    plt.hist(Left, bins=100)
-    plt.xlabel("Positions on mRNA (binned length 1 - 100)")
-    plt.ylabel("Counts, " + Label)
-    plt.title("piRNA: Control RNA")
-
-    plt.subplot(2, 1, 2, sharex=x1)
-    plt.hist(Right, bins=100)
-    plt.xlabel("Positions on mRNA (binned length 1 - 100)")
-    plt.ylabel("Counts, " + Label)
-    plt.suptitle(Types + ", " + Label)
-    plt.title("piRNA: Target RNA")
-    plt.savefig(OutputPDFName)
+def PairedPlot(Figure, Left, Right, Types, Label):
+    x1 = Figure.add_subplot(1, 2, 1)
+    x1.bar(np.arange(len(Left)), Left)
+    x1.set_xticks(np.arange(len(Left)), range(1, len(Left) + 1))
+    x1.set_xlabel("Positions")
+    x1.set_ylabel("piRNA : Control RNA, "+Label)
+    x1.set_title("piRNA: Control RNA")
+
+    x2 = Figure.add_subplot(1, 2, 2, sharey=x1)
+    x2.bar(np.arange(len(Right)), Right)
+    x2.set_xticks(np.arange(len(Right)), range(1, len(Right) + 1))
+    x2.set_xlabel("Positions")
+    x2.set_ylabel("piRNA : Target RNA, " + Label)
+    x2.set_title("piRNA: Target RNA")
+    Figure.suptitle(Types + ", " + Label)
+
+def PairedPlotPosHist(Figure, Left, Right, Types, Label):
+    x1 = Figure.add_subplot(2, 1, 1)
+    Values, Weights = HistogramInputs(Left)
+    x1.hist(Values, bins=100, weights=Weights)
+    x1.set_xlabel("Positions on mRNA (binned length 1 - 100)")
+    x1.set_ylabel("Counts, " + Label)
+    x1.set_title("piRNA: Control RNA")
+
+    x2 = Figure.add_subplot(2, 1, 2, sharex=x1)
+    Values, Weights = HistogramInputs(Right)
+    x2.hist(Values, bins=100, weights=Weights)
+    x2.set_xlabel("Positions on mRNA (binned length 1 - 100)")
+    x2.set_ylabel("Counts, " + Label)
+    Figure.suptitle(Types + ", " + Label)
+    x2.set_title("piRNA: Target RNA")
+
+PairedPlotters = {"Bar": PairedPlot, "Hist": PairedPlotHist, "PosHist": PairedPlotPosHist}
+
+#This function draws one paired plot (Spec: Kind, Left, Right, Types, Label, OutputPDFName) on a new Figure.
+#Figures are made with the object-oriented API, not pyplot, so nothing keeps them alive once they are saved.
+def PairedFigureDrawer(Spec):
+    import matplotlib.figure
+    Kind, Left, Right, Types, Label, OutputPDFName = Spec
+    Figure = matplotlib.figure.Figure(figsize=(16, 9))
+    PairedPlotters[Kind](Figure, Left, Right, Types, Label)
+    return Figure
+
+#This function draws one paired plot into its own PDF file. It is also the task of the worker processes.
+def PairedFigureRenderer(Spec):
+    Figure = PairedFigureDrawer(Spec)
+    Figure.savefig(Spec[5])
+    Figure.clear()
+    return Spec[5]
+
+#This function lists the 12 paired plots of the summaries: (Kind, Left, Right, Types, Label, OutputPDFName).
+def PairedPlotsSpecs(Summary_piRNA_Control, Summary_piRNA_Targets, Prefix):
+    C = Summary_piRNA_Control
+    T = Summary_piRNA_Targets
+    return [("Bar", C.AlignBestPatternsSum[::-1], T.AlignBestPatternsSum[::-1], "Best Patterns", "Sum of Weights", \
+             Prefix+"PairedPlot.BestPattern.WeightSum.pdf"),
+            ("Bar", C.AlignBestPatternsAve[::-1], T.AlignBestPatternsAve[::-1], "Best Patterns", "Average of Weights", \
+             Prefix+"PairedPlot.BestPattern.WeightAve.pdf"),
+            ("Bar", C.AlignBestMatchingsSum[::-1], T.AlignBestMatchingsSum[::-1], "Best Matchings", "Sum of Matchings", \
+             Prefix+"PairedPlot.BestMatching.WeightSum.pdf"),
+            ("Bar", C.AlignBestMatchingsAve[::-1], T.AlignBestMatchingsAve[::-1], "Best Matchings", "Average of Matchings", \
+             Prefix+"PairedPlot.BestMatching.WeightAve.pdf"),
+            ("Hist", C.AlignBestScoresFreqDict, T.AlignBestScoresFreqDict, "Best Patterns", "Histogram of Scores", \
+             Prefix+"PairedPlot.BestPattern.HistoScores.pdf"),
+            ("PosHist", C.AlignBestPosFreqDict, T.AlignBestPosFreqDict, "Best Positions", "Histogram of Positions", \
+             Prefix + "PairedPlot.BestPattern.HistoPos.pdf"),
+            ("Bar", C.AlignAllPatternsSum[::-1], T.AlignAllPatternsSum[::-1], "All Patterns", "Sum of Weights", \
+             Prefix+"PairedPlot.AllPattern.WeightSum.pdf"),
+            ("Bar", C.AlignAllPatternsAve[::-1], T.AlignAllPatternsAve[::-1], "All Patterns", "Average of Weights", \
+             Prefix+"PairedPlot.AllPattern.WeightAve.pdf"),
+            ("Bar", C.AlignAllMatchingsSum[::-1], T.AlignAllMatchingsSum[::-1], "All Matchings", "Sum of Matchings", \
+             Prefix+"PairedPlot.AllMatching.WeightSum.pdf"),
+            ("Bar", C.AlignAllMatchingsAve[::-1], T.AlignAllMatchingsAve[::-1], "All Matchings", "Average of Matchings", \
+             Prefix+"PairedPlot.AllMatching.WeightAve.pdf"),
+            ("Hist", C.AlignAllScoresFreqDict, T.AlignAllScoresFreqDict, "All Patterns", "Histogram of Scores", \
+             Prefix+"PairedPlot.AllPattern.HistoScores.pdf"),
+            ("PosHist", C.AlignBestPosFreqDict, T.AlignBestPosFreqDict, "All Positions", "Histogram of Positions", \
+             Prefix + "PairedPlot.AllPattern.HistoPos.pdf")]
+
+#The hash of the inputs of a plot (or of several plots), with the matplotlib version
+def PlotsInputsHasher(Specs):
+    import matplotlib
+    Hasher = hashlib.sha256(matplotlib.__version__.encode())
+    for Spec in Specs:
+        Hasher.update(pickle.dumps(Spec, protocol=4))
+    return Hasher.hexdigest()
+
+def PlotsManifestFileName(Prefix):
+    return Prefix + "PairedPlots.json"
+
+def PlotsManifestReader(Prefix):
+    if not os.path.exists(PlotsManifestFileName(Prefix)):
+        return {}
+    fi = open(PlotsManifestFileName(Prefix), "r")
+    Manifest = json.load(fi)
+    fi.close()
+    return Manifest
+
+def PlotsManifestWriter(Prefix, Manifest):
+    fo = open(PlotsManifestFileName(Prefix), "w")
+    json.dump(Manifest, fo, indent=1)
+    fo.close()
 
 #Wrap all plots into this function
-def VisualizePairedSummary(Summary_piRNA_Control, Summary_piRNA_Targets, Prefix):
+#The figures are rendered by Workers processes, or with Combined=True, as the pages of one PDF (Prefix.PairedPlots.pdf).
+#The hash of the inputs of each PDF is recorded in Prefix.PairedPlots.json: the PDFs whose inputs have not changed
+# are not rendered again.
+def VisualizePairedSummary(Summary_piRNA_Control, Summary_piRNA_Targets, Prefix, Workers=1, Combined=False):
+    from matplotlib.backends.backend_pdf import PdfPages
     print("Generating paired comparison figures...")
-    #Plot1: AlignBest Weight Sum Barplot
-    PairedPlot(Summary_piRNA_Control.AlignBestPatternsSum[::-1], Summary_piRNA_Targets.AlignBestPatternsSum[::-1], "Best Patterns", \
-               "Sum of Weights", Prefix+"PairedPlot.BestPattern.WeightSum.pdf")
-    MultiSequencesAligner.ProgressBar(1,12)
-    #Plot2: AlignBest Weight Ave Barplot
-    PairedPlot(Summary_piRNA_Control.AlignBestPatternsAve[::-1], Summary_piRNA_Targets.AlignBestPatternsAve[::-1], "Best Patterns", \
-               "Average of Weights", Prefix+"PairedPlot.BestPattern.WeightAve.pdf")
-    MultiSequencesAligner.ProgressBar(2, 12)
-    #Plot3: AlignBest Matching Sum Barplot
-    PairedPlot(Summary_piRNA_Control.AlignBestMatchingsSum[::-1], Summary_piRNA_Targets.AlignBestMatchingsSum[::-1], "Best Matchings", \
-               "Sum of Matchings", Prefix+"PairedPlot.BestMatching.WeightSum.pdf")
-    MultiSequencesAligner.ProgressBar(3, 12)
-    #Plot4: AlignBest Matching Ave Barplot
-    PairedPlot(Summary_piRNA_Control.AlignBestMatchingsAve[::-1], Summary_piRNA_Targets.AlignBestMatchingsAve[::-1], "Best Matchings", \
-               "Average of Matchings", Prefix+"PairedPlot.BestMatching.WeightAve.pdf")
-    MultiSequencesAligner.ProgressBar(4, 12)
-    #Plot5: AlignBest Score Histogram
-    PairedPlotHist(Summary_piRNA_Control.AlignBestScores, Summary_piRNA_Targets.AlignBestScores, "Best Patterns", \
-                   "Histogram of Scores", Prefix+"PairedPlot.BestPattern.HistoScores.pdf")
-    MultiSequencesAligner.ProgressBar(5, 12)
-    #Plot6: AlignBest Targed Pos Histogram
-    PairedPlotPosHist(Summary_piRNA_Control.AlignBestPosList, Summary_piRNA_Targets.AlignBestPosList, "Best Positions", \
-                      "Histogram of Positions", Prefix + "PairedPlot.BestPattern.HistoPos.pdf")
-    MultiSequencesAligner.ProgressBar(6, 12)
-
-    #Plot7: AlignAll Weight Sum Barplot
-    PairedPlot(Summary_piRNA_Control.AlignAllPatternsSum[::-1], Summary_piRNA_Targets.AlignAllPatternsSum[::-1], "All Patterns", \
-               "Sum of Weights", Prefix+"PairedPlot.AllPattern.WeightSum.pdf")
-    MultiSequencesAligner.ProgressBar(7, 12)
-    #Plot8: AlignAll Weight Ave Barplot
-    PairedPlot(Summary_piRNA_Control.AlignAllPatternsAve[::-1], Summary_piRNA_Targets.AlignAllPatternsAve[::-1], "All Patterns", \
-               "Average of Weights", Prefix+"PairedPlot.AllPattern.WeightAve.pdf")
-    MultiSequencesAligner.ProgressBar(8, 12)
-    #Plot9: AlignAll Matching Sum Barplot
-    PairedPlot(Summary_piRNA_Control.AlignAllMatchingsSum[::-1], Summary_piRNA_Targets.AlignAllMatchingsSum[::-1], "All Matchings", \
-               "Sum of Matchings", Prefix+"PairedPlot.AllMatching.WeightSum.pdf")
-    MultiSequencesAligner.ProgressBar(9, 12)
-    #Plot10: AlignAll Matching Ave Barplot
-    PairedPlot(Summary_piRNA_Control.AlignAllMatchingsAve[::-1], Summary_piRNA_Targets.AlignAllMatchingsAve[::-1], "All Matchings", \
-               "Average of Matchings", Prefix+"PairedPlot.AllMatching.WeightAve.pdf")
-    MultiSequencesAligner.ProgressBar(10, 12)
-    #Plot11: AlignAll Score Histogram
-    PairedPlotHist(Summary_piRNA_Control.AlignAllScores, Summary_piRNA_Targets.AlignAllScores, "All Patterns", \
-                   "Histogram of Scores", Prefix+"PairedPlot.AllPattern.HistoScores.pdf")
-    MultiSequencesAligner.ProgressBar(11, 12)
-    #Plot12: AlignAll Score Histogram
-    PairedPlotPosHist(Summary_piRNA_Control.AlignBestPosList, Summary_piRNA_Targets.AlignBestPosList, "All Positions", \
-                      "Histogram of Positions", Prefix + "PairedPlot.AllPattern.HistoPos.pdf")
-    MultiSequencesAligner.ProgressBar(12, 12)
+    Specs = PairedPlotsSpecs(Summary_piRNA_Control, Summary_piRNA_Targets, Prefix)
+    Manifest = PlotsManifestReader(Prefix)
+    if Combined == True:
+        Jobs = {Prefix + "PairedPlots.pdf": Specs}
+    else:
+        Jobs = collections.OrderedDict((Spec[5], [Spec]) for Spec in Specs)
+    Hashes = {OutputPDFName: PlotsInputsHasher(JobSpecs) for OutputPDFName, JobSpecs in Jobs.items()}
+    Pending = [OutputPDFName for OutputPDFName in Jobs if Manifest.get(OutputPDFName) != Hashes[OutputPDFName] \
+               or not os.path.exists(OutputPDFName)]
+    Done = len(Specs) - sum(len(Jobs[OutputPDFName]) for OutputPDFName in Pending)
+    if Done > 0:
+        MultiSequencesAligner.ProgressBar(Done, len(Specs))
+    if Combined == True and len(Pending) > 0:
+        Pages = PdfPages(Pending[0])
+        for Spec in Specs:
+            Figure = PairedFigureDrawer(Spec)
+            Pages.savefig(Figure)
+            Figure.clear()
+            Done = Done + 1
+            MultiSequencesAligner.ProgressBar(Done, len(Specs))
+        Pages.close()
+    elif Workers > 1 and len(Pending) > 1:
+        with ProcessPoolExecutor(max_workers=min(Workers, len(Pending))) as Executor:
+            for OutputPDFName in Executor.map(PairedFigureRenderer, [Jobs[OutputPDFName][0] for OutputPDFName in Pending]):
+                Done = Done + 1
+                MultiSequencesAligner.ProgressBar(Done, len(Specs))
+    else:
+        for OutputPDFName in Pending:
+            PairedFigureRenderer(Jobs[OutputPDFName][0])
+            Done = Done + 1
+            MultiSequencesAligner.ProgressBar(Done, len(Specs))
+    for OutputPDFName in Jobs:
+        Manifest[OutputPDFName] = Hashes[OutputPDFName]
+    PlotsManifestWriter(Prefix, Manifest)
     print("\nDone.")
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+
+"""
+FastaReader.py
+This script is a part of piTargetClassifier project.
+This script contains the functions to stream records from FASTA files, one record at a time.
+Sequences can be wrapped on multiple lines, and files can be gzip (or bgzip) compressed.
+Yu Sun, ysun43@ur.rochester.edu, 2018-11
+"""
+
+import gzip
+
+#This function opens a FASTA file in text mode. Compressed files are detected by the gzip magic number,
+# bgzip files are gzip files made of multiple members, which gzip reads transparently.
+def FastaFileOpener(File):
+    with open(File, "rb") as fi:
+        Magic = fi.read(2)
+    if Magic == b"\x1f\x8b":
+        return gzip.open(File, "rt")
+    else:
+        return open(File, "r")
+
+#This function yields (Header, Sequence) for each record of a FASTA file. The header does not contain '>'.
+#Sequence lines are joined, and blank lines are skipped. Only the current record is kept in memory.
+def FastaRecordsReader(File):
+    fi = FastaFileOpener(File)
+    Header = None
+    SequenceLines = []
+    for line in fi:
+        line = line.strip()
+        if line == "":
+            continue
+        if line[0] == ">":
+            if Header is not None:
+                yield (Header, "".join(SequenceLines))
+            Header = line[1:]
+            SequenceLines = []
+        elif Header is not None:
+            SequenceLines.append(line)
+    if Header is not None:
+        yield (Header, "".join(SequenceLines))
+    fi.close()
+
+#This function counts the records of a FASTA file, without storing them. Headers are detected as in FastaRecordsReader.
+def FastaRecordsCounter(File):
+    fi = FastaFileOpener(File)
+    Counter = 0
+    for line in fi:
+        line = line.strip()
+        if line != "" and line[0] == ">":
+            Counter = Counter + 1
+    fi.close()
+    return Counter
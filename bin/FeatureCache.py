@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+
+"""
+FeatureCache.py
+This script is a part of piTargetClassifier project.
+This script stores the machine learning features of the *AlignmentPattern.txt files in a binary cache (Prefix.FeatureCache/),
+ so that Learn mode (and --import) loads them as memory-mapped arrays instead of re-parsing the text files.
+For each set (Control, Targets) and mode (All, Best), the cache contains:
+  Set.Mode.Features.npy     uint8 patterns (piRNA 5'-> 3'), one row per line of the pattern file
+  Set.Mode.Labels.npy       uint8 labels, 0 for piRNA-Control, 1 for piRNA-Target
+  Set.Mode.TargetIndex.npy  int32 index of the target name (Set.TargetNames.txt)
+  Set.Mode.piRNAIndex.npy   int32 index of the piRNA name (Set.piRNANames.txt)
+Header.json records the weights and the inputs used, and the size/modification time of the pattern files, which is
+ used to check that the cache is still valid.
+Requied packages: numpy
+Yu Sun, ysun43@ur.rochester.edu, 2018-11
+"""
+
+import os
+import json
+import numpy as np
+
+CacheVersion = 1
+CacheSets = (("Control", "Control", 0), ("Targets", "Target", 1))
+CacheModes = ("All", "Best")
+#Number of pattern file lines converted at once by FeatureCacheBuilder
+ConverterChunkSize = 1 << 20
+
+def FeatureCacheDir(Prefix):
+    return Prefix + ".FeatureCache"
+
+def PatternFileName(Prefix, SetName, Mode):
+    return Prefix + "." + SetName + "." + Mode + "AlignmentPattern.txt"
+
+def CacheFileName(Prefix, SetName, Mode, Array):
+    return os.path.join(FeatureCacheDir(Prefix), SetName + "." + Mode + "." + Array + ".npy")
+
+#This function returns the [size, modification time] of each pattern file, used to detect a stale cache.
+def PatternFilesStats(Prefix):
+    Stats = {}
+    for SetName, Group, Label in CacheSets:
+        for Mode in CacheModes:
+            Stat = os.stat(PatternFileName(Prefix, SetName, Mode))
+            Stats[os.path.basename(PatternFileName(Prefix, SetName, Mode))] = [Stat.st_size, Stat.st_mtime_ns]
+    return Stats
+
+#This function writes Header.json, once all the arrays are written. Weights and Inputs can be None (unknown).
+def FeatureCacheHeaderWriter(Prefix, Weights, Inputs):
+    PatternLength = int(np.load(CacheFileName(Prefix, "Control", "All", "Features"), mmap_mode="r").shape[1])
+    Header = {"Version": CacheVersion, "PatternLength": PatternLength, "Weights": Weights, "Inputs": Inputs, \
+              "PatternFiles": PatternFilesStats(Prefix)}
+    fo = open(os.path.join(FeatureCacheDir(Prefix), "Header.json"), "w")
+    json.dump(Header, fo, indent=1)
+    fo.close()
+
+def FeatureCacheHeaderReader(Prefix):
+    HeaderFile = os.path.join(FeatureCacheDir(Prefix), "Header.json")
+    if not os.path.exists(HeaderFile):
+        return None
+    fi = open(HeaderFile, "r")
+    Header = json.load(fi)
+    fi.close()
+    return Header
+
+#This function removes the header of the cache, which marks it as invalid (e.g. before a new alignment).
+def FeatureCacheInvalidator(Prefix):
+    HeaderFile = os.path.join(FeatureCacheDir(Prefix), "Header.json")
+    if os.path.exists(HeaderFile):
+        os.remove(HeaderFile)
+
+#This function checks that the cache exists, has the current version, and matches the pattern files.
+def FeatureCacheChecker(Prefix):
+    Header = FeatureCacheHeaderReader(Prefix)
+    if Header is None or Header.get("Version") != CacheVersion:
+        return False
+    try:
+        return Header["PatternFiles"] == PatternFilesStats(Prefix)
+    except OSError:
+        return False
+
+#This class writes the features of one RNA set during the alignment, from the SequencesAligner.PanelPairing objects.
+#The arrays are memory-mapped .npy files allocated for RNANum x piRNA number pairs, and filled RNA by RNA.
+#The features are the patterns as written in the pattern files, so the writer is only usable if all piRNAs
+# have the same length and all weights are single digits (see FeatureCacheWriterChecker).
+class FeatureCacheWriter:
+    def __init__(self, Prefix, SetName, RNANum, Panel):
+        Label = [Label for Name, Group, Label in CacheSets if Name == SetName][0]
+        piRNANum = len(Panel.Names)
+        PatternLength = Panel.MaxLength
+        self.piRNANum = piRNANum
+        self.TargetNames = []
+        self.Arrays = {}
+        os.makedirs(FeatureCacheDir(Prefix), exist_ok=True)
+        for Mode, TopNum in (("All", 3), ("Best", 1)):
+            RowNum = RNANum * piRNANum * TopNum
+            Features = np.lib.format.open_memmap(CacheFileName(Prefix, SetName, Mode, "Features"), mode="w+", \
+                                                 dtype=np.uint8, shape=(RowNum, PatternLength))
+            TargetIndex = np.repeat(np.arange(RNANum, dtype=np.int32), piRNANum * TopNum)
+            piRNAIndex = np.tile(np.repeat(np.arange(piRNANum, dtype=np.int32), TopNum), RNANum)
+            np.save(CacheFileName(Prefix, SetName, Mode, "Labels"), np.full(RowNum, Label, dtype=np.uint8))
+            np.save(CacheFileName(Prefix, SetName, Mode, "TargetIndex"), TargetIndex)
+            np.save(CacheFileName(Prefix, SetName, Mode, "piRNAIndex"), piRNAIndex)
+            self.Arrays[Mode] = (Features, TopNum)
+        NamesWriter(os.path.join(FeatureCacheDir(Prefix), SetName + ".piRNANames.txt"), Panel.Names)
+        self.TargetNamesFile = os.path.join(FeatureCacheDir(Prefix), SetName + ".TargetNames.txt")
+
+    def Update(self, rnaIndex, PanelResult):
+        self.TargetNames.append(PanelResult.TargetName)
+        #Non-positive weights are written as '0', and the pattern files are in the piRNA 5'->3' direction.
+        Patterns = np.clip(PanelResult.Patterns, 0, None)[:, :, ::-1]
+        for Mode in self.Arrays:
+            Features, TopNum = self.Arrays[Mode]
+            Rows = self.piRNANum * TopNum
+            Features[rnaIndex * Rows:(rnaIndex + 1) * Rows] = Patterns[:, :TopNum, :].reshape(Rows, -1)
+
+    def Close(self):
+        for Mode in self.Arrays:
+            self.Arrays[Mode][0].flush()
+        self.Arrays = {}
+        NamesWriter(self.TargetNamesFile, self.TargetNames)
+
+#This function checks whether the features can be written directly during the alignment (see FeatureCacheWriter).
+def FeatureCacheWriterChecker(Panel, WeightsTable):
+    return len(Panel.Groups) == 1 and WeightsTable.max() <= 9
+
+def NamesWriter(File, Names):
+    fo = open(File, "w")
+    for Name in Names:
+        fo.write(Name + "\n")
+    fo.close()
+
+#This function gets the index of each name in a name table (dictionary), adding new names to the table.
+def NamesIndexer(Names, NamesTable, NamesList):
+    Index = np.zeros(len(Names), dtype=np.int32)
+    for i, Name in enumerate(Names):
+        if Name not in NamesTable:
+            NamesTable[Name] = len(NamesList)
+            NamesList.append(Name)
+        Index[i] = NamesTable[Name]
+    return Index
+
+#This function counts the lines of a file opened in binary mode, and goes back to the start of the file.
+def LinesCounter(fi):
+    RowNum = 0
+    LastBlock = b""
+    for Block in iter(lambda: fi.read(1 << 24), b""):
+        RowNum = RowNum + Block.count(b"\n")
+        LastBlock = Block
+    if LastBlock != b"" and LastBlock[-1:] != b"\n":
+        RowNum = RowNum + 1
+    fi.seek(0)
+    return RowNum
+
+#This function converts one pattern file into cache arrays, ConverterChunkSize lines at a time.
+#Returns the pattern length, or None if the patterns are not all single digits of the same length.
+def PatternFileConverter(Prefix, SetName, Mode, Label, TargetNamesTable, TargetNamesList, piRNANamesTable, piRNANamesList):
+    File = PatternFileName(Prefix, SetName, Mode)
+    fi = open(File, "rb")
+    RowNum = LinesCounter(fi)
+    FirstLine = fi.readline()
+    PatternLength = len(FirstLine.split()[3]) if RowNum > 0 else 0
+    fi.seek(0)
+    Features = np.lib.format.open_memmap(CacheFileName(Prefix, SetName, Mode, "Features"), mode="w+", \
+                                         dtype=np.uint8, shape=(RowNum, PatternLength))
+    TargetIndex = np.zeros(RowNum, dtype=np.int32)
+    piRNAIndex = np.zeros(RowNum, dtype=np.int32)
+    Row = 0
+    while True:
+        Lines = fi.readlines(ConverterChunkSize * (PatternLength + 64))
+        if len(Lines) == 0:
+            break
+        Fields = [line.split() for line in Lines]
+        Patterns = b"".join(Field[3] for Field in Fields)
+        if len(Patterns) != len(Lines) * PatternLength:
+            fi.close()
+            return None
+        Chunk = np.frombuffer(Patterns, dtype=np.uint8).reshape(len(Lines), PatternLength) - 48
+        if Chunk.max(initial=0) > 9:
+            fi.close()
+            return None
+        Features[Row:Row + len(Lines)] = Chunk
+        TargetIndex[Row:Row + len(Lines)] = NamesIndexer([Field[0].decode() for Field in Fields], TargetNamesTable, TargetNamesList)
+        piRNAIndex[Row:Row + len(Lines)] = NamesIndexer([Field[1].decode() for Field in Fields], piRNANamesTable, piRNANamesList)
+        Row = Row + len(Lines)
+    fi.close()
+    Features.flush()
+    np.save(CacheFileName(Prefix, SetName, Mode, "Labels"), np.full(RowNum, Label, dtype=np.uint8))
+    np.save(CacheFileName(Prefix, SetName, Mode, "TargetIndex"), TargetIndex)
+    np.save(CacheFileName(Prefix, SetName, Mode, "piRNAIndex"), piRNAIndex)
+    return PatternLength
+
+#This function builds the cache from the 4 pattern files (the one-time conversion of pre-aligned data).
+#Returns True if the cache has been built.
+def FeatureCacheBuilder(Prefix):
+    os.makedirs(FeatureCacheDir(Prefix), exist_ok=True)
+    PatternLength = None
+    for SetName, Group, Label in CacheSets:
+        TargetNamesTable = {}
+        TargetNamesList = []
+        piRNANamesTable = {}
+        piRNANamesList = []
+        for Mode in CacheModes:
+            CurrLength = PatternFileConverter(Prefix, SetName, Mode, Label, TargetNamesTable, TargetNamesList, \
+                                              piRNANamesTable, piRNANamesList)
+            if CurrLength is None or (PatternLength is not None and CurrLength != PatternLength):
+                print("The patterns can not be stored in the binary cache, use the text files instead.")
+                return False
+            PatternLength = CurrLength
+        NamesWriter(os.path.join(FeatureCacheDir(Prefix), SetName + ".TargetNames.txt"), TargetNamesList)
+        NamesWriter(os.path.join(FeatureCacheDir(Prefix), SetName + ".piRNANames.txt"), piRNANamesList)
+    FeatureCacheHeaderWriter(Prefix, None, None)
+    return True
+
+#This function loads the features and labels of one set and mode, as read-only memory-mapped arrays.
+def FeatureCacheLoader(Prefix, SetName, Mode):
+    Features = np.load(CacheFileName(Prefix, SetName, Mode, "Features"), mmap_mode="r")
+    Labels = np.load(CacheFileName(Prefix, SetName, Mode, "Labels"), mmap_mode="r")
+    return (Features, Labels)
+
+#This function makes sure the cache is valid (building it from the pattern files if needed), and returns True if the
+# features can be loaded from it.
+def FeatureCacheEnsurer(Prefix):
+    if FeatureCacheChecker(Prefix):
+        print(">>> Loading features from the binary cache: " + FeatureCacheDir(Prefix))
+        return True
+    print(">>> Building the binary feature cache: " + FeatureCacheDir(Prefix))
+    return FeatureCacheBuilder(Prefix)
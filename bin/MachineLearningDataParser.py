@@ -10,19 +10,48 @@ Requied packages: numpy
 Yu Sun, ysun43@ur.rochester.edu, 2018-11
 """
 
+import itertools
 import numpy as np
 
-def DataParserFromPatternOnlyFile(File):
-    #Parse file (single column patterns) to np.array
+#Number of patterns parsed at once by PatternChunksReader
+PatternChunkSize = 1 << 16
+
+#This function streams a pattern file (single column patterns) in chunks of ChunkSize patterns, and yields
+# (Patterns, Data) pairs: the list of the pattern strings, and their (n x pattern length) uint8 array.
+#Empty lines are skipped. All the patterns must have the same length, and be made of digits (0-9).
+def PatternChunksReader(File, ChunkSize=PatternChunkSize):
     fi = open(File, "r")
-    ML_List = []
-    for i in fi:
-        data = i.strip()
-        datasplit = [int(d) for d in data]
-        ML_List.append(datasplit)
-    ML_Array = np.array(ML_List)
+    Lines = ((LineNum, Line.strip()) for LineNum, Line in enumerate(fi, 1))
+    Lines = ((LineNum, Pattern) for LineNum, Pattern in Lines if Pattern != "")
+    PatternLength = None
+    while True:
+        Chunk = list(itertools.islice(Lines, ChunkSize))
+        if len(Chunk) == 0:
+            break
+        LineNums = [LineNum for LineNum, Pattern in Chunk]
+        Patterns = [Pattern for LineNum, Pattern in Chunk]
+        if PatternLength is None:
+            PatternLength = len(Patterns[0])
+        for LineNum, Pattern in Chunk:
+            if len(Pattern) != PatternLength:
+                fi.close()
+                raise ValueError("The patterns of " + File + " do not have the same length (line " + str(LineNum) + ")")
+        Data = np.frombuffer("".join(Patterns).encode("ascii", "replace"), dtype=np.uint8).reshape(len(Patterns), -1) - 48
+        #Characters other than digits wrap around in uint8, above 9
+        Invalid = (Data > 9).any(axis=1)
+        if Invalid.any():
+            fi.close()
+            Row = int(Invalid.argmax())
+            raise ValueError("Invalid pattern in " + File + " (line " + str(LineNums[Row]) + "): " + Patterns[Row] + \
+                             ", the patterns must be digit strings")
+        yield Patterns, Data
+    fi.close()
 
-    return ML_Array
+#This function returns the length of the first pattern of a pattern file (single column patterns), or 0 if it is empty.
+def PatternLengthReader(File):
+    for Patterns, Data in PatternChunksReader(File, 1):
+        return Data.shape[1]
+    return 0
 
 def DataParserFromPatternFile(File, Group):
     if Group == "Control":
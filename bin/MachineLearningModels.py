@@ -6,71 +6,248 @@ This script is a part of piTargetClassifier project.
 This script takes the training and testing datasets as input, use assigned tree number and depth to perform Random Forest classification.
 The outputs will be a summary report and a paired comparison figure for training and testing datasets.
 Requied packages: numpy, sklearn, matplotlib.
+sklearn and matplotlib are only imported by the functions using them, so that importing this script (e.g. in Align
+ mode) stays fast.
 Yu Sun, ysun43@ur.rochester.edu, 2018-11
 """
 
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.linear_model import LogisticRegressionCV
-from sklearn.svm import SVC
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import confusion_matrix
-from sklearn.metrics import classification_report
-from sklearn.metrics import roc_auc_score
-from sklearn.metrics import roc_curve
-import matplotlib.pyplot as plt
-plt.switch_backend('agg')   #This is required for Linux system to plot figures (MacOS doesn't require)
+import io
+import os
+import sys
+import json
+import contextlib
+import collections
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from bin import MachineLearningDataParser
+from bin import ModelStore
+
+#Number of chunks queued per worker by PredictResultsStreamer
+PredictTasksPerWorker = 2
+
+#Classifier types (as printed in the reports) of the Learn tasks
+ClassifierTypes = {"Logistic": "Logistic", "RandomForest": "Random Forest", "SVM": "SVM"}
+
+#This function concatenates the Control and Target data, and splits them into training and testing datasets.
+#Returns (X_train, X_test, y_train, y_test). The split is the same for all the classifiers (random_state=0).
+def LearnDataSplitter(Control_Data, Control_Label, Target_Data, Target_Label, test_frac):
+    from sklearn.model_selection import train_test_split
+    ML_Data = np.concatenate((Control_Data, Target_Data))
+    ML_Label = np.append(Control_Label, Target_Label)
+    return train_test_split(ML_Data, ML_Label, test_size=test_frac, random_state=0)
 
 #This is a Logistic classifier. The Cross validation number CVNum can be adjusted.
 def FitClassifierLogistic(Control_Data, Control_Label, Target_Data, Target_Label, CVNum, test_frac ,OutputSummaryFileName):
+    return FitClassifierLogisticSplit(LearnDataSplitter(Control_Data, Control_Label, Target_Data, Target_Label, test_frac), \
+                                      CVNum, OutputSummaryFileName)
+
+#Same as FitClassifierLogistic, for data already split by LearnDataSplitter. NJobs is the number of folds fitted at once.
+def FitClassifierLogisticSplit(Split, CVNum, OutputSummaryFileName, NJobs=None):
+    from sklearn.linear_model import LogisticRegressionCV
     fo = open(OutputSummaryFileName, "w")
-    ML_Data = np.concatenate((Control_Data, Target_Data))
-    ML_Label = np.append(Control_Label, Target_Label)
-    X_train, X_test, y_train, y_test = train_test_split(ML_Data, ML_Label, test_size=test_frac, random_state=0)
+    X_train, X_test, y_train, y_test = Split
     print("Staring Logistic Regressor")
     print("Training data: " + str(X_train.shape[0]))
     print("Testing data: " + str(X_test.shape[0]))
     print("Fitting Logistic Regressor with +"+str(CVNum)+" Cross Validation")
     fo.write("Summary report of the Logistic (LOG) Regressor with "+str(CVNum)+" Cross Validation\n")
-    logi = LogisticRegressionCV(cv=CVNum, solver="liblinear", random_state=42)
+    logi = LogisticRegressionCV(cv=CVNum, solver="liblinear", random_state=42, n_jobs=NJobs)
     logi.fit(X_train, y_train)
     fo.close()
     return X_train, X_test, y_train, y_test, logi
 
 #This is a Random Forest classifier. Tree depth and tree number can be adjusted.
 def FitClassifierRandomForest(Control_Data, Control_Label, Target_Data, Target_Label, TreeNum, Depth, test_frac ,OutputSummaryFileName):
+    return FitClassifierRandomForestSplit(LearnDataSplitter(Control_Data, Control_Label, Target_Data, Target_Label, test_frac), \
+                                          TreeNum, Depth, OutputSummaryFileName)
+
+#Same as FitClassifierRandomForest, for data already split by LearnDataSplitter. NJobs is the number of trees fitted at once.
+def FitClassifierRandomForestSplit(Split, TreeNum, Depth, OutputSummaryFileName, NJobs=None):
+    from sklearn.ensemble import RandomForestClassifier
     fo = open(OutputSummaryFileName, "w")
-    ML_Data = np.concatenate((Control_Data, Target_Data))
-    ML_Label = np.append(Control_Label, Target_Label)
-    X_train, X_test, y_train, y_test = train_test_split(ML_Data, ML_Label, test_size=test_frac, random_state=0)
+    X_train, X_test, y_train, y_test = Split
     print("Staring Random Forest Classifier")
     print("Training data: " + str(X_train.shape[0]))
     print("Testing data: " + str(X_test.shape[0]))
     print("Fitting Random Forest Classifier with "+str(TreeNum)+" trees and maximum depth "+str(Depth)+".")
     fo.write("Summary report of the Random Forest (RF) Classifier\n")
     fo.write("Random Forest Classifier with "+str(TreeNum)+" trees and maximum depth "+str(Depth)+".\n")
-    rf = RandomForestClassifier(n_estimators=TreeNum, max_depth=Depth, random_state=42)
+    rf = RandomForestClassifier(n_estimators=TreeNum, max_depth=Depth, random_state=42, n_jobs=NJobs)
     rf.fit(X_train, y_train)
     fo.close()
     return X_train, X_test, y_train, y_test, rf
 
 #This is a SVM classifier, using rbf kernal and auto gamma. C is the penalty score which is adjustable.
 def FitClassifierSVM(Control_Data, Control_Label, Target_Data, Target_Label, C, test_frac ,OutputSummaryFileName):
+    return FitClassifierSVMSplit(LearnDataSplitter(Control_Data, Control_Label, Target_Data, Target_Label, test_frac), \
+                                 C, OutputSummaryFileName)
+
+#SVM engines of FitClassifierSVMSplit: "exact" is the RBF SVC; "nystroem" and "rff" approximate the same RBF kernel
+# (Nystroem, or random Fourier features) with SVMComponents features, followed by a linear SVM, which scales linearly
+# with the number of training rows.
+SVMEngines = ("exact", "nystroem", "rff")
+SVMComponents = 500
+#Fraction of the training rows kept apart to calibrate the probabilities, when they are not calibrated by SVC itself
+CalibrationFrac = 0.1
+
+#This class is a fitted SVM with probabilities calibrated on a holdout dataset (see HoldoutCalibrator), as
+# SVC(probability=True) does: the labels are the ones of the SVM itself (predict), and only predict_proba is calibrated.
+#The calibrated sigmoid is fitted on few rows, so its 0.5 threshold does not match the decision of the SVM.
+class HoldoutCalibratedSVM:
+    def __init__(self, Classifier, Calibrated):
+        self.Classifier = Classifier
+        self.Calibrated = Calibrated
+        self.classes_ = Classifier.classes_
+
+    def predict(self, X):
+        return self.Classifier.predict(X)
+
+    def decision_function(self, X):
+        return self.Classifier.decision_function(X)
+
+    def predict_proba(self, X):
+        return self.Calibrated.predict_proba(X)
+
+#This function calibrates the probabilities of a fitted classifier (sigmoid) on a holdout dataset, and returns a
+# HoldoutCalibratedSVM.
+def HoldoutCalibrator(Classifier, X_holdout, y_holdout):
+    from sklearn.calibration import CalibratedClassifierCV
+    try:
+        from sklearn.frozen import FrozenEstimator
+        Calibrated = CalibratedClassifierCV(FrozenEstimator(Classifier), method="sigmoid")
+    except ImportError:
+        Calibrated = CalibratedClassifierCV(Classifier, method="sigmoid", cv="prefit")
+    Calibrated.fit(X_holdout, y_holdout)
+    return HoldoutCalibratedSVM(Classifier, Calibrated)
+
+#Same as FitClassifierSVM, for data already split by LearnDataSplitter.
+#With another Engine (see SVMEngines), or with a SampleSize (number of training rows, randomly sampled), the probability
+# is not calibrated by the internal cross validation of SVC(probability=True): a holdout of the training rows
+# (CalibrationFrac, at most SampleSize rows) is kept apart, and the probabilities of the fitted SVM are calibrated on it;
+# the predicted labels stay the ones of the SVM.
+def FitClassifierSVMSplit(Split, C, OutputSummaryFileName, Engine="exact", Components=SVMComponents, SampleSize=None):
+    from sklearn.svm import SVC
+    from sklearn.svm import LinearSVC
+    from sklearn.kernel_approximation import Nystroem
+    from sklearn.kernel_approximation import RBFSampler
+    from sklearn.pipeline import make_pipeline
     fo = open(OutputSummaryFileName, "w")
-    ML_Data = np.concatenate((Control_Data, Target_Data))
-    ML_Label = np.append(Control_Label, Target_Label)
-    X_train, X_test, y_train, y_test = train_test_split(ML_Data, ML_Label, test_size=test_frac, random_state=0)
+    X_train, X_test, y_train, y_test = Split
     print("Staring Support Vector Machine (SVM) Classifier")
     print("Training data: " + str(X_train.shape[0]))
     print("Testing data: " + str(X_test.shape[0]))
     print("Fitting Support Vector Machine (SVM)...This may take a while...")
     fo.write("Summary report of the Support Vector Machine (SVM) Classifier\n")
-    svcfit = SVC(kernel='rbf', gamma='auto', C=C, probability=True, random_state=42)  #Default to use Gaussian kernel (rbf), turn on probability so that the ROC curve can be drawn.
-    svcfit.fit(X_train, y_train)
+    if Engine == "exact" and SampleSize is None:
+        svcfit = SVC(kernel='rbf', gamma='auto', C=C, probability=True, random_state=42)  #Default to use Gaussian kernel (rbf), turn on probability so that the ROC curve can be drawn.
+        svcfit.fit(X_train, y_train)
+        fo.close()
+        return X_train, X_test, y_train, y_test, svcfit
+    Order = np.random.RandomState(42).permutation(X_train.shape[0])
+    HoldoutNum = max(1, int(X_train.shape[0] * CalibrationFrac))
+    if SampleSize is not None:
+        HoldoutNum = min(HoldoutNum, SampleSize)
+    Holdout = np.sort(Order[:HoldoutNum])
+    Fitting = np.sort(Order[HoldoutNum:] if SampleSize is None else Order[HoldoutNum:HoldoutNum + SampleSize])
+    Gamma = 1.0 / X_train.shape[1]   #Same as gamma='auto'
+    if Engine == "nystroem":
+        svm = make_pipeline(Nystroem(kernel="rbf", gamma=Gamma, n_components=Components, random_state=42), \
+                            LinearSVC(C=C, random_state=42))
+    elif Engine == "rff":
+        svm = make_pipeline(RBFSampler(gamma=Gamma, n_components=Components, random_state=42), LinearSVC(C=C, random_state=42))
+    else:
+        svm = SVC(kernel='rbf', gamma='auto', C=C, random_state=42)
+    print("SVM engine: " + Engine + ", fitting on " + str(len(Fitting)) + " rows, calibrating on " + str(len(Holdout)) + " rows")
+    fo.write("SVM engine: " + Engine + ("" if Engine == "exact" else " (" + str(Components) + " components)") + ", fitted on " + \
+             str(len(Fitting)) + " training rows, calibrated on " + str(len(Holdout)) + " rows\n")
+    svm.fit(X_train[Fitting], y_train[Fitting])
+    svcfit = HoldoutCalibrator(svm, X_train[Holdout], y_train[Holdout])
     fo.close()
     return X_train, X_test, y_train, y_test, svcfit
 
+#The name of a classifier from its Kind and parameters (see LearnTask), used in the names of its report, model and
+# Predict files, e.g. Logistic.CV5, RandomForest.T100D8, SVM.C1 (the SVM engine and sample size are added if set)
+def ClassifierName(Kind, Params):
+    if Kind == "Logistic":
+        return "Logistic.CV" + str(Params["CVNum"])
+    elif Kind == "RandomForest":
+        return "RandomForest.T" + str(Params["TNum"]) + "D" + str(Params["Depth"])
+    Name = "SVM.C" + str(Params["Cpen"])
+    if Params.get("Engine", "exact") != "exact":
+        Name = Name + "." + Params["Engine"] + str(Params["Components"])
+    if Params.get("SampleSize") is not None:
+        Name = Name + ".S" + str(Params["SampleSize"])
+    return Name
+
+#This object describes one classifier to fit in Learn mode: its Kind (see ClassifierTypes), the Mode of its data
+# (All/Best), its parameters (CVNum; TNum, Depth; or Cpen, Engine, Components, SampleSize), and the prefix of its report files (.txt and .pdf).
+#Banner is printed before its output. With Plots=False, the ROC curves (.pdf) are not drawn.
+#With an OutputFilePrefix of None, no report file is written (the summary report goes to os.devnull).
+class LearnTask:
+    def __init__(self, Kind, Mode, Params, OutputFilePrefix, Banner, Plots=True):
+        self.Kind = Kind
+        self.Mode = Mode
+        self.Params = Params
+        if OutputFilePrefix is None:
+            self.OutputSummaryFileName = os.devnull
+            self.OutputPDFName = None
+        else:
+            self.OutputSummaryFileName = OutputFilePrefix + ".txt"
+            self.OutputPDFName = OutputFilePrefix + ".pdf" if Plots == True else None
+        self.Banner = Banner
+
+#This function fits and evaluates the classifier of a LearnTask on its Split, and returns the fitted classifier and its
+# metrics (see MetricsSummarizer). With Capture=True, the printed output is returned too, instead of being printed.
+def LearnTaskRunner(Task, Split, NJobs=None, Verbose=False, Capture=False):
+    Buffer = io.StringIO()
+    with contextlib.redirect_stdout(Buffer) if Capture == True else contextlib.nullcontext():
+        if Task.Kind == "Logistic":
+            Classifier = FitClassifierLogisticSplit(Split, Task.Params["CVNum"], Task.OutputSummaryFileName, NJobs)[4]
+        elif Task.Kind == "RandomForest":
+            Classifier = FitClassifierRandomForestSplit(Split, Task.Params["TNum"], Task.Params["Depth"], \
+                                                        Task.OutputSummaryFileName, NJobs)[4]
+        else:
+            Classifier = FitClassifierSVMSplit(Split, Task.Params["Cpen"], Task.OutputSummaryFileName, Task.Params["Engine"], \
+                                               Task.Params["Components"], Task.Params["SampleSize"])[4]
+        Evaluations = CompareMLResultsAndROCCurves(*Split, Classifier, ClassifierTypes[Task.Kind], Task.OutputSummaryFileName, \
+                                                   Task.OutputPDFName, Verbose)
+    return Classifier, MetricsSummarizer(Evaluations, ClassifierTypes[Task.Kind]), Buffer.getvalue()
+
+#Worker process state of LearnTasksScheduler, set once per worker, so that the data are only sent once.
+LearnWorkerSplits = None
+
+def LearnWorkerInitializer(Splits):
+    global LearnWorkerSplits
+    LearnWorkerSplits = Splits
+
+def LearnWorkerTask(Task, NJobs, Verbose):
+    return LearnTaskRunner(Task, LearnWorkerSplits[Task.Mode], NJobs, Verbose, Capture=True)
+
+#This function fits the LearnTasks on the Splits of their mode ({Mode: LearnDataSplitter result}), and yields
+# (Task, Classifier, Metrics) in the order of the tasks, once the output of the task is printed.
+#With Threads > 1, the tasks run at the same time in a process pool of up to Threads workers, and the Threads cores are
+# shared by the workers: each Logistic or Random Forest fit uses Threads // workers of them (n_jobs). A single task
+# runs in this process, and its fit uses all the Threads cores.
+#The results do not depend on Threads.
+def LearnTasksScheduler(Tasks, Splits, Threads=1, Verbose=False):
+    if Threads <= 1 or len(Tasks) <= 1:
+        NJobs = Threads if Threads > 1 else None
+        for Task in Tasks:
+            for Line in Task.Banner:
+                print(Line)
+            Classifier, Metrics, Output = LearnTaskRunner(Task, Splits[Task.Mode], NJobs, Verbose)
+            yield Task, Classifier, Metrics
+        return
+    Workers = min(Threads, len(Tasks))
+    with ProcessPoolExecutor(max_workers=Workers, initializer=LearnWorkerInitializer, initargs=(Splits,)) as Pool:
+        Futures = [Pool.submit(LearnWorkerTask, Task, max(1, Threads // Workers), Verbose) for Task in Tasks]
+        for Task, Future in zip(Tasks, Futures):
+            for Line in Task.Banner:
+                print(Line)
+            Classifier, Metrics, Output = Future.result()
+            sys.stdout.write(Output)
+            yield Task, Classifier, Metrics
+
 #Convert 0/1 numpy array into Predicted Results
 def Convert01ToPredictedResults(Num):
     if Num == 1:
@@ -93,103 +270,227 @@ def PredictResultsFromModel(Data, InputFile, Classifier, ClassifierType, OutputS
     fi.close()
     fo.close()
 
-#Evaluate classifier
-def CompareMLResultsAndROCCurves(X_train, X_test, y_train, y_test, Classifier, ClassifierType, OutputSummaryFileName, OutputPDFName, Verbose):
-    print("Evaluating the classifier: "+ClassifierType)
-    fo=open(OutputSummaryFileName,"a")
-    fo.write("Evaluating the classifier: "+ClassifierType+"\n")
-    fo.write("Training data: " + str(X_train.shape[0])+"\n"+"Testing data: " + str(X_test.shape[0])+"\n")
-    #Analyze training set:
-    datasettype = "training"
-    data_x = X_train
-    data_y = y_train
-    y_pred = Classifier.predict(data_x)
-    print("Use training datasets:")
-    fo.write("\nUse training datasets:\n")
-    print("Accuracy of "+ClassifierType+" Classifier on " + datasettype + " dataset: {:.2f}".format(
-        Classifier.score(data_x, data_y) * 100) + " %")
-    fo.write("Accuracy of "+ClassifierType+" Classifier on " + datasettype + " dataset: {:.2f}".format(
-        Classifier.score(data_x, data_y) * 100) + " %\n")
+#Worker process state of PredictResultsStreamer, set once per worker, so that the classifiers are only sent once.
+PredictWorkerClassifiers = None
 
+def PredictWorkerInitializer(Classifiers):
+    global PredictWorkerClassifiers
+    PredictWorkerClassifiers = Classifiers
+
+#This function predicts the patterns of DataList (one array per classifier) with their classifiers, and returns the
+# (Labels, Probabilities) of each one. The probabilities of Target are only computed with Probability=True (NaN otherwise).
+def PredictChunkPredictor(Classifiers, DataList, Probability):
+    Results = []
+    for Classifier, Data in zip(Classifiers, DataList):
+        if Data.shape[0] == 0:
+            Results.append((np.zeros(0, dtype=np.int64), np.zeros(0)))
+            continue
+        Labels = Classifier.predict(Data).astype(np.int64)
+        if Probability == True:
+            Probabilities = Classifier.predict_proba(Data)[:, 1]
+        else:
+            Probabilities = np.full(Data.shape[0], np.nan)
+        Results.append((Labels, Probabilities))
+    return Results
+
+def PredictWorkerChunk(DataList, Probability):
+    return PredictChunkPredictor(PredictWorkerClassifiers, DataList, Probability)
+
+#This function formats the output of one chunk for one classifier: Pattern, Label, and the probability of Target with
+# Probability=True. The lines are formatted once per unique pattern, and repeated in the input order (Inverse).
+def PredictChunkFormatter(Unique, Inverse, Labels, Probabilities, Probability):
+    Names = np.array(["Control", "Target"])[Labels].tolist()
+    if Probability == True:
+        Lines = [Pattern + "\t" + Name + "\t" + "{:.6f}".format(Prob) + "\n" \
+                 for Pattern, Name, Prob in zip(Unique.tolist(), Names, Probabilities.tolist())]
+    else:
+        Lines = [Pattern + "\t" + Name + "\n" for Pattern, Name in zip(Unique.tolist(), Names)]
+    return "".join([Lines[i] for i in Inverse.tolist()])
+
+#Predict results of large pattern files. The input is read once, in chunks of ChunkSize patterns, and each chunk is
+# predicted by all the Models ((Classifier, ClassifierType, OutputSummaryFileName) tuples) and written right away, so
+# that the memory used does not depend on the size of the input. The output is the same as PredictResultsFromModel,
+# with a 3rd column (probability of Target) if Probability=True.
+#Only the unique patterns of a chunk are predicted, and only if they are not in the ModelStore.PredictionCache of their
+# model (Caches, one per model; in-memory caches are used if None).
+#With Workers > 1, the chunks are predicted in a process pool, and written in the input order.
+def PredictResultsStreamer(InputFile, Models, ChunkSize=MachineLearningDataParser.PatternChunkSize, Probability=False, Workers=1, \
+                           Caches=None):
+    Classifiers = [Classifier for Classifier, ClassifierType, OutputSummaryFileName in Models]
+    if Caches is None:
+        Caches = [ModelStore.PredictionCache() for Model in Models]
+    for Classifier, ClassifierType, OutputSummaryFileName in Models:
+        print("Running Prediction using "+str(ClassifierType)+"...")
+    Outputs = [open(OutputSummaryFileName, "w") for Classifier, ClassifierType, OutputSummaryFileName in Models]
+
+    #Looks up a chunk in the caches, and returns its state and the data to predict for each model
+    def ChunkLookup(Patterns, Data):
+        Unique, First, Inverse = np.unique(np.array(Patterns), return_index=True, return_inverse=True)
+        Lookups = [Cache.Lookup(Unique, Probability) for Cache in Caches]
+        return (Unique, Inverse, Lookups), [Data[First[Missing]] for Labels, Probabilities, Missing in Lookups]
+
+    #Merges the predictions of a chunk into the caches, and writes it
+    def ChunkWriter(State, Results):
+        Unique, Inverse, Lookups = State
+        for fo, Cache, (Labels, Probabilities, Missing), Result in zip(Outputs, Caches, Lookups, Results):
+            Labels[Missing], Probabilities[Missing] = Result
+            Cache.Update(Unique[Missing], *Result)
+            fo.write(PredictChunkFormatter(Unique, Inverse, Labels, Probabilities, Probability))
+
+    Chunks = MachineLearningDataParser.PatternChunksReader(InputFile, ChunkSize)
+    if Workers <= 1:
+        for Patterns, Data in Chunks:
+            State, DataList = ChunkLookup(Patterns, Data)
+            ChunkWriter(State, PredictChunkPredictor(Classifiers, DataList, Probability))
+    else:
+        with ProcessPoolExecutor(max_workers=Workers, initializer=PredictWorkerInitializer, initargs=(Classifiers,)) as Pool:
+            Pending = collections.deque()
+            for Patterns, Data in Chunks:
+                State, DataList = ChunkLookup(Patterns, Data)
+                Pending.append((State, Pool.submit(PredictWorkerChunk, DataList, Probability)))
+                while len(Pending) >= Workers * PredictTasksPerWorker or (len(Pending) > 0 and Pending[0][1].done()):
+                    State, Future = Pending.popleft()
+                    ChunkWriter(State, Future.result())
+            while len(Pending) > 0:
+                State, Future = Pending.popleft()
+                ChunkWriter(State, Future.result())
+    for fo in Outputs:
+        fo.close()
+    for Cache, (Classifier, ClassifierType, OutputSummaryFileName) in zip(Caches, Models):
+        Cache.Save()
+        print(ClassifierType + ": " + str(Cache.Predicted) + " unique patterns predicted, " + str(Cache.Reused) + " reused")
+
+#Whether the labels predicted by a classifier are the argmax of its probabilities (Logistic regression and Random
+# Forest). They are not for the SVMs, whose probabilities are calibrated apart from their decision.
+def LabelsFromProbabilitiesChecker(Classifier):
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.ensemble import RandomForestClassifier
+    return isinstance(Classifier, (LogisticRegression, RandomForestClassifier))
+
+#This function runs the inference of a classifier on a dataset, and derives all the metrics from its outputs: accuracy,
+# confusion matrix, classification report, AUC (from the probabilities) and ROC curve.
+#The probabilities are predicted once, and the labels are derived from them when they agree with predict (see
+# LabelsFromProbabilitiesChecker); otherwise (SVM), predict is a second inference pass.
+def SplitEvaluator(Classifier, data_x, data_y):
+    from sklearn.metrics import confusion_matrix, classification_report, roc_auc_score, roc_curve
+    Probabilities = Classifier.predict_proba(data_x)
+    if LabelsFromProbabilitiesChecker(Classifier):
+        y_pred = Classifier.classes_[Probabilities.argmax(axis=1)]
+    else:
+        y_pred = Classifier.predict(data_x)
+    y_proba = Probabilities[:, 1]
+    tn, fp, fn, tp = confusion_matrix(data_y, y_pred, labels=[0, 1]).ravel()
+    fpr, tpr, thresholds = roc_curve(data_y, y_proba)
+    return {"Labels": np.asarray(data_y), "Predicted": y_pred, "Probabilities": y_proba, \
+            "Accuracy": float(np.mean(y_pred == np.asarray(data_y))), "ConfusionMatrix": (int(tn), int(fp), int(fn), int(tp)), \
+            "Report": classification_report(data_y, y_pred), \
+            "ReportDict": classification_report(data_y, y_pred, output_dict=True), \
+            "AUC": float(roc_auc_score(data_y, y_proba)), "ROC": (fpr, tpr, thresholds)}
+
+#This function prints and writes the evaluation of one dataset (training/testing), from SplitEvaluator.
+def SplitReportWriter(fo, Evaluation, ClassifierType, datasettype, Verbose):
+    if datasettype == "training":
+        print("Use training datasets:")
+        fo.write("\nUse training datasets:\n")
+        print("Accuracy of "+ClassifierType+" Classifier on " + datasettype + " dataset: {:.2f}".format(Evaluation["Accuracy"] * 100) + " %")
+    else:
+        print("Use testing datasets:")
+        fo.write("Use testing datasets:\n")
+        print("Accuracy of "+ClassifierType+" Classifier on " + datasettype + " dataset: {:.2f}".format(Evaluation["Accuracy"] * 100) + " %\n")
+    fo.write("Accuracy of "+ClassifierType+" Classifier on " + datasettype + " dataset: {:.2f}".format(Evaluation["Accuracy"] * 100) + " %\n")
     if Verbose == True:
         print("Confusion matrix:")
     fo.write("Confusion matrix:\n")
     tablewidth = "{0:20}{1:10}{2:10}"
-    tn, fp, fn, tp=confusion_matrix(data_y, y_pred).ravel()
-    if Verbose == True:
-        print(tablewidth.format("Actual\Predicted","0","1"))
-        print(tablewidth.format("   Actual 0   ", str(tn), str(fp)))
-        print(tablewidth.format("   Actual 1   ", str(fn), str(tp)))
-        print("TN="+str(tp)+"\tFP="+str(fp)+"\tFN="+str(fn)+"\tTP="+str(tp))
-    fo.write(tablewidth.format("Actual\Predicted","0","1")+"\n")
-    fo.write(tablewidth.format("   Actual 0   ", str(tn), str(fp))+"\n")
-    fo.write(tablewidth.format("   Actual 1   ", str(fn), str(tp))+"\n")
-    fo.write("TN="+str(tn)+"\tFP="+str(fp)+"\tFN="+str(fn)+"\tTP="+str(tp)+"\n")
-    if Verbose == True:
-        print("Summary report:")
-        print(classification_report(data_y, y_pred))
-    fo.write("Summary report:\n")
-    fo.write(classification_report(data_y, y_pred)+"\n\n")
-
-    plt.figure(figsize=(16, 9))
-    x1 = plt.subplot(1, 2, 1)
-    curve_roc_auc = roc_auc_score(data_y, Classifier.predict(data_x))
-    fpr, tpr, thresholds = roc_curve(data_y, Classifier.predict_proba(data_x)[:, 1])
-    plt.plot(fpr, tpr, label=ClassifierType+" Classifier (area = %0.3f)" % curve_roc_auc)
-    plt.plot([0, 1], [0, 1], marker='.', lw=2, ls='--', mfc='g', mec='g', color='r')
-    plt.xlim([0.0, 1.02])
-    plt.ylim([0.0, 1.02])
-    plt.xlabel("False Positive Rate (1-Specificity)")
-    plt.ylabel("True Positive Rate (Sensitivity)")
-    plt.grid(True, linewidth=1, linestyle='--')
-    plt.title("Training dataset, accuracy: "+"{:.2f}".format(Classifier.score(data_x, data_y) * 100) + " %")
-    plt.legend(loc="lower right")
-
-
-    # Analyze testing set:
-    datasettype = "testing"
-    data_x = X_test
-    data_y = y_test
-    y_pred = Classifier.predict(data_x)
-    print("Use testing datasets:")
-    fo.write("Use testing datasets:\n")
-    print("Accuracy of "+ClassifierType+" Classifier on " + datasettype + " dataset: {:.2f}".format(
-        Classifier.score(data_x, data_y) * 100) + " %\n")
-    fo.write("Accuracy of "+ClassifierType+" Classifier on " + datasettype + " dataset: {:.2f}".format(
-        Classifier.score(data_x, data_y) * 100) + " %\n")
-    if Verbose == True:
-        print("Confusion matrix:")
-    fo.write("Confusion matrix:\n")
-    tablewidth = "{0:20}{1:10}{2:10}"
-    tn, fp, fn, tp=confusion_matrix(data_y, y_pred).ravel()
+    tn, fp, fn, tp = Evaluation["ConfusionMatrix"]
     if Verbose == True:
-        print(tablewidth.format("Actual\Predicted","0","1"))
+        print(tablewidth.format("Actual\\Predicted","0","1"))
         print(tablewidth.format("   Actual 0   ", str(tn), str(fp)))
         print(tablewidth.format("   Actual 1   ", str(fn), str(tp)))
         print("TN="+str(tp)+"\tFP="+str(fp)+"\tFN="+str(fn)+"\tTP="+str(tp))
-    fo.write(tablewidth.format("Actual\Predicted","0","1")+"\n")
+    fo.write(tablewidth.format("Actual\\Predicted","0","1")+"\n")
     fo.write(tablewidth.format("   Actual 0   ", str(tn), str(fp))+"\n")
     fo.write(tablewidth.format("   Actual 1   ", str(fn), str(tp))+"\n")
     fo.write("TN="+str(tn)+"\tFP="+str(fp)+"\tFN="+str(fn)+"\tTP="+str(tp)+"\n")
     if Verbose == True:
         print("Summary report:")
-        print(classification_report(data_y, y_pred))
+        print(Evaluation["Report"])
     fo.write("Summary report:\n")
-    fo.write(classification_report(data_y, y_pred)+"\n")
-
-    plt.subplot(1, 2, 2, sharey=x1)
-    curve_roc_auc = roc_auc_score(data_y, Classifier.predict(data_x))
-    fpr, tpr, thresholds = roc_curve(data_y, Classifier.predict_proba(data_x)[:, 1])
-    plt.plot(fpr, tpr, label=ClassifierType+" Classifier (area = %0.3f)" % curve_roc_auc)
-    plt.plot([0, 1], [0, 1], marker='.', lw=2, ls='--', mfc='g', mec='g', color='r')
-    plt.xlim([0.0, 1.02])
-    plt.ylim([0.0, 1.02])
-    plt.xlabel("False Positive Rate (1-Specificity)")
-    plt.ylabel("True Positive Rate (Sensitivity)")
-    plt.grid(True, linewidth=1, linestyle='--')
-    plt.title("Testing dataset, accuracy: " + "{:.2f}".format(Classifier.score(data_x, data_y) * 100) + " %")
-    plt.legend(loc="lower right")
-
-    plt.suptitle("Comparison of Receiver operating characteristic (ROC) curves on training and testing datasets: "+ClassifierType)
-    plt.savefig(OutputPDFName)
+    fo.write(Evaluation["Report"] + ("\n\n" if datasettype == "training" else "\n"))
+
+#This function draws the ROC curves of the training and testing datasets, side by side, into OutputPDFName.
+#The figure is made with the object-oriented API, not pyplot, so nothing keeps it alive once it is saved.
+def ROCCurvesPlotter(Evaluations, ClassifierType, OutputPDFName):
+    import matplotlib.figure
+    Figure = matplotlib.figure.Figure(figsize=(16, 9))
+    x1 = None
+    for Position, (datasettype, Evaluation) in enumerate(Evaluations.items()):
+        Axes = Figure.add_subplot(1, 2, Position + 1, sharey=x1)
+        if x1 is None:
+            x1 = Axes
+        fpr, tpr, thresholds = Evaluation["ROC"]
+        Axes.plot(fpr, tpr, label=ClassifierType+" Classifier (area = %0.3f)" % Evaluation["AUC"])
+        Axes.plot([0, 1], [0, 1], marker='.', lw=2, ls='--', mfc='g', mec='g', color='r')
+        Axes.set_xlim([0.0, 1.02])
+        Axes.set_ylim([0.0, 1.02])
+        Axes.set_xlabel("False Positive Rate (1-Specificity)")
+        Axes.set_ylabel("True Positive Rate (Sensitivity)")
+        Axes.grid(True, linewidth=1, linestyle='--')
+        Axes.set_title(datasettype.capitalize() + " dataset, accuracy: " + "{:.2f}".format(Evaluation["Accuracy"] * 100) + " %")
+        Axes.legend(loc="lower right")
+    Figure.suptitle("Comparison of Receiver operating characteristic (ROC) curves on training and testing datasets: "+ClassifierType)
+    Figure.savefig(OutputPDFName)
+    Figure.clear()
+
+#The machine-readable results of a classifier, next to its summary report (Prefix.ML.Mode.Classifier.Metrics.json/npz)
+def MetricsFilesNames(OutputSummaryFileName):
+    if OutputSummaryFileName.endswith(".txt"):
+        OutputSummaryFileName = OutputSummaryFileName[:-len(".txt")]
+    return OutputSummaryFileName + ".Metrics.json", OutputSummaryFileName + ".Metrics.npz"
+
+#This function returns the metrics of the evaluations of a classifier (the content of the JSON file, see MetricsSaver):
+# {"Classifier": ClassifierType, Dataset: {"Size", "Accuracy", "AUC", "ConfusionMatrix", "Report"}}
+def MetricsSummarizer(Evaluations, ClassifierType):
+    Metrics = {"Classifier": ClassifierType}
+    for datasettype, Evaluation in Evaluations.items():
+        tn, fp, fn, tp = Evaluation["ConfusionMatrix"]
+        Metrics[datasettype] = {"Size": int(len(Evaluation["Labels"])), "Accuracy": Evaluation["Accuracy"], \
+                                "AUC": Evaluation["AUC"], "ConfusionMatrix": {"TN": tn, "FP": fp, "FN": fn, "TP": tp}, \
+                                "Report": Evaluation["ReportDict"]}
+    return Metrics
+
+#This function saves the evaluations of a classifier: the metrics in the JSON file, and the labels, predictions,
+# probabilities and ROC curves of each dataset in the NPZ file (arrays named Dataset.Array, e.g. testing.fpr).
+def MetricsSaver(Evaluations, ClassifierType, OutputSummaryFileName):
+    JsonFileName, NpzFileName = MetricsFilesNames(OutputSummaryFileName)
+    Metrics = MetricsSummarizer(Evaluations, ClassifierType)
+    Arrays = {}
+    for datasettype, Evaluation in Evaluations.items():
+        fpr, tpr, thresholds = Evaluation["ROC"]
+        Arrays.update({datasettype + ".labels": Evaluation["Labels"], datasettype + ".predicted": Evaluation["Predicted"], \
+                       datasettype + ".probabilities": Evaluation["Probabilities"], datasettype + ".fpr": fpr, \
+                       datasettype + ".tpr": tpr, datasettype + ".thresholds": thresholds})
+    fo = open(JsonFileName, "w")
+    json.dump(Metrics, fo, indent=1)
+    fo.close()
+    np.savez(NpzFileName, **Arrays)
+
+#This function evaluates a fitted classifier on the training and testing datasets: inference runs once per dataset,
+# and the summary report, the ROC curves (OutputPDFName, None to skip them) and the metrics files (see MetricsSaver)
+# are made from it.
+def CompareMLResultsAndROCCurves(X_train, X_test, y_train, y_test, Classifier, ClassifierType, OutputSummaryFileName, OutputPDFName, Verbose):
+    print("Evaluating the classifier: "+ClassifierType)
+    fo=open(OutputSummaryFileName,"a")
+    fo.write("Evaluating the classifier: "+ClassifierType+"\n")
+    fo.write("Training data: " + str(X_train.shape[0])+"\n"+"Testing data: " + str(X_test.shape[0])+"\n")
+    Evaluations = collections.OrderedDict()
+    Evaluations["training"] = SplitEvaluator(Classifier, X_train, y_train)
+    Evaluations["testing"] = SplitEvaluator(Classifier, X_test, y_test)
+    for datasettype, Evaluation in Evaluations.items():
+        SplitReportWriter(fo, Evaluation, ClassifierType, datasettype, Verbose)
+    if OutputPDFName is not None:
+        ROCCurvesPlotter(Evaluations, ClassifierType, OutputPDFName)
+    if OutputSummaryFileName != os.devnull:
+        MetricsSaver(Evaluations, ClassifierType, OutputSummaryFileName)
     fo.close()
+    return Evaluations
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+"""
+ModelStore.py
+This script is a part of piTargetClassifier project.
+This script saves the classifiers fitted in Learn mode (Prefix.ML.Mode.Classifier.model, next to their summary report),
+ and loads them back in Predict mode (--model), so that new patterns are scored without aligning and fitting again.
+A model file is a pickle of a dict: the fitted classifier, its name and type, the Learn mode used (All/Best), the pattern
+ length, the weights of the alignment (if known), a sha256 checksum of the training data and the sklearn version.
+Model files are pickles: only load the files you trust.
+The predictions of a saved model are memoized in a PredictionCache, stored next to it (Model.model.PredictCache.npz).
+Requied packages: numpy, sklearn
+Yu Sun, ysun43@ur.rochester.edu, 2018-11
+"""
+
+import os
+import pickle
+import collections
+import hashlib
+import numpy as np
+
+ModelVersion = 1
+ModelSuffix = ".model"
+#Maximum number of patterns kept in a PredictionCache
+PredictCacheSizeLimit = 1 << 20
+
+#The model file of a classifier, from the name of its summary report (Prefix.ML.Mode.Classifier.txt)
+def ModelFileName(OutputSummaryFileName):
+    if OutputSummaryFileName.endswith(".txt"):
+        OutputSummaryFileName = OutputSummaryFileName[:-len(".txt")]
+    return OutputSummaryFileName + ModelSuffix
+
+#The name of a classifier (Mode.Classifier, e.g. All.Logistic.CV5), used for the Predict output file
+def ModelName(OutputSummaryFileName, OutputPrefix):
+    return os.path.basename(ModelFileName(OutputSummaryFileName))[len(os.path.basename(OutputPrefix) + ".ML."):-len(ModelSuffix)]
+
+#This function hashes the training data (the Control and Target features) of a classifier.
+def TrainingDataHasher(Arrays):
+    Hasher = hashlib.sha256()
+    for Array in Arrays:
+        Hasher.update(str(Array.shape).encode())
+        for BlockStart in range(0, Array.shape[0], 1 << 16):
+            Hasher.update(np.ascontiguousarray(Array[BlockStart:BlockStart + (1 << 16)]).tobytes())
+    return Hasher.hexdigest()
+
+#This function saves a classifier fitted in Learn mode (see MachineLearningModels) next to its summary report, with its
+# metadata, and returns the model file. TrainingData is the (Control, Target) features it was fitted on.
+#The file is written atomically.
+def ModelSaver(OutputSummaryFileName, OutputPrefix, Classifier, ClassifierType, Mode, TrainingData, Weights):
+    import sklearn
+    File = ModelFileName(OutputSummaryFileName)
+    Model = {"Version": ModelVersion, "Classifier": Classifier, "ClassifierType": ClassifierType, \
+             "Name": ModelName(OutputSummaryFileName, OutputPrefix), "Mode": Mode, "PatternLength": int(TrainingData[0].shape[1]), \
+             "Weights": Weights, "Checksum": TrainingDataHasher(TrainingData), "sklearn": sklearn.__version__}
+    TempFile = File + ".tmp"
+    fo = open(TempFile, "wb")
+    pickle.dump(Model, fo, protocol=pickle.HIGHEST_PROTOCOL)
+    fo.close()
+    os.replace(TempFile, File)
+    print("Model saved: " + File)
+    return File
+
+#This function reads a model file, and returns its dict, or None if it is not a model file of this version.
+#The sha256 of the file is added as FileChecksum, to tell apart the caches of the models saved under the same name.
+def ModelLoader(File):
+    import sklearn
+    fi = open(File, "rb")
+    Content = fi.read()
+    fi.close()
+    Model = pickle.loads(Content)
+    if not isinstance(Model, dict) or Model.get("Version") != ModelVersion:
+        return None
+    Model["FileChecksum"] = hashlib.sha256(Content).hexdigest()
+    if Model["sklearn"] != sklearn.__version__:
+        print("The model " + File + " was saved with sklearn " + Model["sklearn"] + ", running " + sklearn.__version__)
+    return Model
+
+def PredictionCacheFileName(ModelFile):
+    return ModelFile + ".PredictCache.npz"
+
+#This class memoizes the predictions of one classifier: pattern -> (label, probability of Target). The probability is
+# NaN until it is asked for. Patterns are few (short strings of the weight values) and repeated a lot, so only the
+# patterns never seen are predicted. The least recently used patterns are dropped beyond SizeLimit.
+#With a File, the cache is loaded from it and saved back by Save(); Stamp (the FileChecksum of the model) makes sure it
+# belongs to the same model.
+class PredictionCache:
+    def __init__(self, File=None, Stamp=None, SizeLimit=PredictCacheSizeLimit):
+        self.File = File
+        self.Stamp = Stamp
+        self.SizeLimit = SizeLimit
+        self.Table = collections.OrderedDict()
+        self.Reused = 0
+        self.Predicted = 0
+        if File is not None and os.path.exists(File):
+            Arrays = np.load(File, allow_pickle=False)
+            if str(Arrays["Stamp"]) == str(Stamp):
+                for Pattern, Label, Probability in zip(Arrays["Patterns"].tolist(), Arrays["Labels"].tolist(), \
+                                                       Arrays["Probabilities"].tolist()):
+                    self.Table[Pattern] = (Label, Probability)
+
+    #Returns the labels and probabilities of an array of unique patterns, and the mask of the patterns Missing from the
+    # cache (or without probability, when it is asked for); their labels and probabilities are 0 / NaN.
+    def Lookup(self, Patterns, Probability=False):
+        Labels = np.zeros(len(Patterns), dtype=np.int64)
+        Probabilities = np.full(len(Patterns), np.nan)
+        Missing = np.ones(len(Patterns), dtype=bool)
+        for i, Pattern in enumerate(Patterns.tolist()):
+            Cached = self.Table.get(Pattern)
+            if Cached is not None and (Probability == False or Cached[1] == Cached[1]):
+                self.Table.move_to_end(Pattern)
+                Labels[i], Probabilities[i] = Cached
+                Missing[i] = False
+        self.Reused = self.Reused + int((~Missing).sum())
+        self.Predicted = self.Predicted + int(Missing.sum())
+        return Labels, Probabilities, Missing
+
+    def Update(self, Patterns, Labels, Probabilities):
+        for Pattern, Label, Probability in zip(Patterns.tolist(), Labels.tolist(), Probabilities.tolist()):
+            self.Table[Pattern] = (Label, Probability)
+            self.Table.move_to_end(Pattern)
+        while len(self.Table) > self.SizeLimit:
+            self.Table.popitem(last=False)
+
+    #Write the cache to its file atomically (nothing to do without a File)
+    def Save(self):
+        if self.File is None:
+            return
+        TempFile = self.File + ".tmp.npz"
+        Patterns = list(self.Table.keys())
+        Values = list(self.Table.values())
+        np.savez(TempFile, Stamp=np.array(str(self.Stamp)), Patterns=np.array(Patterns, dtype=str), \
+                 Labels=np.array([Value[0] for Value in Values], dtype=np.int64), \
+                 Probabilities=np.array([Value[1] for Value in Values], dtype=np.float64))
+        os.replace(TempFile, self.File)
@@ -8,9 +8,41 @@ Requied packages: numpy
 Yu Sun, ysun43@ur.rochester.edu, 2018-11
 """
 
+import os
 import sys
+import itertools
+import collections
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from bin import SequencesAligner
+from bin import AlignmentOutputWriter
+from bin import FastaReader
+from bin import AlignmentResultStore
+from bin import FeatureCache
+from bin import AlignCheckpoint
+from bin import AlignmentCache
+from bin import SeedIndex
+from bin import TranscriptomeIndex
+
+#Maximum number of RNAs sent to a worker process in one task, and the number of tasks kept in flight per worker.
+ChunkSizeLimit = 32
+TasksPerWorker = 4
+
+#This object stores one set of RNAs (e.g. Targets or Control) to be aligned against the piRNA panel.
+#RNAFile is the FASTA file, which is streamed during the alignment, and RNANum is its number of records.
+#Alternatively, the RNAs are read from Index, a TranscriptomeIndex.TranscriptomeIndex object (RNAFile is then None).
+#If an AlignmentResultsSummarizer.AlignmentSummaryAccumulator is given, it is updated with the results of every RNA.
+#With an OutputFilePrefix of None, the alignments are not written to files (e.g. kept in memory, see Pipeline).
+class RNASet:
+    def __init__(self, RNAFile, RNANum, OutputFilePrefix, Verbose, Accumulator=None, Index=None):
+        self.RNAFile = RNAFile
+        self.Index = Index
+        self.RNANum = RNANum
+        self.OutputFilePrefix = OutputFilePrefix
+        self.Verbose = Verbose
+        self.Accumulator = Accumulator
+        self.FeatureCacheWritten = False
+        self.StartIndex = 0
 
 #This function cleans up the output files (before writing anything in them)
 def OutputAlignFilesFlusher(OutputPrefix):
@@ -32,6 +64,11 @@ def OutputAlignFilesFlusher(OutputPrefix):
     fopattern_TargetBest.close()
     fopattern_TargetAll.close()
 
+    # The hits files are only written with --hits, remove those of a previous run
+    for SetName in ("Control", "Targets"):
+        if os.path.exists(OutputPrefix + "." + SetName + AlignmentOutputWriter.HitsFileSuffix):
+            os.remove(OutputPrefix + "." + SetName + AlignmentOutputWriter.HitsFileSuffix)
+
 #Use finished percentage to create a progress bar for piRNA-RNA alignment.
 def ProgressBar(CurrRNAId, RNAlen):
     Finished = CurrRNAId / RNAlen * 100
@@ -40,42 +77,263 @@ def ProgressBar(CurrRNAId, RNAlen):
     sys.stdout.write("[%-50s] %d%%" % ('=' * barid, 2 * barid))
     sys.stdout.flush()
 
-#This function generates a numpy array of objects that stores matching results. Each row is an RNA, and each column is a piRNA.
+#This function reads the piRNA FASTA file and encodes it once into a piRNAPanel object.
+#Updated on 2018-11-26, use reversed (but not complement) sequence!
+def piRNAPanelGenerator(piRNAFile):
+    piHeaders = []
+    piSequences = []
+    for piHeader, piSequence in FastaReader.FastaRecordsReader(piRNAFile):
+        piHeaders.append(piHeader)
+        piSequences.append(piSequence.upper()[::-1])
+    return SequencesAligner.piRNAPanel(piHeaders, piSequences)
+
+#This function streams the (Header, Sequence) records of a RNA set, sequences are upper-cased.
+#The first StartIndex records (already aligned, when resuming from a checkpoint) are skipped.
+def RNARecordsGenerator(CurrSet):
+    if CurrSet.Index is not None:
+        for Record in CurrSet.Index.Records(CurrSet.StartIndex):
+            yield Record
+        return
+    for Header, Sequence in itertools.islice(FastaReader.FastaRecordsReader(CurrSet.RNAFile), CurrSet.StartIndex, None):
+        yield (Header, Sequence.upper())
+
+#This function groups the RNA records into lists of ChunkSize records.
+def RNAChunksGenerator(Records, ChunkSize):
+    Chunk = []
+    for Record in Records:
+        Chunk.append(Record)
+        if len(Chunk) == ChunkSize:
+            yield Chunk
+            Chunk = []
+    if len(Chunk) > 0:
+        yield Chunk
+
+#Worker process state, set once per worker by AlignWorkerInitializer, so that the panel is only sent once.
+WorkerPanel = None
+WorkerWeightsTable = None
+WorkerEngine = "direct"
+WorkerSeeds = None
+WorkerScanWindow = SequencesAligner.ScanWindowLength
+WorkerSelector = None
+WorkerIndexes = {}
+
+def AlignWorkerInitializer(Panel, WeightsTable, Engine, Seeds, ScanWindow, Selector):
+    global WorkerPanel, WorkerWeightsTable, WorkerEngine, WorkerSeeds, WorkerScanWindow, WorkerSelector
+    WorkerPanel = Panel
+    WorkerWeightsTable = WeightsTable
+    WorkerEngine = Engine
+    WorkerSeeds = Seeds
+    WorkerScanWindow = ScanWindow
+    WorkerSelector = Selector
+
+#This function returns the sequence of a record sent to a worker: either the sequence itself, or the (Prefix, SetName,
+# Number) of the RNA in a TranscriptomeIndex, which each worker memory-maps once.
+def WorkerSequenceResolver(Source):
+    if isinstance(Source, str):
+        return Source
+    Prefix, SetName, Number = Source
+    if (Prefix, SetName) not in WorkerIndexes:
+        WorkerIndexes[(Prefix, SetName)] = TranscriptomeIndex.TranscriptomeIndex(Prefix, SetName)
+    return WorkerIndexes[(Prefix, SetName)].Sequence(Number)
+
+#This function runs in a worker process and aligns the panel against a chunk of (Header, Source, Subset) records.
+#The target sequences are not sent back (the main process still has them), only the result arrays.
+def AlignRNAChunk(Chunk):
+    Results = []
+    for Header, Source, Subset in Chunk:
+        CurrTarget = SequencesAligner.RNAClass(Header, WorkerSequenceResolver(Source))
+        PanelResult = SequencesAligner.PairingPanelAligner(WorkerPanel, CurrTarget, WorkerWeightsTable, Subset, WorkerEngine, \
+                                                           WorkerSeeds, WorkerScanWindow, WorkerSelector)
+        PanelResult.TargetSeq = None
+        Results.append(PanelResult)
+    return Results
+
+#This function streams the (Header, Sequence, Source, Subset, Lookup) records of a RNA set. Source is what is sent to
+# the workers (see WorkerSequenceResolver). Without an AlignmentCache, Subset and Lookup are None; otherwise Lookup is
+# the (Found, Cached) result of AlignmentCache.Lookup, and Subset is the mask of the piRNAs to align.
+def RNALookupsGenerator(CurrSet, Cache):
+    for Number, (Header, Sequence) in enumerate(RNARecordsGenerator(CurrSet), CurrSet.StartIndex):
+        if CurrSet.Index is None:
+            Source = Sequence
+        else:
+            Source = (CurrSet.Index.Prefix, CurrSet.Index.SetName, Number)
+        if Cache is None:
+            yield (Header, Sequence, Source, None, None)
+        else:
+            Found, Cached = Cache.Lookup(Sequence)
+            yield (Header, Sequence, Source, ~Found, (Found, Cached))
+
+#This function aligns the panel against all RNAs of the RNA sets, and yields (SetIndex, PanelPairing) pairs.
+#Within each set, the results are always yielded in the input order. With Threads > 1, RNAs are spread across a
+# process pool in chunks, and the chunks of all sets are submitted in turn, so that the sets are aligned at the same time.
+#With an AlignmentCache.AlignmentCache, only the pairs missing from the cache are aligned.
+#Engine is the scoring engine of SequencesAligner.PairingPanelAligner, Seeds its SeedIndex.SeedIndex, if any, and
+# ScanWindow the number of offsets it scans at once, and Selector its SequencesAligner.HitsSelector, if any.
+def PanelPairingsGenerator(Sets, Panel, WeightsTable, Threads, Cache=None, Engine="direct", Seeds=None, \
+                           ScanWindow=SequencesAligner.ScanWindowLength, Selector=None):
+    if Threads <= 1:
+        for SetIndex, CurrSet in enumerate(Sets):
+            for Header, Sequence, Source, Subset, Lookup in RNALookupsGenerator(CurrSet, Cache):
+                CurrTarget = SequencesAligner.RNAClass(Header, Sequence)
+                PanelResult = SequencesAligner.PairingPanelAligner(Panel, CurrTarget, WeightsTable, Subset, Engine, Seeds, \
+                                                                   ScanWindow, Selector)
+                if Lookup is not None:
+                    Cache.Merge(PanelResult, *Lookup)
+                yield SetIndex, PanelResult
+        return
+    TotalRNANum = sum(CurrSet.RNANum - CurrSet.StartIndex for CurrSet in Sets)
+    ChunkSize = max(1, min(ChunkSizeLimit, int(TotalRNANum / (Threads * TasksPerWorker))))
+    Chunks = [RNAChunksGenerator(RNALookupsGenerator(CurrSet, Cache), ChunkSize) for CurrSet in Sets]
+    Pending = [collections.deque() for CurrSet in Sets]
+    Active = list(range(len(Sets)))
+    with ProcessPoolExecutor(max_workers=Threads, initializer=AlignWorkerInitializer, initargs=(Panel, WeightsTable, Engine, Seeds, \
+                                                                                                 ScanWindow, Selector)) as Pool:
+        while True:
+            # Keep the pool busy, taking the next chunk from each set in turn
+            while len(Active) > 0 and sum(len(Queue) for Queue in Pending) < Threads * TasksPerWorker:
+                SetIndex = Active.pop(0)
+                Chunk = next(Chunks[SetIndex], None)
+                if Chunk is not None:
+                    Tasks = [(Header, Source, Subset) for Header, Sequence, Source, Subset, Lookup in Chunk]
+                    Pending[SetIndex].append((Chunk, Pool.submit(AlignRNAChunk, Tasks)))
+                    Active.append(SetIndex)
+            Heads = [Queue[0][1] for Queue in Pending if len(Queue) > 0]
+            if len(Heads) == 0:
+                break
+            wait(Heads, return_when=FIRST_COMPLETED)
+            for SetIndex, Queue in enumerate(Pending):
+                while len(Queue) > 0 and Queue[0][1].done():
+                    Chunk, Future = Queue.popleft()
+                    for (Header, Sequence, Source, Subset, Lookup), PanelResult in zip(Chunk, Future.result()):
+                        PanelResult.TargetSeq = Sequence
+                        if Lookup is not None:
+                            Cache.Merge(PanelResult, *Lookup)
+                        yield SetIndex, PanelResult
+
+#This function stores the PanelPairing of one RNA into the result store (row rnaIndex) and the summary accumulator,
+# if any, and saves the alignments to the output files through an AlignmentOutputWriter.AlignmentOutputSink.
+#Alignment.txt contains all the alignments and position, score info; while the Pattern.txt only contains critical
+# info for the classifier: RNA name, piRNA name, topID and scoring pattern
+#With a minimum score, only the reported pairs are summarized and written (see SequencesAligner.PanelPairingReported).
+def PanelPairingSaver(ResultStore, Accumulator, CacheWriter, rnaIndex, PanelResult, Panel, OutputSink):
+    Reported = SequencesAligner.PanelPairingReported(PanelResult)
+    if ResultStore is not None:
+        ResultStore.AddPanelPairing(rnaIndex, PanelResult)
+    if Accumulator is not None:
+        if Reported is None:
+            Accumulator.Update(PanelResult.Patterns, PanelResult.BinPos)
+        else:
+            Accumulator.Update(PanelResult.Patterns[Reported], PanelResult.BinPos[Reported])
+    if CacheWriter is not None:
+        CacheWriter.Update(rnaIndex, PanelResult)
+    if OutputSink is not None:
+        OutputSink.WritePanelPairing(PanelResult, Panel, Reported)
+
+#This function records the progress of all sets in the checkpoint: the output files are written to the disk first,
+# so that the recorded sizes only cover complete records.
+def CheckpointSaver(Checkpoint, Sets, OutputSinks, Counters):
+    for CurrSet, OutputSink, Counter in zip(Sets, OutputSinks, Counters):
+        OutputSink.Flush(Sync=True)
+        Summary = None if CurrSet.Accumulator is None else CurrSet.Accumulator.State()
+        Checkpoint.UpdateSet(CurrSet.OutputFilePrefix, Counter, OutputSink.Offsets(), Summary)
+    Checkpoint.Save()
+
+#This function aligns several RNA sets (RNASet objects) against the piRNA panel, and returns a list of
+# AlignmentResultStore objects, one per set. In each store, RNAs are in input order, and so are the piRNAs.
 #piRNA sequences have been reversed in this function.
-def ObjectsMatrixGenerator(RNAData, piRNAData, RNAlen, piRNAlen, Weights, OutputFilePrefix, Verbose):
-    piRNARNA_AlignObjects = np.zeros((int(RNAlen / 2), int(piRNAlen / 2)), dtype=object)
-    Counter=0
-    for rnaIndex in range(0, RNAlen, 2):
-        Header = RNAData[rnaIndex].strip()[1:]
-        Sequence = RNAData[rnaIndex + 1].strip().upper()
-        Counter=Counter+1
-        if Verbose == True:
-            print("Processing RNA: "+Header)
-        elif Verbose == False:
-            if (Counter==RNAlen/2):
-                ProgressBar(Counter, RNAlen/2)
-                print("\nDone.")
+#The whole piRNA panel is aligned against one RNA at a time (see SequencesAligner.PairingPanelAligner), using Threads
+# worker processes. The output files are identical to a serial run.
+#With BackgroundWriter=True, the output files are written by a background thread.
+#With KeepResults=False, no store is built (the list contains None), and only the output files and the summary
+# accumulators of the sets are updated, so that the memory does not grow with the number of pairs.
+#With a FeatureCachePrefix, the features of the pattern files are also written to the binary feature cache (see
+# FeatureCache.FeatureCacheWriter) when possible, and the FeatureCacheWritten attribute of each set is set to True.
+#With an AlignCheckpoint.AlignCheckpoint, the progress is recorded periodically. If the checkpoint already holds the
+# state of a set (--resume), its output files are trimmed to the recorded sizes, its accumulator is restored, and the
+# alignment continues from the first unfinished RNA (the result store and the feature cache are then incomplete/skipped).
+#With an AlignCacheFile, the pairs already aligned in previous runs are read from this AlignmentCache.AlignmentCache
+# (limited to AlignCacheSize MB), and the new ones are added to it.
+#Engine is the scoring engine, "direct" or "fft" (see SequencesAligner.AlignEngines); both give the same results.
+#With a MinScore, only the pairs whose best score reaches it are reported, and a SeedIndex.SeedIndex (seeds of SeedLength
+# nt) skips the pairs that can not reach it. The feature cache is then not written.
+#Targets longer than ScanWindow offsets are scanned in windows, so that the memory used does not grow with their length.
+#With a Distance, the alignments of a pair ending less than Distance nt apart are suppressed. With a HitNum, up to HitNum
+# hits of each pair (scoring at least HitScore) are also written to the *Hits.txt file (see SequencesAligner.HitsSelector);
+# the AlignmentCache is then not used.
+def ObjectsMatricesGenerator(Sets, piRNAFile, Weights, Threads, BackgroundWriter=False, KeepResults=True, FeatureCachePrefix=None, \
+                             Checkpoint=None, AlignCacheFile=None, AlignCacheSize=AlignmentCache.AlignCacheSizeLimit, Engine="direct", \
+                             MinScore=None, SeedLength=SeedIndex.SeedLength, ScanWindow=SequencesAligner.ScanWindowLength, \
+                             Distance=0, HitNum=0, HitScore=None):
+    WeightsTable = SequencesAligner.WeightsTableGenerator(Weights)
+    Panel = piRNAPanelGenerator(piRNAFile)
+    Seeds = None
+    if MinScore is not None:
+        Seeds = SeedIndex.SeedIndex(Panel, WeightsTable, MinScore, SeedLength)
+        FeatureCachePrefix = None
+    Selector = None
+    if Distance > 0 or HitNum > 0:
+        Selector = SequencesAligner.HitsSelector(HitNum, HitScore, Distance)
+    Cache = None
+    if AlignCacheFile is not None and HitNum == 0:
+        Cache = AlignmentCache.AlignmentCache(AlignCacheFile, Panel, WeightsTable, AlignCacheSize, Distance, ScanWindow)
+    if Checkpoint is not None:
+        for CurrSet in Sets:
+            State = Checkpoint.SetState(CurrSet.OutputFilePrefix)
+            if State is None:
+                AlignCheckpoint.OutputFilesTruncator(CurrSet.OutputFilePrefix, [0] * (4 + (HitNum > 0)))
             else:
-                ProgressBar(Counter, RNAlen / 2)
-
-        for piIndex in range(0, piRNAlen, 2):
-            piHeader = piRNAData[piIndex].strip()[1:]
-            #Updated on 2018-11-26, use reversed (but not complement) sequence!
-            piSequence = piRNAData[piIndex + 1].strip().upper()[::-1]
-            #print(piHeader + piSequence)
-
-            # Do alignment: piRNA-RNA
-            AlignTg_CurrpiRNA = SequencesAligner.RNAClass(piHeader, piSequence)
-            AlignTg_CurrTarget = SequencesAligner.RNAClass(Header, Sequence)
-            AlignTg_CurrMatrix = SequencesAligner.PairingMatrixGenerator(AlignTg_CurrpiRNA, AlignTg_CurrTarget, Weights)
-            AlignTg_CurrResult = SequencesAligner.PairingResultsWraper(AlignTg_CurrpiRNA, AlignTg_CurrTarget, AlignTg_CurrMatrix)
-            piRNARNA_AlignObjects[int(rnaIndex / 2), int(piIndex / 2)] = AlignTg_CurrResult
-
-            #Pass the pairing info to the alignment visualizer and save them to output files, for the best and all pairings
-            #Alignment.txt contains all the alignments and position, score info; while the Pattern.txt only contains critical
-            # info for the classifier: RNA name, piRNA name, topID and scoring pattern
-            SequencesAligner.VisualizePairing(AlignTg_CurrResult, 1, OutputFilePrefix+".BestAlignment.txt", OutputFilePrefix+".BestAlignmentPattern.txt")
-            SequencesAligner.VisualizePairing(AlignTg_CurrResult, 1, OutputFilePrefix+".AllAlignment.txt", OutputFilePrefix+".AllAlignmentPattern.txt")
-            SequencesAligner.VisualizePairing(AlignTg_CurrResult, 2, OutputFilePrefix+".AllAlignment.txt", OutputFilePrefix+".AllAlignmentPattern.txt")
-            SequencesAligner.VisualizePairing(AlignTg_CurrResult, 3, OutputFilePrefix+".AllAlignment.txt", OutputFilePrefix+".AllAlignmentPattern.txt")
-    return piRNARNA_AlignObjects
+                AlignCheckpoint.OutputFilesTruncator(CurrSet.OutputFilePrefix, State["Offsets"])
+                CurrSet.StartIndex = State["Done"]
+                if CurrSet.Accumulator is not None and State["Summary"] is not None:
+                    CurrSet.Accumulator.LoadState(State["Summary"])
+    if any(CurrSet.StartIndex > 0 for CurrSet in Sets):
+        FeatureCachePrefix = None
+    PatternDtype = AlignmentResultStore.PatternDtypeSelector(WeightsTable)
+    if KeepResults == True:
+        ResultStores = [AlignmentResultStore.AlignmentResultStore(CurrSet.RNANum, Panel, PatternDtype) for CurrSet in Sets]
+    else:
+        ResultStores = [None] * len(Sets)
+    OutputSinks = [None if CurrSet.OutputFilePrefix is None else \
+                   AlignmentOutputWriter.AlignmentOutputSink(CurrSet.OutputFilePrefix, BackgroundWriter, HitNum > 0) for CurrSet in Sets]
+    if FeatureCachePrefix is not None and FeatureCache.FeatureCacheWriterChecker(Panel, WeightsTable):
+        CacheWriters = [FeatureCache.FeatureCacheWriter(FeatureCachePrefix, CurrSet.OutputFilePrefix[len(FeatureCachePrefix) + 1:], \
+                                                        CurrSet.RNANum, Panel) for CurrSet in Sets]
+    else:
+        CacheWriters = [None] * len(Sets)
+    Counters = [CurrSet.StartIndex for CurrSet in Sets]
+    TotalRNANum = sum(CurrSet.RNANum for CurrSet in Sets)
+    ShowProgressBar = not any(CurrSet.Verbose for CurrSet in Sets)
+    for SetIndex, PanelResult in PanelPairingsGenerator(Sets, Panel, WeightsTable, Threads, Cache, Engine, Seeds, ScanWindow, \
+                                                        Selector):
+        CurrSet = Sets[SetIndex]
+        if CurrSet.Verbose == True:
+            print("Processing RNA: " + PanelResult.TargetName)
+        elif ShowProgressBar:
+            ProgressBar(sum(Counters) + 1, TotalRNANum)
+            if sum(Counters) + 1 == TotalRNANum:
+                print("\nDone.")
+        PanelPairingSaver(ResultStores[SetIndex], CurrSet.Accumulator, CacheWriters[SetIndex], Counters[SetIndex], PanelResult, \
+                          Panel, OutputSinks[SetIndex])
+        Counters[SetIndex] = Counters[SetIndex] + 1
+        if Checkpoint is not None and Checkpoint.Due():
+            CheckpointSaver(Checkpoint, Sets, OutputSinks, Counters)
+    if Checkpoint is not None:
+        CheckpointSaver(Checkpoint, Sets, OutputSinks, Counters)
+    for OutputSink in OutputSinks:
+        if OutputSink is not None:
+            OutputSink.Close()
+    if Cache is not None:
+        Cache.Close()
+    for CurrSet, CacheWriter in zip(Sets, CacheWriters):
+        if CacheWriter is not None:
+            CacheWriter.Close()
+            CurrSet.FeatureCacheWritten = True
+    return ResultStores
+
+#This function aligns one RNA set against the piRNA panel, and returns an AlignmentResultStore object (see above).
+#Each row is an RNA, and each column is a piRNA. piRNA sequences have been reversed in this function.
+#The FASTA files are streamed (see FastaReader.FastaRecordsReader), RNANum is the number of RNA records.
+def ObjectsMatrixGenerator(RNAFile, piRNAFile, RNANum, Weights, OutputFilePrefix, Verbose, Threads=1, BackgroundWriter=False, \
+                           Accumulator=None, KeepResults=True):
+    CurrSet = RNASet(RNAFile, RNANum, OutputFilePrefix, Verbose, Accumulator)
+    return ObjectsMatricesGenerator([CurrSet], piRNAFile, Weights, Threads, BackgroundWriter, KeepResults)[0]
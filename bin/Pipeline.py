@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+"""
+Pipeline.py
+This script is a part of piTargetClassifier project.
+This script contains the Pipeline class, the importable API of the Align, Learn and Predict modes, to use the
+ classifier from Python without running piTargetClassifier.py. The features of the alignments are handed to Learn
+ mode as numpy arrays, and the fitted classifiers to Predict mode, without going through the text files.
+With an OutputPrefix, the same files as piTargetClassifier.py are written too (alignments, feature cache, figures,
+ reports and models); without it, nothing is written.
+Example:
+    from bin import Pipeline
+    Classifier = Pipeline.Pipeline(Threads=4)
+    Classifier.Align("piRNA.fa", "Control.fa", "Target.fa")
+    Classifier.Learn(["Logistic", "RandomForest"], Modes=["All", "Best"])
+    Results = Classifier.Predict(["0111201100000000000003222", "0322333322220000000000000"])
+Requied packages: numpy, sklearn (Learn and Predict), matplotlib (figures)
+Yu Sun, ysun43@ur.rochester.edu, 2018-11
+"""
+
+import io
+import contextlib
+import numpy as np
+from bin import WeightsParser
+from bin import FastaReader
+from bin import FeatureCache
+from bin import MultiSequencesAligner
+from bin import AlignmentResultsSummarizer
+from bin import AlignmentResultsVisualizer
+from bin import MachineLearningDataParser
+from bin import MachineLearningModels
+from bin import ModelStore
+
+#Learn mode parameters of each kind of classifier, with the defaults of piTargetClassifier.py
+LearnDefaults = {"Logistic": {"CVNum": 5}, "RandomForest": {"TNum": 100, "Depth": 8}, \
+                 "SVM": {"Cpen": 1, "Engine": "exact", "Components": MachineLearningModels.SVMComponents, "SampleSize": None}}
+
+#This class runs the 3 modes of piTargetClassifier in memory.
+#Weights is a weights dictionary (see WeightsParser), the default weights if None. Threads is the number of worker
+# processes (cores) of every stage. With Quiet=True, nothing is printed.
+#AlignOptions are passed to MultiSequencesAligner.ObjectsMatricesGenerator (e.g. Engine, MinScore, Distance, HitNum).
+#After each stage, its results are kept: Features and Summaries (Align), Classifiers and Metrics (Learn), which are
+# dictionaries keyed by set name ("Control", "Targets") and by classifier name (Mode.Classifier, e.g. All.Logistic.CV5).
+class Pipeline:
+    def __init__(self, Weights=None, OutputPrefix=None, Threads=1, Quiet=False, Plots=True, **AlignOptions):
+        self.Weights = dict(WeightsParser.WeightsDict_Default_Weight) if Weights is None else Weights
+        self.OutputPrefix = OutputPrefix
+        self.Threads = Threads
+        self.Quiet = Quiet
+        self.Plots = Plots
+        self.AlignOptions = AlignOptions
+        self.Features = {}
+        self.Summaries = {}
+        self.Classifiers = {}
+        self.Metrics = {}
+
+    #Context of each stage: silences the printed output with Quiet=True
+    def Output(self):
+        return contextlib.redirect_stdout(io.StringIO()) if self.Quiet == True else contextlib.nullcontext()
+
+    #Align the piRNAs of piRNAFile with the Control and Target RNAs (FASTA files, plain or gzipped).
+    #Returns the Features: {"Control": {"All": array, "Best": array}, "Targets": {...}}, the uint8 patterns of the
+    # reported pairs, the same as parsed from the *AlignmentPattern.txt files (see AlignmentResultStore.Features).
+    def Align(self, piRNAFile, ControlFile, TargetFile):
+        with self.Output():
+            if self.OutputPrefix is not None:
+                MultiSequencesAligner.OutputAlignFilesFlusher(self.OutputPrefix)
+                FeatureCache.FeatureCacheInvalidator(self.OutputPrefix)
+            Sets = []
+            for SetName, RNAFile in (("Targets", TargetFile), ("Control", ControlFile)):
+                OutputFilePrefix = None if self.OutputPrefix is None else self.OutputPrefix + "." + SetName
+                Sets.append(MultiSequencesAligner.RNASet(RNAFile, FastaReader.FastaRecordsCounter(RNAFile), OutputFilePrefix, \
+                                                         False, AlignmentResultsSummarizer.AlignmentSummaryAccumulator()))
+            Stores = MultiSequencesAligner.ObjectsMatricesGenerator(Sets, piRNAFile, self.Weights, self.Threads, KeepResults=True, \
+                                                                    FeatureCachePrefix=self.OutputPrefix, **self.AlignOptions)
+            if all(CurrSet.FeatureCacheWritten for CurrSet in Sets):
+                FeatureCache.FeatureCacheHeaderWriter(self.OutputPrefix, self.Weights, \
+                                                      {"piRNA": piRNAFile, "Control": ControlFile, "Target": TargetFile})
+            self.Features = {}
+            self.Summaries = {}
+            for (SetName, RNAFile), CurrSet, Store in zip((("Targets", TargetFile), ("Control", ControlFile)), Sets, Stores):
+                self.Features[SetName] = {Mode: Store.Features(Mode) for Mode in FeatureCache.CacheModes}
+                self.Summaries[SetName] = CurrSet.Accumulator.Summary()
+            if self.OutputPrefix is not None and self.Plots == True:
+                AlignmentResultsVisualizer.VisualizePairedSummary(self.Summaries["Control"], self.Summaries["Targets"], \
+                                                                  self.OutputPrefix, self.Threads)
+        return self.Features
+
+    #Fit the Classifiers (kinds of MachineLearningModels.ClassifierTypes) on the Features of the Modes ("All", "Best"),
+    # from Align, or given as {"Control": {Mode: array}, "Targets": {Mode: array}}.
+    #Params overrides the parameters of a kind, e.g. {"SVM": {"Engine": "nystroem"}} (see LearnDefaults).
+    #Returns the fitted Classifiers; their metrics (see MachineLearningModels.MetricsSummarizer) are kept in Metrics.
+    def Learn(self, Classifiers=("Logistic", "RandomForest", "SVM"), Modes=("All",), TestFrac=0.05, Params=None, Features=None):
+        Features = self.Features if Features is None else Features
+        with self.Output():
+            Splits = {}
+            for Mode in Modes:
+                Control_Data, Control_Label = MachineLearningDataParser.DataParserFromPatternArray(Features["Control"][Mode], "Control")
+                Target_Data, Target_Label = MachineLearningDataParser.DataParserFromPatternArray(Features["Targets"][Mode], "Target")
+                Splits[Mode] = MachineLearningModels.LearnDataSplitter(Control_Data, Control_Label, Target_Data, Target_Label, TestFrac)
+            Tasks = []
+            for Kind in Classifiers:
+                KindParams = dict(LearnDefaults[Kind])
+                KindParams.update({} if Params is None else Params.get(Kind, {}))
+                for Mode in Modes:
+                    Name = Mode + "." + MachineLearningModels.ClassifierName(Kind, KindParams)
+                    OutputFilePrefix = None if self.OutputPrefix is None else self.OutputPrefix + ".ML." + Name
+                    Tasks.append(MachineLearningModels.LearnTask(Kind, Mode, KindParams, OutputFilePrefix, \
+                                                                 [">>> " + MachineLearningModels.ClassifierTypes[Kind] + \
+                                                                  ": Model Fitting using " + Mode + " Alignments"], self.Plots))
+            for Task, Classifier, Metrics in MachineLearningModels.LearnTasksScheduler(Tasks, Splits, self.Threads):
+                Name = Task.Mode + "." + MachineLearningModels.ClassifierName(Task.Kind, Task.Params)
+                self.Classifiers[Name] = Classifier
+                self.Metrics[Name] = Metrics
+                if self.OutputPrefix is not None:
+                    ModelStore.ModelSaver(Task.OutputSummaryFileName, self.OutputPrefix, Classifier, \
+                                          MachineLearningModels.ClassifierTypes[Task.Kind], Task.Mode, \
+                                          (Features["Control"][Task.Mode], Features["Targets"][Task.Mode]), self.Weights)
+        return self.Classifiers
+
+    #Load the models saved by Learn mode (ModelStore), in addition to the fitted Classifiers. Returns the Classifiers.
+    def LoadModels(self, ModelFiles):
+        for ModelFile in ModelFiles:
+            Model = ModelStore.ModelLoader(ModelFile)
+            if Model is None:
+                raise ValueError("Not a piTargetClassifier model file: " + ModelFile)
+            self.Classifiers[Model["Name"]] = Model["Classifier"]
+        return self.Classifiers
+
+    #Predict Patterns, a list of pattern strings (piRNA 5'->3', as in the *AlignmentPattern.txt files) or a (n x pattern
+    # length) array, with the Classifiers (names, all if None).
+    #Returns {Name: (Labels, Probabilities)}: 0 for Control and 1 for Target, and the probabilities of Target with
+    # Probability=True (NaN otherwise). Each unique pattern is only predicted once.
+    def Predict(self, Patterns, Probability=False, Classifiers=None):
+        Names = list(self.Classifiers) if Classifiers is None else list(Classifiers)
+        if len(Patterns) > 0 and isinstance(Patterns[0], str):
+            Patterns = np.frombuffer("".join(Patterns).encode(), dtype=np.uint8).reshape(len(Patterns), -1) - 48
+        Patterns = np.asarray(Patterns)
+        Unique, Inverse = np.unique(Patterns, axis=0, return_inverse=True)
+        Inverse = Inverse.reshape(-1)
+        Results = MachineLearningModels.PredictChunkPredictor([self.Classifiers[Name] for Name in Names], \
+                                                              [Unique] * len(Names), Probability)
+        return {Name: (Labels[Inverse], Probabilities[Inverse]) for Name, (Labels, Probabilities) in zip(Names, Results)}
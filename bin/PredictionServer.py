@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+
+"""
+PredictionServer.py
+This script is a part of piTargetClassifier project.
+This script contains the PredictionServer class (Serve mode), a long-lived local HTTP service which loads the models
+ saved by Learn mode once, and predicts the patterns, or the piRNA-target sequence pairs (aligned on the fly), it is
+ sent. The concurrent requests are merged into micro-batches, predicted by one predict/predict_proba call per model.
+Endpoints (JSON):
+  POST /predict   {"patterns": ["0111201100...", ...]} or {"pairs": [{"piRNA": "TGAC...", "target": "ACGU..."}, ...]},
+                  optional "probability": true and "models": [names]. Returns {"models": {name: {"labels": [...],
+                  "probabilities": [...]}}, "latency_ms": ...}, and the best "patterns" of the pairs.
+  GET  /metrics   numbers of requests, batches and patterns, queue depth, and latency percentiles (ms).
+  GET  /models    names of the models, with their classifier, mode and pattern length.
+The server listens on 127.0.0.1:Port, or on a Unix socket.
+Requied packages: numpy, sklearn
+Yu Sun, ysun43@ur.rochester.edu, 2018-11
+"""
+
+import json
+import time
+import asyncio
+import collections
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from bin import SequencesAligner
+from bin import MachineLearningModels
+from bin import ModelStore
+
+ServePort = 8765
+#A micro-batch is predicted once it holds BatchSize patterns, or BatchWait ms after its first request
+BatchSize = 4096
+BatchWait = 2.0
+#Number of latencies kept for the percentiles of /metrics
+LatencyWindow = 10000
+#Maximum size of a request body
+BodySizeLimit = 64 << 20
+
+#This function aligns piRNA-target sequence pairs, and returns the top 3 patterns of each pair (n x 3 x piRNA length),
+# as in the *AlignmentPattern.txt files (piRNA 5'->3', non-positive weights as 0).
+def PairsPatternsGenerator(Pairs, WeightsTable):
+    Patterns = []
+    for piRNASeq, TargetSeq in Pairs:
+        Panel = SequencesAligner.piRNAPanel(["piRNA"], [piRNASeq.upper()[::-1]])
+        PanelResult = SequencesAligner.PairingPanelAligner(Panel, SequencesAligner.RNAClass("Target", TargetSeq.upper()), WeightsTable)
+        Patterns.append(np.clip(PanelResult.Patterns[0], 0, None)[:, ::-1])
+    return Patterns
+
+#This function converts a (n x length) array of single digit patterns into n pattern strings.
+def PatternStringsGenerator(Patterns):
+    return [Row.tobytes().decode() for Row in (Patterns + 48).astype(np.uint8)]
+
+#This class is the predictor behind the server: the models ({Name: ModelStore.ModelLoader dict}), an in-memory
+# ModelStore.PredictionCache per model, and the metrics.
+class PredictionServer:
+    def __init__(self, Models, BatchSize=BatchSize, BatchWait=BatchWait):
+        self.Models = Models
+        self.Names = list(Models)
+        self.BatchSize = BatchSize
+        self.BatchWait = BatchWait / 1000.0
+        self.Caches = {Name: ModelStore.PredictionCache() for Name in self.Names}
+        self.PatternLengths = set(Model["PatternLength"] for Model in Models.values())
+        Weights = [Model["Weights"] for Model in Models.values()]
+        #Pairs can only be aligned if the models were learnt with the same known weights
+        self.WeightsTable = None
+        if len(Weights) > 0 and Weights[0] is not None and all(W == Weights[0] for W in Weights):
+            self.WeightsTable = SequencesAligner.WeightsTableGenerator(Weights[0])
+        self.Queue = None
+        #The batches are predicted one at a time, out of the event loop, while the next one is gathered
+        self.Executor = ThreadPoolExecutor(max_workers=1)
+        self.Counters = collections.Counter()
+        self.MaxQueueDepth = 0
+        self.Latencies = collections.deque(maxlen=LatencyWindow)
+
+    #This function predicts one batch: the unique patterns missing from the caches, with each model.
+    #Patterns is a (n x length) array; returns {Name: (Labels, Probabilities)}.
+    def BatchPredictor(self, Patterns, Probability):
+        Unique, First, Inverse = np.unique(np.array(PatternStringsGenerator(Patterns)), return_index=True, return_inverse=True)
+        Results = {}
+        for Name in self.Names:
+            if self.Models[Name]["PatternLength"] != Patterns.shape[1]:
+                continue
+            Labels, Probabilities, Missing = self.Caches[Name].Lookup(Unique, Probability)
+            if Missing.any():
+                Predicted = MachineLearningModels.PredictChunkPredictor([self.Models[Name]["Classifier"]], \
+                                                                        [Patterns[First[Missing]]], Probability)[0]
+                Labels[Missing], Probabilities[Missing] = Predicted
+                self.Caches[Name].Update(Unique[Missing], *Predicted)
+            Results[Name] = (Labels[Inverse.reshape(-1)], Probabilities[Inverse.reshape(-1)])
+        return Results
+
+    #This coroutine gathers the queued requests into batches (all of the same pattern length) and predicts them.
+    async def Batcher(self):
+        Loop = asyncio.get_running_loop()
+        Pending = None
+        while True:
+            Batch = [await self.Queue.get() if Pending is None else Pending]
+            Pending = None
+            Size = Batch[0][0].shape[0]
+            Deadline = Loop.time() + self.BatchWait
+            while Size < self.BatchSize:
+                try:
+                    Item = await asyncio.wait_for(self.Queue.get(), max(0.0, Deadline - Loop.time()))
+                except asyncio.TimeoutError:
+                    break
+                if Item[0].shape[1] != Batch[0][0].shape[1]:
+                    Pending = Item
+                    break
+                Batch.append(Item)
+                Size = Size + Item[0].shape[0]
+            Probability = any(Item[1] for Item in Batch)
+            Patterns = np.concatenate([Item[0] for Item in Batch])
+            self.Counters["Batches"] += 1
+            self.Counters["Patterns"] += Patterns.shape[0]
+            try:
+                Results = await Loop.run_in_executor(self.Executor, self.BatchPredictor, Patterns, Probability)
+            except Exception as Error:
+                for Item in Batch:
+                    Item[2].set_exception(Error)
+                continue
+            Offset = 0
+            for ItemPatterns, ItemProbability, Future in Batch:
+                Rows = slice(Offset, Offset + ItemPatterns.shape[0])
+                Future.set_result({Name: (Labels[Rows], Probabilities[Rows]) for Name, (Labels, Probabilities) in Results.items()})
+                Offset = Offset + ItemPatterns.shape[0]
+
+    #This coroutine answers one /predict request (its decoded JSON body), and returns the response dictionary.
+    async def Predict(self, Request):
+        Response = {}
+        if "pairs" in Request:
+            if self.WeightsTable is None:
+                raise ValueError("The models do not have the same known weights, pairs can not be aligned")
+            Pairs = [(Pair["piRNA"], Pair["target"]) for Pair in Request["pairs"]]
+            if len(Pairs) == 0:
+                return {"patterns": [], "models": {}}
+            AllPatterns = await asyncio.get_running_loop().run_in_executor(None, PairsPatternsGenerator, Pairs, self.WeightsTable)
+            Patterns = np.array([Top[0] for Top in AllPatterns], dtype=np.uint8).reshape(len(Pairs), -1)
+            Response["patterns"] = [PatternStringsGenerator(Top) for Top in AllPatterns]
+        else:
+            Strings = [Pattern.strip() for Pattern in Request["patterns"]]
+            if len(Strings) == 0:
+                return {"models": {}}
+            if any(len(Pattern) != len(Strings[0]) or not Pattern.isdigit() for Pattern in Strings):
+                raise ValueError("The patterns must be digit strings of the same length")
+            Patterns = np.frombuffer("".join(Strings).encode(), dtype=np.uint8).reshape(len(Strings), -1) - 48
+        if Patterns.shape[1] not in self.PatternLengths:
+            raise ValueError("The patterns do not have the length of the models: " + str(sorted(self.PatternLengths)))
+        Probability = Request.get("probability", False) == True
+        Names = Request.get("models", [Name for Name in self.Names if self.Models[Name]["PatternLength"] == Patterns.shape[1]])
+        for Name in Names:
+            if Name not in self.Models:
+                raise ValueError("Unknown model: " + str(Name))
+            if self.Models[Name]["PatternLength"] != Patterns.shape[1]:
+                raise ValueError("The patterns do not have the length of the model " + Name)
+        Future = asyncio.get_running_loop().create_future()
+        await self.Queue.put((Patterns, Probability, Future))
+        self.MaxQueueDepth = max(self.MaxQueueDepth, self.Queue.qsize())
+        Results = await Future
+        Response["models"] = {}
+        for Name in Names:
+            Labels, Probabilities = Results[Name]
+            Response["models"][Name] = {"labels": np.array(["Control", "Target"])[Labels].tolist()}
+            if Probability == True:
+                Response["models"][Name]["probabilities"] = [round(Prob, 6) for Prob in Probabilities.tolist()]
+        return Response
+
+    def Metrics(self):
+        Latencies = np.array(self.Latencies) if len(self.Latencies) > 0 else np.zeros(1)
+        return {"requests": self.Counters["Requests"], "errors": self.Counters["Errors"], "batches": self.Counters["Batches"], \
+                "patterns": self.Counters["Patterns"], "queue_depth": 0 if self.Queue is None else self.Queue.qsize(), "max_queue_depth": self.MaxQueueDepth, \
+                "mean_batch_patterns": self.Counters["Patterns"] / max(1, self.Counters["Batches"]), \
+                "cache_reused": sum(Cache.Reused for Cache in self.Caches.values()), \
+                "latency_ms": {"p50": float(np.percentile(Latencies, 50)), "p90": float(np.percentile(Latencies, 90)), \
+                               "p99": float(np.percentile(Latencies, 99)), "max": float(Latencies.max())}}
+
+    #This coroutine answers one HTTP request, and returns (status, response dictionary).
+    async def Dispatch(self, Method, Path, Body):
+        if Method == "GET" and Path == "/metrics":
+            return 200, self.Metrics()
+        if Method == "GET" and Path == "/models":
+            return 200, {Name: {"classifier": Model["ClassifierType"], "mode": Model["Mode"], \
+                                "pattern_length": Model["PatternLength"]} for Name, Model in self.Models.items()}
+        if Method == "POST" and Path == "/predict":
+            Start = time.perf_counter()
+            self.Counters["Requests"] += 1
+            try:
+                Response = await self.Predict(json.loads(Body))
+            except (ValueError, KeyError, TypeError, AttributeError) as Error:
+                self.Counters["Errors"] += 1
+                return 400, {"error": str(Error)}
+            except Exception as Error:
+                self.Counters["Errors"] += 1
+                return 500, {"error": str(Error)}
+            Latency = (time.perf_counter() - Start) * 1000
+            self.Latencies.append(Latency)
+            Response["latency_ms"] = round(Latency, 3)
+            return 200, Response
+        return 404, {"error": "Unknown endpoint: " + Method + " " + Path}
+
+    #This coroutine serves one connection (HTTP/1.1, kept alive until the client closes it).
+    async def ConnectionHandler(self, Reader, Writer):
+        try:
+            while True:
+                RequestLine = await Reader.readline()
+                if RequestLine == b"":
+                    break
+                Fields = RequestLine.decode("latin-1").split()
+                Headers = {}
+                while True:
+                    Line = await Reader.readline()
+                    if Line in (b"\r\n", b"\n", b""):
+                        break
+                    Key, _, Value = Line.decode("latin-1").partition(":")
+                    Headers[Key.strip().lower()] = Value.strip()
+                Length = int(Headers.get("content-length", 0))
+                if len(Fields) < 2 or Length > BodySizeLimit:
+                    Status, Response = 400, {"error": "Bad request"}
+                    Headers["connection"] = "close"
+                else:
+                    Body = await Reader.readexactly(Length) if Length > 0 else b""
+                    Status, Response = await self.Dispatch(Fields[0].upper(), Fields[1].split("?")[0], Body)
+                Content = json.dumps(Response).encode()
+                Close = Headers.get("connection", "").lower() == "close" or Fields[-1:] == ["HTTP/1.0"]
+                Writer.write(("HTTP/1.1 " + str(Status) + (" OK" if Status == 200 else " Error") + "\r\n" + \
+                              "Content-Type: application/json\r\nContent-Length: " + str(len(Content)) + "\r\n" + \
+                              ("Connection: close\r\n" if Close else "") + "\r\n").encode() + Content)
+                await Writer.drain()
+                if Close:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            Writer.close()
+
+    #This coroutine runs the server on 127.0.0.1:Port, or on the Unix socket Socket, until it is cancelled.
+    async def Serve(self, Port=ServePort, Socket=None):
+        self.Queue = asyncio.Queue()
+        Batcher = asyncio.ensure_future(self.Batcher())
+        if Socket is None:
+            Server = await asyncio.start_server(self.ConnectionHandler, "127.0.0.1", Port)
+            print(">>> Serving " + str(len(self.Names)) + " models on http://127.0.0.1:" + str(Port))
+        else:
+            Server = await asyncio.start_unix_server(self.ConnectionHandler, Socket)
+            print(">>> Serving " + str(len(self.Names)) + " models on the Unix socket " + Socket)
+        print("Endpoints: POST /predict, GET /metrics, GET /models. Press Ctrl+C to stop.")
+        try:
+            async with Server:
+                await Server.serve_forever()
+        finally:
+            Batcher.cancel()
+
+#This function loads the model files, and runs the server until it is interrupted (Ctrl+C).
+def PredictionServerRunner(ModelFiles, Port=ServePort, Socket=None, BatchSize=BatchSize, BatchWait=BatchWait):
+    Models = {}
+    for ModelFile in ModelFiles:
+        Model = ModelStore.ModelLoader(ModelFile)
+        if Model is None:
+            raise ValueError("Not a piTargetClassifier model file: " + ModelFile)
+        print(">>> Model " + Model["Name"] + ": " + Model["ClassifierType"] + ", learnt from " + Model["Mode"] + " alignments")
+        Models[Model["Name"]] = Model
+    Server = PredictionServer(Models, BatchSize, BatchWait)
+    try:
+        asyncio.run(Server.Serve(Port, Socket))
+    except KeyboardInterrupt:
+        print("\nServer stopped.")
+    print(json.dumps(Server.Metrics()))
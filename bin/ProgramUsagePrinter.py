@@ -13,6 +13,11 @@ def PrintUsage():
     print("      Demo mode uses the prepared files in ./demo.")
     print("      No other inputs needed. This will take 1 min to run.")
 
+    print("Index mode (--Index)")
+    print("      Encode RNAs once, for Align mode with --index:")
+    print("           -c, -mc   FILE            Control mRNA FASTA file")
+    print("           -t, -mt   FILE            Target mRNA FASTA file")
+    print("           -o        Prefix          Prefix of the index (Prefix.Index/)")
     print("Align mode (--Align)")
     print("           -v        INT             Verbosity, [1, 2, 3]")
     print("      Perform de novo alignments:")
@@ -22,6 +27,23 @@ def PrintUsage():
     print("           -w        Weight/FILE     Weight: 'match' or 'hy'")
     print("                                      or an additional file")
     print("           -o        Prefix          Prefix of output files")
+    print("           --threads INT             (Optional) Worker processes, default 1")
+    print("           --bgwrite                 (Optional) Write outputs on a background thread")
+    print("           --no-plots                (Optional) Do not draw the figures (also in Learn mode)")
+    print("           --plotpdf                 (Optional) Draw the paired figures in one PDF, Prefix.PairedPlots.pdf")
+    print("           --checkpoint INT          (Optional) Save a checkpoint every INT seconds, default off")
+    print("           --resume                  (Optional) Resume from Prefix.Checkpoint.json")
+    print("           --aligncache FILE         (Optional) Cache alignments across runs (SQLite)")
+    print("           --aligncachesize INT      (Optional) Cache size limit in MB, default 1024")
+    print("           --engine  direct/fft      (Optional) Scoring engine, fft for long targets")
+    print("           --minscore INT            (Optional) Only report pairs scoring >= INT")
+    print("           --seedk   INT             (Optional) Seed length for --minscore, default 4")
+    print("           --index   Prefix          (Optional) Index mode output, in place of -c/-t")
+    print("           --verify                  (Optional) Verify the checksums of --index")
+    print("           --window  INT             (Optional) Scan long targets in windows of INT nt, default 1048576")
+    print("           --nms     INT             (Optional) Suppress alignments ending < INT nt from a better one")
+    print("           --hits    INT             (Optional) Also write up to INT hits per pair to *.Hits.txt")
+    print("           --hitscore INT            (Optional) Only write the hits with a score >= INT")
     print("      or Use ready-to-use aligned results:")
     print("           --import  Prefix          Prefix of pre-aligned data")
 
@@ -34,20 +56,48 @@ def PrintUsage():
     print("               --Depth INT           (Optional) Tree Depth N")
     print("           -s, --svm                 Use SVM classifier")
     print("               --Cpen  INT           (Optional) SVM penalty C")
+    print("               --svmengine ENGINE    (Optional) exact/nystroem/rff, default exact")
+    print("               --svmcomp INT         (Optional) Kernel approximation components, default 500")
+    print("               --svmsample INT       (Optional) Fit on INT sampled rows, calibrate on a holdout")
     print("           -a, --all                 Use all above three methods")
     print("           -m, --mode  MODE          (Optional) All/Best/AllBest modes.")
+    print("           --threads INT             (Optional) Cores shared by the fits, default 1")
+    print("           --no-plots                (Optional) Do not draw the ROC curves")
 
     print("Predict mode (--Predict)")
     print("           --prealign                pre-aligned pattern file")
     print("           --preout                  Prefix of the output file")
+    print("           --model   FILE            (Optional) Model saved by Learn mode, can be repeated")
+    print("           --prechunk INT            (Optional) Patterns predicted at once, default 65536")
+    print("           --proba                   (Optional) Also write the probability of Target")
+    print("           --threads INT             (Optional) Worker processes for prediction, default 1")
+    print("")
+    print("Serve mode (--Serve)")
+    print("           --model   FILE            Model saved by Learn mode, can be repeated")
+    print("           --port    INT             (Optional) Port on 127.0.0.1, default 8765")
+    print("           --socket  FILE            (Optional) Unix socket, in place of the port")
+    print("           --batchsize INT           (Optional) Patterns of a micro-batch, default 4096")
+    print("           --batchwait MS            (Optional) Wait for more requests, default 2 ms")
     print("")
     print("Demo or Align mode can be run separately.")
     print("Align+Learn, or Align+Learn+Predict modes can be run together.")
     print("For Align mode, please pick one sub-mode: de novo or import.")
     print("    within each sub-mode, all arguments are required")
+    print("    FASTA inputs can be multi-line, and gzip/bgzip compressed (.fa.gz)")
+    print("    With --checkpoint, Align mode saves its progress in Prefix.Checkpoint.json;")
+    print("    an interrupted run continues from there with the same arguments + --resume.")
+    print("    --resume stops if the inputs, weights or alignment options (--nms, --hits, ...) differ.")
     print("For Learn mode, one or more modes can be used. Default none.")
+    print("    Features are loaded from Prefix.FeatureCache/, written by Align mode or")
+    print("    built once from the *AlignmentPattern.txt files of --import data.")
+    print("    Each fitted classifier is saved as Prefix.ML.Mode.Classifier.model.")
+    print("    Its metrics are saved in Prefix.ML.Mode.Classifier.Metrics.json (and .npz: predictions, probabilities, ROC curves).")
     print("For Predict mode, the input contains only a single pattern column.")
     print("    The output file is Predictfile.pre.txt")
+    print("    With --model, Predict mode runs alone, using the saved models.")
+    print("    Their predictions are memoized in FILE.PredictCache.npz for the next runs.")
+    print('For Serve mode, POST {"patterns": [...]} or {"pairs": [{"piRNA": ..., "target": ...}]}')
+    print("    to /predict; GET /metrics for the latency and queue depth, /models for the models.")
     print("Default optional values: CVNum=5, TNum=100, Depth=8, Cpen=1, mode=All")
     print("               TestFrac=0.05")
     print("***********************************************************************")
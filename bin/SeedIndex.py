@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+"""
+SeedIndex.py
+This script is a part of piTargetClassifier project.
+This script contains the SeedIndex class, which computes an upper bound of the best alignment score of every
+ piRNA-RNA pair from k-mer seeds, so that the pairs that can not reach a minimum score (--minscore) are skipped.
+The bound is positional: it is computed for every offset of the pair from a k-mer index of the target, and only the
+ best offset counts. It is admissible (never lower than the real best score), so the pairs that are aligned and
+ reported are exactly the same as with the exhaustive scan.
+Requied packages: numpy
+Yu Sun, ysun43@ur.rochester.edu, 2018-11
+"""
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+#Default seed length, and the maximum number of possible seeds (piRNA alphabet ^ seed length) of the seed table.
+SeedLength = 4
+SeedTableLimit = 1 << 12
+#Maximum number of seed sums (piRNAs x offsets) held in memory at once when computing the bounds.
+SeedBatchElementsLimit = 1 << 22
+
+#This class indexes the piRNAs of a SequencesAligner.piRNAPanel as disjoint seeds of K nt, plus the remaining
+# (Length mod K) nt. For one target, TargetTableGenerator indexes the target as the k-mer starting at each position,
+# and scores every k-mer of the target against every seed of the panel.
+#The alignment of a pair at one offset is a sum of the same parts, each against one k-mer (or nt) of the target padded
+# with empty positions, so it is summed at each offset (UpperBounds) with one table lookup per seed, instead of one
+# weight per nt. The bound of the pair is the best of its offsets.
+#The offsets themselves can not be skipped: the top 3 alignments of a reported pair may score less than the minimum.
+class SeedIndex:
+    def __init__(self, Panel, WeightsTable, MinScore, K=SeedLength):
+        self.WeightsTable = WeightsTable
+        self.MinScore = MinScore
+        self.MaxLength = Panel.MaxLength
+        Groups = list(Panel.Groups.values())
+        if len(Groups) > 0:
+            self.Alphabet = np.unique(np.concatenate([Codes.ravel() for Index, Codes in Groups]))
+        else:
+            self.Alphabet = np.zeros(1, dtype=np.uint8)
+        Base = len(self.Alphabet)
+        while K > 1 and Base ** K > SeedTableLimit:
+            K = K - 1
+        self.K = K
+        self.Lookup = np.zeros(256, dtype=np.int64)
+        self.Lookup[self.Alphabet] = np.arange(Base)
+        Powers = Base ** np.arange(K - 1, -1, -1, dtype=np.int64)
+        #For each piRNA length: the seed codes (n x seeds) and the remaining nt (n x (Length mod K)) of the group
+        SeedCodes = {}
+        for piRNALength, (Index, Codes) in Panel.Groups.items():
+            SeedNum = piRNALength // K
+            Digits = self.Lookup[Codes[:, :SeedNum * K]].reshape(len(Index), SeedNum, K)
+            SeedCodes[piRNALength] = (Digits @ Powers, Codes[:, SeedNum * K:])
+        #The seeds used by the panel (seeds x K nt), and the seeds of each group as indexes of these
+        Used = np.unique(np.concatenate([Codes.ravel() for Codes, Remainders in SeedCodes.values()] + [np.zeros(0, dtype=np.int64)]))
+        self.UsedSeeds = self.Alphabet[(Used[:, None] // Powers) % Base]
+        self.Seeds = {piRNALength: (np.searchsorted(Used, Codes), Remainders) for piRNALength, (Codes, Remainders) in SeedCodes.items()}
+
+    #This function builds the table of one target, padded with (MaxLength - 1) empty positions on both sides:
+    # the index of the k-mer starting at each position (in the unique k-mers of the target), the score of every unique
+    # k-mer against every seed of the panel, and the padded target itself (for the remaining nt).
+    def TargetTableGenerator(self, TargetCodes):
+        K = self.K
+        Padding = np.zeros(max(K, self.MaxLength - 1), dtype=np.uint8)
+        Padded = np.concatenate((Padding, TargetCodes, Padding))
+        TargetAlphabet, Digits = np.unique(Padded, return_inverse=True)
+        TargetPowers = len(TargetAlphabet) ** np.arange(K - 1, -1, -1, dtype=np.int64)
+        KmerCodes, KmerIndex = np.unique(sliding_window_view(Digits.reshape(-1), K) @ TargetPowers, return_inverse=True)
+        Kmers = TargetAlphabet[(KmerCodes[:, None] // TargetPowers) % len(TargetAlphabet)]
+        Table = np.zeros((Kmers.shape[0], self.UsedSeeds.shape[0]), dtype=np.int64)
+        for k in range(K):
+            Table += self.WeightsTable[Kmers[:, k, None], self.UsedSeeds[None, :, k]]
+        return KmerIndex.reshape(-1), Table, Padded, Padding.shape[0]
+
+    #This function returns the upper bounds of the piRNAs of one length group against a target: at each offset of the
+    # alignment (ending at the same positions as in SequencesAligner.PairingScoresBatchGenerator), the sum of the
+    # scores of the seeds against the k-mers they face, plus the weights of the remaining nt, and the best one over
+    # the offsets. Rows selects the piRNAs of the group (all if None).
+    #The sums are the alignment scores themselves. With TopEnds=True, the end positions (n x 3) of the top 3
+    # alignments of the piRNAs reaching MinScore are also returned, ranked by argsort as SequencesAligner.
+    # PairingTopEndsScanner ranks a target scanned in one window (the other rows are 0), so they are not scored again.
+    def UpperBounds(self, TargetTable, piRNALength, Rows=None, TopEnds=False):
+        KmerIndex, Table, Padded, PaddingLength = TargetTable
+        SeedIndexes, Remainders = self.Seeds[piRNALength]
+        if Rows is not None:
+            SeedIndexes = SeedIndexes[Rows]
+            Remainders = Remainders[Rows]
+        #The target padded with (piRNALength - 1) empty positions starts at Shift in the padded target of the table
+        Shift = PaddingLength - (piRNALength - 1)
+        DiagonalLength = KmerIndex.shape[0] + self.K - 1 - 2 * PaddingLength + piRNALength - 1
+        Bounds = np.zeros(SeedIndexes.shape[0], dtype=np.int64)
+        Ends = np.zeros((SeedIndexes.shape[0], 3), dtype=np.int64) if TopEnds == True else None
+        BatchSize = max(1, SeedBatchElementsLimit // DiagonalLength)
+        for BatchStart in range(0, SeedIndexes.shape[0], BatchSize):
+            Batch = SeedIndexes[BatchStart:BatchStart + BatchSize]
+            Sums = np.zeros((Batch.shape[0], DiagonalLength), dtype=np.int64)
+            for SeedID in range(Batch.shape[1]):
+                Start = Shift + SeedID * self.K
+                Sums += Table[KmerIndex[None, Start:Start + DiagonalLength], Batch[:, SeedID, None]]
+            for RemainderID in range(Remainders.shape[1]):
+                Start = Shift + Batch.shape[1] * self.K + RemainderID
+                Sums += self.WeightsTable[Padded[None, Start:Start + DiagonalLength], \
+                                          Remainders[BatchStart:BatchStart + BatchSize, RemainderID, None]]
+            Bounds[BatchStart:BatchStart + Batch.shape[0]] = Sums.max(axis=1)
+            if TopEnds == True:
+                Kept = np.flatnonzero(Bounds[BatchStart:BatchStart + Batch.shape[0]] >= self.MinScore)
+                Ends[BatchStart + Kept] = np.argsort(Sums[Kept], axis=1)[:, :-4:-1]
+        if TopEnds == True:
+            return Bounds, Ends
+        return Bounds
@@ -16,6 +16,7 @@ Matrix dimension: m rows and N+2(m-1) columns
 """
 
 import numpy as np
+from bin import AlignmentOutputWriter
 
 #This object stores RNA sequence information
 class RNAClass:
@@ -55,9 +56,71 @@ class Pairing:
         self.Matching3_Score = Matching3_Score
         self.Matching3_BinPos=Top3_BinPos
 
+#This object stores a piRNA panel, encoded once for the whole run. The sequences should already be reversed.
+#piRNAs are grouped by length, and each group is stacked into a 2D uint8 array, so that a whole group can be scored
+# against one target at once.
+#Duplicate sequences (under different names) are only aligned once: Representatives maps each piRNA to the first
+# piRNA with the same sequence, and only these unique piRNAs (Unique) are in the groups.
+class piRNAPanel:
+    def __init__(self, Names, Sequences):
+        self.Names = Names
+        self.Sequences = Sequences
+        self.Lengths = np.array([len(Seq) for Seq in Sequences], dtype=np.int64)
+        self.MaxLength = int(self.Lengths.max()) if len(Sequences) > 0 else 0
+        FirstIndex = {}
+        self.Representatives = np.array([FirstIndex.setdefault(Seq, i) for i, Seq in enumerate(Sequences)], dtype=np.int64)
+        self.Unique = np.flatnonzero(self.Representatives == np.arange(len(Sequences)))
+        self.HasDuplicates = len(self.Unique) < len(Sequences)
+        self.Groups = {}
+        for Length in np.unique(self.Lengths).tolist():
+            Index = self.Unique[self.Lengths[self.Unique] == Length]
+            Codes = np.stack([SequenceEncoder(Sequences[i]) for i in Index])
+            self.Groups[Length] = (Index, Codes)
+
+#This object stores the top 3 pairing results of a whole piRNA panel against 1 mRNA, as arrays.
+#Starts, Ends, Scores and BinPos are (piRNA number x 3) arrays. Patterns is a (piRNA number x 3 x MaxLength) array,
+# and the patterns of shorter piRNAs are padded with 0 at the end.
+#With a minimum score (see SeedIndex.SeedIndex), Pruned is the mask of the piRNAs skipped (their rows are 0).
+#With a HitsSelector, Hits is a PanelHits object holding the hits of each piRNA.
+class PanelPairing:
+    def __init__(self, TargetName, TargetSeq, TargetLength, Starts, Ends, Scores, BinPos, Patterns, Pruned=None, MinScore=None, \
+                 Hits=None):
+        self.TargetName = TargetName
+        self.TargetSeq = TargetSeq
+        self.TargetLength = TargetLength
+        self.Starts = Starts
+        self.Ends = Ends
+        self.Scores = Scores
+        self.BinPos = BinPos
+        self.Patterns = Patterns
+        self.Pruned = Pruned
+        self.MinScore = MinScore
+        self.Hits = Hits
+
+#This object stores the hits of a whole piRNA panel against 1 mRNA (see HitsSelector), as arrays of the same layout as
+# PanelPairing, with HitNum columns. Valid is the mask of the hits found, best first for each piRNA.
+class PanelHits:
+    def __init__(self, Starts, Ends, Scores, Patterns, Valid):
+        self.Starts = Starts
+        self.Ends = Ends
+        self.Scores = Scores
+        self.Patterns = Patterns
+        self.Valid = Valid
+
+#This function returns the mask of the piRNAs reported for a PanelPairing object, or None if all of them are.
+#With a minimum score, the pairs skipped by the seed index and the pairs scoring lower are not reported.
+def PanelPairingReported(PanelResult):
+    if PanelResult.MinScore is None:
+        return None
+    Reported = PanelResult.Scores[:, 0] >= PanelResult.MinScore
+    if PanelResult.Pruned is not None:
+        Reported = Reported & ~PanelResult.Pruned
+    return Reported
+
 #Get the visualization of alignments from the object Pairing, for the top 1, 2, 3 alignments.
 #For partial matching, it will add 'E' (which means empty) in the target sequence.
 #In the pattern output file, the pattern is in piRNA 5'->3' direction!
+#This opens the output files on every call; for a whole run, use AlignmentOutputWriter.AlignmentOutputSink instead.
 def VisualizePairing(PairingObject,TopID, OutputFileAln, OutputFilePattern):
     fo=open(OutputFileAln,"a")
     fop=open(OutputFilePattern,"a")
@@ -81,26 +144,16 @@ def VisualizePairing(PairingObject,TopID, OutputFileAln, OutputFilePattern):
         BinPos = PairingObject.Matching3_BinPos
     else:
         print("TopID out of bound...")
-    fo.write("Target RNA: " + PairingObject.TargetName + "; "+ str(Start + 1) + " - " + str(End + 1)+"\n")
     OriSeqTargetSeq=PairingObject.TargetSeq
     EmptyE="E"*(PairingObject.piRNALength-1)
     TargetSeqEmptyE=EmptyE+OriSeqTargetSeq+EmptyE
-    fo.write(TargetSeqEmptyE[(Start+(PairingObject.piRNALength-1)):(End + 1 + PairingObject.piRNALength-1)]+"\n")
-    MatchingString = ""
-    ScoringString = ""
-    for pos in range(PairingObject.piRNALength):
-        if Pattern[pos] > 0:
-            MatchingString = MatchingString + "|"
-            ScoringString = ScoringString + str(Pattern[pos])
-        else:
-            MatchingString = MatchingString + " "
-            ScoringString = ScoringString + "0"
-    fo.write(MatchingString+"\n")
-    fo.write(PairingObject.piRNASeq+"\n")
-    fo.write(ScoringString+"\n")
-    fop.write(PairingObject.TargetName+"\t"+PairingObject.piRNAName+"\t"+"m"+str(TopID)+"\t"+ScoringString[::-1] + "\t"+ str(BinPos) +"\n")
-    fo.write("piRNA: "+ PairingObject.piRNAName + "; " + str(PairingObject.piRNALength) +" - 1 ; m"+str(TopID)+ ", Score: " + str(Score)+"\n")
-    fo.write("\n")
+    TargetWindow=TargetSeqEmptyE[(Start+(PairingObject.piRNALength-1)):(End + 1 + PairingObject.piRNALength-1)]
+    ScoringStrings, MatchingStrings = AlignmentOutputWriter.PatternStringsGenerator(np.array([Pattern]))
+    fo.write(AlignmentOutputWriter.AlignmentRecordFormatter(PairingObject.TargetName, TargetWindow, PairingObject.piRNAName, \
+                                                            PairingObject.piRNASeq, PairingObject.piRNALength, TopID, \
+                                                            Start, End, Score, ScoringStrings[0], MatchingStrings[0]))
+    fop.write(AlignmentOutputWriter.PatternRecordFormatter(PairingObject.TargetName, PairingObject.piRNAName, TopID, \
+                                                           ScoringStrings[0], BinPos))
     fo.close()
     fop.close()
 
@@ -128,31 +181,48 @@ def PairingPatternTracer(Matrix,EndPos,piRNALength):
             CurrPattern[j] = CurrTrace[j]-CurrTrace[j-1]
     return CurrPattern
 
+#This function converts the WeightsDict into a 256 x 256 lookup table, indexed by the ASCII codes of
+# the target nt (row) and the piRNA nt (column). Unlisted pairings (and the padding code 0) weight 0.
+def WeightsTableGenerator(Weights):
+    WeightsTable = np.zeros((256, 256), dtype=np.int64)
+    for CurrPairing in Weights:
+        if len(CurrPairing) == 2:
+            WeightsTable[ord(CurrPairing[0]) & 255, ord(CurrPairing[1]) & 255] = int(Weights[CurrPairing])
+    return WeightsTable
+
+#This function integer-encodes a sequence as an uint8 array of ASCII codes.
+def SequenceEncoder(Sequence):
+    return np.frombuffer(Sequence.encode("ascii", "replace"), dtype=np.uint8)
+
+#This function pads the encoded target with (piRNALength - 1) empty positions (code 0) on both sides,
+# which corresponds to the 'E' padding used for partial matching.
+def TargetCodesPadder(TargetCodes, piRNALength):
+    Padding = np.zeros(piRNALength - 1, dtype=np.uint8)
+    return np.concatenate((Padding, TargetCodes, Padding))
+
+#This function looks up all the pairing weights along the diagonals of the scoring matrix at once.
+#Row k, column e is the weight of piRNA nt k paired with padded target nt e + k, so that the column e holds the
+# raw matching scores of the alignment ending at position e (0 based, on the cut scoring vector).
+#Returns an m x (N + m - 1) array.
+def PairingDiagonalsGenerator(piRNACodes, PaddedTargetCodes, WeightsTable):
+    piRNALength = piRNACodes.shape[0]
+    DiagonalLength = PaddedTargetCodes.shape[0] - (piRNALength - 1)
+    Windows = np.lib.stride_tricks.sliding_window_view(PaddedTargetCodes, DiagonalLength)
+    return WeightsTable[Windows, piRNACodes[:, None]]
+
 #CurrPairing: Target nt goes first, and piRNA nt goes second.
 #This function generates the scoring matrix. The two inputs are RNAClass objects.
+#The matrix is built from the cumulative sums along the diagonals; cells outside the DP band keep the value 999.
 def PairingMatrixGenerator(CurrpiRNA,CurrTarget,Weight):
-    AlignmentMatrix = [999] * CurrpiRNA.Length
+    WeightsTable = WeightsTableGenerator(Weight)
+    piRNACodes = SequenceEncoder(CurrpiRNA.Sequence)
+    PaddedTargetCodes = TargetCodesPadder(SequenceEncoder(CurrTarget.Sequence), CurrpiRNA.Length)
+    Diagonals = PairingDiagonalsGenerator(piRNACodes, PaddedTargetCodes, WeightsTable)
     AlignmentMatrix_Length = CurrTarget.Length + 2 * (CurrpiRNA.Length - 1)
-    for i in range(CurrpiRNA.Length):
-        AlignmentMatrix[i] = [999] * AlignmentMatrix_Length
-    for j in range(CurrpiRNA.Length):
-        for i in range(j, CurrTarget.Length + j + (CurrpiRNA.Length - 1)):
-            if (i < CurrpiRNA.Length - 1):
-                AlignmentMatrix[j][i] = 0  # Initialize the non-matching parts
-            elif j == 0:
-                CurrPairing = CurrTarget.Sequence[i - (CurrpiRNA.Length - 1)] + CurrpiRNA.Sequence[j]  #1st nt of piRNA
-                CurrWeight = GetPairingWeight(Weight, CurrPairing)
-                AlignmentMatrix[j][i] = int(CurrWeight)
-                # print(CurrPairing,CurrWeight)
-            elif (j > 0) and (i < CurrTarget.Length + CurrpiRNA.Length - 1):
-                CurrPairing = CurrTarget.Sequence[i - (CurrpiRNA.Length - 1)] + CurrpiRNA.Sequence[j]
-                CurrWeight = GetPairingWeight(Weight, CurrPairing)
-                AlignmentMatrix[j][i] = int(AlignmentMatrix[j - 1][i - 1]) + int(CurrWeight)
-                # print(CurrPairing)
-            else:
-                CurrWeight = 0
-                AlignmentMatrix[j][i] = int(AlignmentMatrix[j - 1][i - 1]) + int(CurrWeight)
-                # print(j,i)
+    AlignmentMatrix = np.full((CurrpiRNA.Length, AlignmentMatrix_Length), 999, dtype=np.int64)
+    Rows = np.arange(CurrpiRNA.Length)[:, None]
+    Columns = Rows + np.arange(Diagonals.shape[1])[None, :]
+    AlignmentMatrix[Rows, Columns] = np.cumsum(Diagonals, axis=0)
     return AlignmentMatrix
 
 #This function takes the StartPos of the piRNA-RNA targeting event (based on target RNA nt), bins the position on a
@@ -169,6 +239,12 @@ def GetBinnedPosOnRNA(StartPos, RNALength):
     else:
         return (Frac -1)
 
+#Vectorized version of GetBinnedPosOnRNA, for an array of start positions on the same RNA.
+def GetBinnedPosOnRNAVectorized(StartPos, RNALength):
+    Frac = (np.maximum(StartPos, 0) / RNALength * 100).astype(np.int64)
+    Frac[StartPos == RNALength] = RNALength - 1
+    return np.where(Frac < 100, Frac, Frac - 1)
+
 #This function is a wraper of the pairing result. It takes the alignment matrix and original RNA objects,
 # picks the top 3 alignments, and summairzes them into a Pairing object.
 def PairingResultsWraper(CurrpiRNA,CurrTarget,AlignmentMatrix):
@@ -200,3 +276,247 @@ def PairingResultsWraper(CurrpiRNA,CurrTarget,AlignmentMatrix):
                             Top2_StartPos, Top2_EndPos, Top2_Pattern, Top2_Score, Top2_BinPos, \
                             Top3_StartPos, Top3_EndPos, Top3_Pattern, Top3_Score, Top3_BinPos)
     return PairingResult
+
+#Maximum number of scores (piRNAs x offsets) held in memory at once by PairingPanelAligner.
+BatchElementsLimit = 1 << 22
+
+#This function scores a stack of equal-length piRNAs (n x m codes) against one padded target.
+#Returns an n x (N + m - 1) scoring array, where each row is the cut scoring vector of one piRNA.
+def PairingScoresBatchGenerator(piRNACodesStack, PaddedTargetCodes, WeightsTable):
+    piRNALength = piRNACodesStack.shape[1]
+    DiagonalLength = PaddedTargetCodes.shape[0] - (piRNALength - 1)
+    Scores = np.zeros((piRNACodesStack.shape[0], DiagonalLength), dtype=np.int64)
+    for k in range(piRNALength):
+        Scores += WeightsTable[PaddedTargetCodes[None, k:k + DiagonalLength], piRNACodesStack[:, k, None]]
+    return Scores
+
+#Scoring engines of PairingPanelAligner: "direct" sums the weights of the diagonals (PairingScoresBatchGenerator),
+# "fft" computes the same scores with FFT cross-correlations (PairingScoresFFTBatchGenerator).
+AlignEngines = ("direct", "fft")
+
+#This function picks the FFT length for a padded target: the smallest 2^a * 3^b >= Length.
+def FFTLengthSelector(Length):
+    Best = 1 << (Length - 1).bit_length()
+    Power3 = 3
+    while Power3 < 2 * Length:
+        Best = min(Best, Power3 * (1 << max(0, (-(-Length // Power3) - 1).bit_length())))
+        Power3 = Power3 * 3
+    return Best
+
+#This function splits a padded target into one indicator channel per code, and returns the FFT length, the codes
+# and the spectra of the channels (codes x FFT frequencies). It is computed once per target and piRNA length.
+def TargetSpectraGenerator(PaddedTargetCodes):
+    FFTLength = FFTLengthSelector(PaddedTargetCodes.shape[0])
+    Codes = np.unique(PaddedTargetCodes)
+    Channels = (PaddedTargetCodes[None, :] == Codes[:, None]).astype(np.float64)
+    return FFTLength, Codes, np.fft.rfft(Channels, n=FFTLength, axis=1)
+
+#This function returns the same scoring array as PairingScoresBatchGenerator, using FFT cross-correlations.
+#The score at offset e is sum_k W[Target[e + k], piRNA[k]], i.e. the sum over the target codes a and the piRNA codes b
+# of W[a, b] times the correlation of the channel a of the target with the channel b of the piRNA. The target spectra
+# are first mixed by the weights, so that only one FFT per piRNA code is needed, and one inverse FFT per piRNA.
+#The scores are integers, and are rounded back exactly.
+def PairingScoresFFTBatchGenerator(piRNACodesStack, PaddedTargetCodes, WeightsTable, TargetSpectra):
+    FFTLength, TargetCodes, Spectra = TargetSpectra
+    DiagonalLength = PaddedTargetCodes.shape[0] - (piRNACodesStack.shape[1] - 1)
+    piRNACodes = np.unique(piRNACodesStack)
+    MixedSpectra = WeightsTable[np.ix_(TargetCodes, piRNACodes)].T.astype(np.float64) @ Spectra
+    Products = np.zeros((piRNACodesStack.shape[0], FFTLength // 2 + 1), dtype=np.complex128)
+    for j, Code in enumerate(piRNACodes.tolist()):
+        Channel = (piRNACodesStack == Code).astype(np.float64)
+        Products += np.conj(np.fft.rfft(Channel, n=FFTLength, axis=1)) * MixedSpectra[j]
+    Scores = np.fft.irfft(Products, n=FFTLength, axis=1)[:, :DiagonalLength]
+    return np.rint(Scores).astype(np.int64)
+
+#Maximum number of offsets scored at once for one piRNA. Longer targets (e.g. whole chromosomes) are scanned in
+# windows of this many offsets, so that the memory used does not depend on the target length.
+ScanWindowLength = 1 << 20
+
+#Key of an empty slot in the arrays of PairingTopKeysScanner
+EmptyKey = np.iinfo(np.int64).min
+
+#This function scores a stack of equal-length piRNAs (n x m codes) against one padded target, in windows of at most
+# WindowLength offsets, each reading the m - 1 nt after it, so that the alignments across two windows are scored in full.
+#Yields (WindowStart, WindowEnd, BatchStart, BatchScores) for each window and batch of piRNAs.
+def PairingScoresWindowsGenerator(piRNACodesStack, PaddedTargetCodes, WeightsTable, Engine, WindowLength):
+    piRNANum, piRNALength = piRNACodesStack.shape
+    DiagonalLength = PaddedTargetCodes.shape[0] - (piRNALength - 1)
+    for WindowStart in range(0, DiagonalLength, WindowLength):
+        WindowEnd = min(DiagonalLength, WindowStart + WindowLength)
+        WindowCodes = PaddedTargetCodes[WindowStart:WindowEnd + piRNALength - 1]
+        if Engine == "fft":
+            TargetSpectra = TargetSpectraGenerator(WindowCodes)
+            BatchSize = max(1, BatchElementsLimit // TargetSpectra[0])
+        else:
+            BatchSize = max(1, BatchElementsLimit // (WindowEnd - WindowStart))
+        for BatchStart in range(0, piRNANum, BatchSize):
+            BatchCodes = piRNACodesStack[BatchStart:BatchStart + BatchSize]
+            if Engine == "fft":
+                BatchScores = PairingScoresFFTBatchGenerator(BatchCodes, WindowCodes, WeightsTable, TargetSpectra)
+            else:
+                BatchScores = PairingScoresBatchGenerator(BatchCodes, WindowCodes, WeightsTable)
+            yield WindowStart, WindowEnd, BatchStart, BatchScores
+
+#This function returns the keys (n x CandidateNum, best first) of the best alignments of a stack of equal-length piRNAs
+# against one padded target. The key of an alignment is Score * DiagonalLength + End, so that the alignments are ranked
+# by score, then by end position (the last first); End is Key % DiagonalLength. Missing alignments are EmptyKey.
+#Only partial selections (np.partition) are made, the scoring vectors are never sorted, and only the candidates of each
+# piRNA are kept from window to window.
+def PairingTopKeysScanner(piRNACodesStack, PaddedTargetCodes, WeightsTable, CandidateNum, Engine="direct", \
+                          ScanWindow=ScanWindowLength):
+    piRNANum, piRNALength = piRNACodesStack.shape
+    DiagonalLength = PaddedTargetCodes.shape[0] - (piRNALength - 1)
+    TopKeys = np.full((piRNANum, CandidateNum), EmptyKey, dtype=np.int64)
+    for WindowStart, WindowEnd, BatchStart, BatchScores in \
+            PairingScoresWindowsGenerator(piRNACodesStack, PaddedTargetCodes, WeightsTable, Engine, max(1, ScanWindow)):
+        Keys = BatchScores * DiagonalLength + np.arange(WindowStart, WindowEnd)
+        Merged = np.concatenate((TopKeys[BatchStart:BatchStart + Keys.shape[0]], Keys), axis=1)
+        TopKeys[BatchStart:BatchStart + Keys.shape[0]] = np.partition(Merged, -CandidateNum, axis=1)[:, -CandidateNum:]
+    return np.sort(TopKeys, axis=1)[:, ::-1]
+
+#This function returns the end positions (n x 3, 0 based on the cut scoring vector) of the top 3 alignments of a stack of
+# equal-length piRNAs (n x m codes) against one padded target.
+#If the target fits in one window, the scores of each batch are ranked by argsort, exactly as in PairingResultsWraper.
+#Otherwise the target is scanned in windows of ScanWindow offsets (see PairingTopKeysScanner). The scores are the same;
+# among equal scores, the alignment ending last on the target is ranked first.
+def PairingTopEndsScanner(piRNACodesStack, PaddedTargetCodes, WeightsTable, Engine="direct", ScanWindow=ScanWindowLength):
+    DiagonalLength = PaddedTargetCodes.shape[0] - (piRNACodesStack.shape[1] - 1)
+    if DiagonalLength > max(3, ScanWindow):
+        return PairingTopKeysScanner(piRNACodesStack, PaddedTargetCodes, WeightsTable, 3, Engine, ScanWindow) % DiagonalLength
+    TopEnds = np.zeros((piRNACodesStack.shape[0], 3), dtype=np.int64)
+    for WindowStart, WindowEnd, BatchStart, BatchScores in \
+            PairingScoresWindowsGenerator(piRNACodesStack, PaddedTargetCodes, WeightsTable, Engine, DiagonalLength):
+        TopEnds[BatchStart:BatchStart + BatchScores.shape[0]] = np.argsort(BatchScores, axis=1)[:, :-4:-1]
+    return TopEnds
+
+#This class holds how the alignments of a pair are picked, instead of the plain top 3 of PairingResultsWraper:
+# - Distance: two alignments of a pair must end at least Distance nt apart (non-maximum suppression), so that the
+#   shifts of the same site are not reported again. This applies to the top 3 too. 0 to disable: the top 3 are then
+#   the plain ones of PairingTopEndsScanner, whatever the HitNum.
+# - HitNum: up to HitNum hits are also reported for each pair (PanelHits), and only those scoring at least HitScore.
+#The candidates are picked by partial selection (see PairingTopKeysScanner): a hit suppresses at most
+# 2 x Distance - 1 alignments, so the first N hits are always among the best N x (2 x Distance - 1) alignments.
+class HitsSelector:
+    def __init__(self, HitNum=0, HitScore=None, Distance=0):
+        self.HitNum = HitNum
+        self.HitScore = HitScore
+        self.Distance = Distance
+        self.CandidateNum = max(3, HitNum) * max(1, 2 * Distance - 1)
+
+    #This function picks TopNum alignments (n x TopNum end positions and valid mask) from the keys of
+    # PairingTopKeysScanner, best first, skipping those ending less than Distance nt from an alignment already picked.
+    #With Fill=True, the slots left empty (when the target is too short) take the best alignments not picked yet.
+    def Suppressor(self, TopKeys, DiagonalLength, TopNum, Fill=False):
+        Rows = np.arange(TopKeys.shape[0])
+        Open = TopKeys.copy()
+        Remaining = TopKeys.copy()
+        Candidates = TopKeys % DiagonalLength
+        Ends = np.zeros((TopKeys.shape[0], TopNum), dtype=np.int64)
+        Valid = np.zeros((TopKeys.shape[0], TopNum), dtype=bool)
+        for TopIndex in range(TopNum):
+            Column = Open.argmax(axis=1)
+            Found = Open[Rows, Column] != EmptyKey
+            if Fill == True:
+                Column = np.where(Found, Column, Remaining.argmax(axis=1))
+                Found = Remaining[Rows, Column] != EmptyKey
+            Ends[:, TopIndex] = np.where(Found, Candidates[Rows, Column], 0)
+            Valid[:, TopIndex] = Found
+            Remaining[Rows, Column] = EmptyKey
+            Near = np.abs(Candidates - Ends[:, TopIndex, None]) < max(1, self.Distance)
+            Open[Near & Found[:, None]] = EmptyKey
+        return Ends, Valid
+
+#This function aligns a whole piRNAPanel against 1 target (an RNAClass object), and returns a PanelPairing object.
+#The top 3 alignments are picked exactly as in PairingResultsWraper, whatever the Engine (see AlignEngines), and the
+# targets longer than ScanWindow are scanned in windows (see PairingTopEndsScanner).
+#The patterns are only rebuilt for the top 3 alignments, from the encoded target.
+#With a Subset (a boolean mask over the panel, e.g. the pairs missing from AlignmentCache), only the unique piRNAs in
+# it are aligned, and the other rows are left as 0.
+#With Seeds (a SeedIndex.SeedIndex object), the piRNAs whose upper bound is lower than the minimum score are skipped,
+# and marked in the Pruned mask of the result. The top 3 of the other piRNAs are ranked from the seed sums (the scores
+# of all the offsets), or scanned in full for windowed targets and with a Selector, so their results do not change.
+#With a Selector (a HitsSelector object), the hits are added to the result. With a suppression Distance, the top 3 are
+# also picked by HitsSelector.Suppressor; among equal scores, the alignment ending last on the target is then ranked
+# first. Without it, the top 3 are picked as above, and the hits are picked separately.
+def PairingPanelAligner(Panel, CurrTarget, WeightsTable, Subset=None, Engine="direct", Seeds=None, \
+                        ScanWindow=ScanWindowLength, Selector=None):
+    piRNANum = len(Panel.Names)
+    Starts = np.zeros((piRNANum, 3), dtype=np.int64)
+    Ends = np.zeros((piRNANum, 3), dtype=np.int64)
+    Scores = np.zeros((piRNANum, 3), dtype=np.int64)
+    Patterns = np.zeros((piRNANum, 3, Panel.MaxLength), dtype=np.int64)
+    Pruned = None if Seeds is None else np.zeros(piRNANum, dtype=bool)
+    TargetTable = None
+    TargetCodes = SequenceEncoder(CurrTarget.Sequence)
+    if Selector is not None and Selector.HitNum > 0:
+        Hits = PanelHits(np.zeros((piRNANum, Selector.HitNum), dtype=np.int64), \
+                         np.zeros((piRNANum, Selector.HitNum), dtype=np.int64), \
+                         np.zeros((piRNANum, Selector.HitNum), dtype=np.int64), \
+                         np.zeros((piRNANum, Selector.HitNum, Panel.MaxLength), dtype=np.int64), \
+                         np.zeros((piRNANum, Selector.HitNum), dtype=bool))
+    else:
+        Hits = None
+    for piRNALength, (Index, Codes) in Panel.Groups.items():
+        Selected = None if Subset is None else Subset[Index]
+        SeedTopEnds = None
+        if Seeds is not None and (Selected is None or Selected.any()):
+            if TargetTable is None:
+                TargetTable = Seeds.TargetTableGenerator(TargetCodes)
+            Rows = np.arange(len(Index)) if Selected is None else np.flatnonzero(Selected)
+            #The seed sums are the scores: the top 3 are taken from them, unless the target is scanned in windows or the
+            # alignments are picked by a Selector
+            DiagonalLength = CurrTarget.Length + piRNALength - 1
+            Reuse = Selector is None and 3 <= DiagonalLength <= max(3, ScanWindow)
+            Bounds = Seeds.UpperBounds(TargetTable, piRNALength, Rows, Reuse)
+            if Reuse == True:
+                Bounds, SeedTopEnds = Bounds
+            Kept = Bounds >= Seeds.MinScore
+            Pruned[Index[Rows[~Kept]]] = True
+            Selected = np.zeros(len(Index), dtype=bool)
+            Selected[Rows[Kept]] = True
+            if SeedTopEnds is not None:
+                SeedTopEnds = SeedTopEnds[Kept]
+        if Selected is not None:
+            Index = Index[Selected]
+            Codes = Codes[Selected]
+            if len(Index) == 0:
+                continue
+        PaddedTargetCodes = TargetCodesPadder(TargetCodes, piRNALength)
+        if SeedTopEnds is not None:
+            TopEnds = SeedTopEnds
+        elif Selector is None or Selector.Distance == 0:
+            TopEnds = PairingTopEndsScanner(Codes, PaddedTargetCodes, WeightsTable, Engine, ScanWindow)
+        if Selector is not None:
+            DiagonalLength = CurrTarget.Length + piRNALength - 1
+            TopKeys = PairingTopKeysScanner(Codes, PaddedTargetCodes, WeightsTable, Selector.CandidateNum, Engine, ScanWindow)
+            if Selector.Distance > 0:
+                TopEnds = Selector.Suppressor(TopKeys, DiagonalLength, 3, Fill=True)[0]
+            if Hits is not None:
+                HitEnds, HitValid = Selector.Suppressor(TopKeys, DiagonalLength, Selector.HitNum)
+                Windows = PaddedTargetCodes[HitEnds[:, :, None] + np.arange(piRNALength)]
+                Hits.Patterns[Index, :, :piRNALength] = WeightsTable[Windows, Codes[:, None, :]]
+                Hits.Scores[Index] = Hits.Patterns[Index, :, :piRNALength].sum(axis=2)
+                if Selector.HitScore is not None:
+                    HitValid = HitValid & (Hits.Scores[Index] >= Selector.HitScore)
+                Hits.Ends[Index] = HitEnds
+                Hits.Starts[Index] = HitEnds - (piRNALength - 1)
+                Hits.Valid[Index] = HitValid
+        Ends[Index] = TopEnds
+        Starts[Index] = TopEnds - (piRNALength - 1)
+        Windows = PaddedTargetCodes[TopEnds[:, :, None] + np.arange(piRNALength)]
+        Patterns[Index, :, :piRNALength] = WeightsTable[Windows, Codes[:, None, :]]
+        Scores[Index] = Patterns[Index, :, :piRNALength].sum(axis=2)
+    if Panel.HasDuplicates:
+        Starts = Starts[Panel.Representatives]
+        Ends = Ends[Panel.Representatives]
+        Scores = Scores[Panel.Representatives]
+        Patterns = Patterns[Panel.Representatives]
+        if Pruned is not None:
+            Pruned = Pruned[Panel.Representatives]
+        if Hits is not None:
+            Hits = PanelHits(Hits.Starts[Panel.Representatives], Hits.Ends[Panel.Representatives], \
+                             Hits.Scores[Panel.Representatives], Hits.Patterns[Panel.Representatives], \
+                             Hits.Valid[Panel.Representatives])
+    BinPos = GetBinnedPosOnRNAVectorized(Starts, CurrTarget.Length)
+    return PanelPairing(CurrTarget.Name, CurrTarget.Sequence, CurrTarget.Length, Starts, Ends, Scores, BinPos, Patterns, \
+                        Pruned, None if Seeds is None else Seeds.MinScore, Hits)
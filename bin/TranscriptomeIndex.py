@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+"""
+TranscriptomeIndex.py
+This script is a part of piTargetClassifier project.
+This script encodes the Control and Target RNA FASTA files once (Index mode) into Prefix.Index/, so that Align mode
+ (--index Prefix) reads the RNAs from memory-mapped arrays instead of parsing the FASTA files again.
+For each set (Control, Targets), the index contains:
+  Set.Codes.u8       upper-cased sequences, concatenated, one uint8 (ASCII code) per nt
+  Set.Offsets.npy    int64 start of each RNA in Set.Codes.u8, plus the total length
+  Set.Names.txt      RNA names (FASTA headers without '>')
+Header.json records the source files, the number of RNAs and nt, and a sha256 checksum of each set.
+Requied packages: numpy
+Yu Sun, ysun43@ur.rochester.edu, 2018-11
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+from bin import FastaReader
+
+IndexVersion = 1
+IndexSets = ("Control", "Targets")
+
+def IndexDir(Prefix):
+    return Prefix + ".Index"
+
+def IndexFileName(Prefix, SetName, Array):
+    return os.path.join(IndexDir(Prefix), SetName + "." + Array)
+
+#This function encodes one FASTA file into the index, and returns its entry of Header.json.
+#The checksum covers the codes, the offsets and the names.
+def IndexSetBuilder(Prefix, SetName, FastaFile):
+    Hasher = hashlib.sha256()
+    Offsets = [0]
+    fo = open(IndexFileName(Prefix, SetName, "Codes.u8"), "wb")
+    fon = open(IndexFileName(Prefix, SetName, "Names.txt"), "w")
+    for Header, Sequence in FastaReader.FastaRecordsReader(FastaFile):
+        Codes = Sequence.upper().encode("ascii", "replace")
+        fo.write(Codes)
+        fon.write(Header + "\n")
+        Hasher.update(Codes)
+        Offsets.append(Offsets[-1] + len(Codes))
+    fo.close()
+    fon.close()
+    Offsets = np.array(Offsets, dtype=np.int64)
+    np.save(IndexFileName(Prefix, SetName, "Offsets.npy"), Offsets)
+    Hasher.update(Offsets.tobytes())
+    fi = open(IndexFileName(Prefix, SetName, "Names.txt"), "rb")
+    Hasher.update(fi.read())
+    fi.close()
+    return {"Source": os.path.abspath(FastaFile), "Records": len(Offsets) - 1, "Length": int(Offsets[-1]), \
+            "Checksum": Hasher.hexdigest()}
+
+#This function builds the index from the Control and Target FASTA files (Files: {"Control": FILE, "Targets": FILE}).
+def TranscriptomeIndexBuilder(Prefix, Files):
+    os.makedirs(IndexDir(Prefix), exist_ok=True)
+    HeaderFile = os.path.join(IndexDir(Prefix), "Header.json")
+    if os.path.exists(HeaderFile):
+        os.remove(HeaderFile)
+    Header = {"Version": IndexVersion, "Sets": {}}
+    for SetName in IndexSets:
+        Header["Sets"][SetName] = IndexSetBuilder(Prefix, SetName, Files[SetName])
+    fo = open(HeaderFile, "w")
+    json.dump(Header, fo, indent=1)
+    fo.close()
+    return Header
+
+#This function reads Header.json, or returns None if the index does not exist or has another version.
+def TranscriptomeIndexHeaderReader(Prefix):
+    HeaderFile = os.path.join(IndexDir(Prefix), "Header.json")
+    if not os.path.exists(HeaderFile):
+        return None
+    fi = open(HeaderFile, "r")
+    Header = json.load(fi)
+    fi.close()
+    if Header.get("Version") != IndexVersion:
+        return None
+    return Header
+
+#This class gives access to one set of the index. The codes are memory-mapped, so that the pages are shared by all the
+# processes reading the same index, and nothing is parsed; the names are only read when the records are streamed.
+class TranscriptomeIndex:
+    def __init__(self, Prefix, SetName, Header=None):
+        if Header is None:
+            Header = TranscriptomeIndexHeaderReader(Prefix)
+        self.Prefix = Prefix
+        self.SetName = SetName
+        self.RNANum = Header["Sets"][SetName]["Records"]
+        self.Length = Header["Sets"][SetName]["Length"]
+        self.Checksum = Header["Sets"][SetName]["Checksum"]
+        self.Offsets = np.load(IndexFileName(Prefix, SetName, "Offsets.npy"), mmap_mode="r")
+        if self.Length > 0:
+            self.Codes = np.memmap(IndexFileName(Prefix, SetName, "Codes.u8"), dtype=np.uint8, mode="r")
+        else:
+            self.Codes = np.zeros(0, dtype=np.uint8)
+        if self.Codes.shape[0] != self.Length or self.Offsets.shape[0] != self.RNANum + 1:
+            raise ValueError("The index " + IndexDir(Prefix) + " is incomplete, please run Index mode again.")
+
+    #The sequence of the RNA Number
+    def Sequence(self, Number):
+        return self.Codes[self.Offsets[Number]:self.Offsets[Number + 1]].tobytes().decode("ascii")
+
+    #This function yields (Name, Sequence) for each RNA, from the RNA Start
+    def Records(self, Start=0):
+        fi = open(IndexFileName(self.Prefix, self.SetName, "Names.txt"), "r")
+        for Number, Name in enumerate(fi):
+            if Number >= Start:
+                yield (Name.rstrip("\n"), self.Sequence(Number))
+        fi.close()
+
+#This function checks the checksums of all the sets of the index (this reads the whole index once).
+def TranscriptomeIndexVerifier(Prefix):
+    Header = TranscriptomeIndexHeaderReader(Prefix)
+    if Header is None:
+        return False
+    for SetName in IndexSets:
+        CurrIndex = TranscriptomeIndex(Prefix, SetName, Header)
+        Hasher = hashlib.sha256()
+        for BlockStart in range(0, CurrIndex.Length, 1 << 24):
+            Hasher.update(CurrIndex.Codes[BlockStart:BlockStart + (1 << 24)].tobytes())
+        Hasher.update(np.ascontiguousarray(CurrIndex.Offsets).tobytes())
+        fi = open(IndexFileName(Prefix, SetName, "Names.txt"), "rb")
+        Hasher.update(fi.read())
+        fi.close()
+        if Hasher.hexdigest() != CurrIndex.Checksum:
+            return False
+    return True
@@ -16,15 +16,21 @@ import time
 import datetime
 import argparse
 import numpy as np
-import matplotlib.pyplot as plt
 from bin import ProgramUsagePrinter
 from bin import SequencesAligner
 from bin import WeightsParser
+from bin import FastaReader
+from bin import FeatureCache
+from bin import AlignCheckpoint
+from bin import AlignmentCache
+from bin import SeedIndex
+from bin import TranscriptomeIndex
 from bin import MultiSequencesAligner
 from bin import AlignmentResultsSummarizer
 from bin import AlignmentResultsVisualizer
 from bin import MachineLearningDataParser
 from bin import MachineLearningModels
+from bin import ModelStore
 
 #Starting time stamp
 start = time.time()
@@ -42,6 +48,7 @@ else:
 
     parser = argparse.ArgumentParser()
     parser.add_argument("--Demo", help="Use files in ./demo. No other inputs needed.",action="store_true")
+    parser.add_argument("--Index", help="Use Index mode: encode -c/-t FASTA files into Prefix.Index (-o Prefix)", action="store_true")
     parser.add_argument("--Align", help="Use Align mode", action="store_true")
     parser.add_argument("-v", type=int, dest="Verbose", help="(Optional) Verbosity, default 1",default=1)
     parser.add_argument("-p","--pi", type=str, dest="PiRNA_File", help="piRNA FASTA file")   #Set an argument with file inputs using dest option.
@@ -50,6 +57,23 @@ else:
     parser.add_argument("-w", type=str, dest="Weight", help="Weight: 'match' or 'hy', or a file", default="hy")
     parser.add_argument("-o", type=str, dest="Out_Prefix", help="Prefix of output files")
     parser.add_argument("--import", type=str, dest="Import_Prefix", help="Prefix of pre-aligned data")
+    parser.add_argument("--index", type=str, dest="Index_Prefix", help="(Optional) Prefix of an Index mode index, in place of -c/-t")
+    parser.add_argument("--verify", action="store_true", dest="VerifyIndex", help="(Optional) Verify the checksums of --index first", default=False)
+    parser.add_argument("--threads", "--workers", type=int, dest="Threads", help="(Optional) Number of worker processes (cores) for alignment, learning and prediction, default 1", default=1)
+    parser.add_argument("--no-plots", action="store_true", dest="NoPlots", help="(Optional) Do not draw the figures (paired comparisons and ROC curves)", default=False)
+    parser.add_argument("--plotpdf", action="store_true", dest="CombinedPlots", help="(Optional) Draw the paired comparison figures as the pages of one PDF, Prefix.PairedPlots.pdf", default=False)
+    parser.add_argument("--bgwrite", action="store_true", dest="BackgroundWriter", help="(Optional) Write alignment files on a background thread", default=False)
+    parser.add_argument("--checkpoint", type=int, dest="CheckpointInterval", help="(Optional) Make an alignment checkpoint every INT seconds, for --resume, default off (300 with --resume)", default=None)
+    parser.add_argument("--resume", action="store_true", dest="Resume", help="(Optional) Resume an interrupted alignment from its checkpoint", default=False)
+    parser.add_argument("--aligncache", type=str, dest="AlignCacheFile", help="(Optional) SQLite file caching alignments across runs", default=None)
+    parser.add_argument("--aligncachesize", type=int, dest="AlignCacheSize", help="(Optional) Size limit of the alignment cache in MB, default 1024", default=AlignmentCache.AlignCacheSizeLimit)
+    parser.add_argument("--engine", type=str, dest="Engine", choices=SequencesAligner.AlignEngines, help="(Optional) Scoring engine: 'direct' or 'fft' (faster for long targets), default direct", default="direct")
+    parser.add_argument("--minscore", type=int, dest="MinScore", help="(Optional) Only report pairs with a best score >= INT, skipping the others with a seed index", default=None)
+    parser.add_argument("--seedk", type=int, dest="SeedLength", help="(Optional) Seed length of the seed index, default 4", default=SeedIndex.SeedLength)
+    parser.add_argument("--window", type=int, dest="ScanWindow", help="(Optional) Scan long targets in windows of INT nt, default 1048576", default=SequencesAligner.ScanWindowLength)
+    parser.add_argument("--nms", type=int, dest="Distance", help="(Optional) Suppress the alignments of a pair ending less than INT nt from a better one, default 0 (off)", default=0)
+    parser.add_argument("--hits", type=int, dest="HitNum", help="(Optional) Also write up to INT hits of each pair to Prefix.*.Hits.txt, default 0 (off)", default=0)
+    parser.add_argument("--hitscore", type=int, dest="HitScore", help="(Optional) Only write the hits with a score >= INT", default=None)
 
     parser.add_argument("--Learn", help="Use Learn mode", action="store_true")
     parser.add_argument("--TestFrac", type=float, dest="TestFrac", help="(Optional) Test data fraction, default 0.05", default=0.05)
@@ -60,12 +84,23 @@ else:
     parser.add_argument("--Depth", type=int, dest="Depth", help="(Optional) Tree Depth N, default 8", default=8)
     parser.add_argument("-s", "--svm", action="store_true", help="Use SVM classifier", default=False)
     parser.add_argument("--Cpen", type=int, dest="Cpen", help="(Optional) SVM penalty C, default 1", default=1)
+    parser.add_argument("--svmengine", type=str, dest="SVMEngine", choices=MachineLearningModels.SVMEngines, help="(Optional) SVM engine: 'exact' RBF SVC, or 'nystroem'/'rff' kernel approximation + linear SVM, default exact", default="exact")
+    parser.add_argument("--svmcomp", type=int, dest="SVMComponents", help="(Optional) Number of components of the kernel approximation, default 500", default=MachineLearningModels.SVMComponents)
+    parser.add_argument("--svmsample", type=int, dest="SVMSampleSize", help="(Optional) Fit the SVM on INT sampled training rows, and calibrate it on a holdout", default=None)
     parser.add_argument("-a", "--all", action="store_true", help="Use all above three methods", default=False)
     parser.add_argument("-m", "--mode", type=str, dest="Mode", help="(Optional) All/Best/AllBest modes, default All", default="All")
 
     parser.add_argument("--Predict", help="Use Predict mode", action="store_true")
     parser.add_argument("--prealign", type=str, dest="Pre_Align", help="pre-aligned patterns (single column).")
     parser.add_argument("--preout", type=str, dest="Pre_Out", help="Prefix of the output file.", default="DefaultPre")
+    parser.add_argument("--prechunk", type=int, dest="PredictChunkSize", help="(Optional) Number of patterns predicted at once, default 65536", default=MachineLearningDataParser.PatternChunkSize)
+    parser.add_argument("--proba", action="store_true", dest="Probability", help="(Optional) Also write the probability of Target", default=False)
+    parser.add_argument("--model", type=str, dest="Model_Files", action="append", help="(Optional) Model file saved by Learn mode (*.model), can be repeated", default=None)
+    parser.add_argument("--Serve", help="Use Serve mode: serve the --model files on a local HTTP endpoint", action="store_true")
+    parser.add_argument("--port", type=int, dest="Port", help="(Optional) Port of Serve mode on 127.0.0.1, default 8765", default=8765)
+    parser.add_argument("--socket", type=str, dest="Socket", help="(Optional) Serve on this Unix socket instead of a port", default=None)
+    parser.add_argument("--batchsize", type=int, dest="BatchSize", help="(Optional) Maximum number of patterns of a micro-batch, default 4096", default=4096)
+    parser.add_argument("--batchwait", type=float, dest="BatchWait", help="(Optional) Milliseconds a micro-batch waits for more requests, default 2", default=2.0)
 
     #args is a list of arguments. If default values not set, it will be None or False
     args = parser.parse_args()
@@ -93,6 +128,30 @@ else:
     else:
         pass
 
+    #Index mode: the Control and Target RNAs are encoded once, and reused by Align mode with --index Prefix
+    if args.Index == True:
+        print("0. Starting piTargetClassifier Index mode...")
+        if args.RNA_Control_File == None or args.RNA_Target_File == None or args.Out_Prefix == None:
+            print("Missing input files...")
+            exit()
+        print(">>> Encoding RNAs into: " + TranscriptomeIndex.IndexDir(args.Out_Prefix))
+        IndexHeader = TranscriptomeIndex.TranscriptomeIndexBuilder(args.Out_Prefix, {"Control": args.RNA_Control_File,
+                                                                                     "Targets": args.RNA_Target_File})
+        print("Control RNAs: " + str(IndexHeader["Sets"]["Control"]["Records"]))
+        print("Target RNAs: " + str(IndexHeader["Sets"]["Targets"]["Records"]))
+        print("***********************************************************************")
+
+    #Serve mode: the saved models are loaded once, and serve the prediction requests until Ctrl+C
+    if args.Serve == True:
+        print("0. Starting piTargetClassifier Serve mode...")
+        if args.Model_Files == None:
+            print("Serve mode needs the models saved by Learn mode (--model FILE)")
+            exit()
+        # The server (asyncio, http) is only imported by Serve mode, to keep the startup of the other modes short
+        from bin import PredictionServer
+        PredictionServer.PredictionServerRunner(args.Model_Files, args.Port, args.Socket, args.BatchSize, args.BatchWait)
+        print("***********************************************************************")
+
     #Setting input files
     if (args.Demo == True) or (args.Align == True):
         # Get inputs for Demo or Align (de novo) modes
@@ -127,7 +186,7 @@ else:
                 PiRNAFile = args.PiRNA_File
                 RNAControlFile = args.RNA_Control_File
                 RNATargetingFile = args.RNA_Target_File
-                if PiRNAFile == None or RNAControlFile == None or RNATargetingFile == None:
+                if PiRNAFile == None or ((RNAControlFile == None or RNATargetingFile == None) and args.Index_Prefix == None):
                     print("Missing input files...")
                     exit()
                 WeightValue=args.Weight
@@ -149,20 +208,33 @@ else:
             # Starting Align mode
             print("1. Starting piTargetClassifier Align mode with input FASTA files...")
 
-            # Read inputs and get statistics
-            PiRNAFi = open(PiRNAFile, "r")
-            RNAControlFi = open(RNAControlFile, "r")
-            RNATargetingFi = open(RNATargetingFile, "r")
-            PiRNA = PiRNAFi.readlines()
-            RNAControl = RNAControlFi.readlines()
-            RNATargeting = RNATargetingFi.readlines()
-            PiRNA_Len = len(PiRNA)
-            RNAControl_Len = len(RNAControl)
-            RNATargeting_Len = len(RNATargeting)
+            # Get statistics. FASTA files (plain or gzipped) are streamed during the alignment, not loaded in memory.
+            # With --index, the RNAs are read from the memory-mapped index instead, and nothing is parsed.
+            PiRNA_Num = FastaReader.FastaRecordsCounter(PiRNAFile)
+            Index_Control = None
+            Index_Targets = None
+            if args.Demo != True and args.Index_Prefix != None:
+                IndexHeader = TranscriptomeIndex.TranscriptomeIndexHeaderReader(args.Index_Prefix)
+                if IndexHeader == None:
+                    print("No index found for: " + str(args.Index_Prefix) + ", please run Index mode first.")
+                    exit()
+                if args.VerifyIndex == True and not TranscriptomeIndex.TranscriptomeIndexVerifier(args.Index_Prefix):
+                    print("The checksums of the index do not match, please run Index mode again.")
+                    exit()
+                print(">>> Reading RNAs from the index: " + TranscriptomeIndex.IndexDir(args.Index_Prefix))
+                Index_Control = TranscriptomeIndex.TranscriptomeIndex(args.Index_Prefix, "Control", IndexHeader)
+                Index_Targets = TranscriptomeIndex.TranscriptomeIndex(args.Index_Prefix, "Targets", IndexHeader)
+                RNAControlFile = TranscriptomeIndex.IndexDir(args.Index_Prefix) + "/Control"
+                RNATargetingFile = TranscriptomeIndex.IndexDir(args.Index_Prefix) + "/Targets"
+                RNAControl_Num = Index_Control.RNANum
+                RNATargeting_Num = Index_Targets.RNANum
+            else:
+                RNAControl_Num = FastaReader.FastaRecordsCounter(RNAControlFile)
+                RNATargeting_Num = FastaReader.FastaRecordsCounter(RNATargetingFile)
             print(">>> Input statistics:")
-            print("Control RNAs: " + str(int(RNAControl_Len / 2)))
-            print("Target RNAs: " + str(int(RNATargeting_Len / 2)))
-            print("piRNAs: " + str(int(PiRNA_Len / 2)))
+            print("Control RNAs: " + str(RNAControl_Num))
+            print("Target RNAs: " + str(RNATargeting_Num))
+            print("piRNAs: " + str(PiRNA_Num))
 
             # Get Weights
             print(">>> Getting weights and input files")
@@ -174,28 +246,98 @@ else:
             print(">>> Other parameters")
             print("Verbosity: "+str(args.Verbose))
             print("Output Prefix: "+str(OutputPrefix))
+            print("Workers: "+str(args.Threads))
+            print("Scoring engine: "+str(args.Engine))
+            if args.MinScore != None:
+                print("Minimum score: "+str(args.MinScore))
+            if args.Distance > 0:
+                print("Suppression distance: "+str(args.Distance))
+            if args.HitNum > 0:
+                print("Hits per pair: "+str(args.HitNum))
+                if args.HitScore != None:
+                    print("Minimum hit score: "+str(args.HitScore))
+                if args.AlignCacheFile != None:
+                    print("The alignment cache is not used when reporting hits")
 
-            # Perform multi-alignment. The returned result is a numpy Array of Objects
-            MultiSequencesAligner.OutputAlignFilesFlusher(OutputPrefix)
-            # print(V_pi, V_con)
-            print(">>> Aligning piRNAs with Target RNAs")
-            AlignMatrix_piRNA_Targets = MultiSequencesAligner.ObjectsMatrixGenerator(RNATargeting, PiRNA,
-                                                                                     RNATargeting_Len, PiRNA_Len,
-                                                                                     WeightsDict,
-                                                                                     OutputPrefix + ".Targets", V_pi)
-            print(">>> Aligning piRNAs with Control RNAs")
-            AlignMatrix_piRNA_Control = MultiSequencesAligner.ObjectsMatrixGenerator(RNAControl, PiRNA, RNAControl_Len,
-                                                                                     PiRNA_Len, WeightsDict,
-                                                                                     OutputPrefix + ".Control", V_con)
+            # Perform multi-alignment. The results are written to the output files, and summarized on the fly:
+            # the AlignmentSummary objects contain the sum and average values of patterns/matchings, and the frequencies
+            # of scores and positions.
+            # With checkpoints, the progress is recorded in Prefix.Checkpoint.json, and --resume continues from there
+            # if the inputs, weights and alignment options are the same. Otherwise, the output files are cleaned up.
+            # Checkpoints are off by default: they are made with --checkpoint N (seconds), or every 300 s with --resume.
+            # The checkpoint is keyed by a hash of the contents of the inputs, and a checkpoint made with other inputs
+            # or options is never resumed.
+            Checkpoint = None
+            if args.CheckpointInterval == None:
+                args.CheckpointInterval = AlignCheckpoint.CheckpointInterval if args.Resume == True else 0
+            if args.CheckpointInterval > 0 or args.Resume == True:
+                if Index_Control == None:
+                    InputsFiles = [PiRNAFile, RNAControlFile, RNATargetingFile]
+                    InputsChecksums = []
+                else:
+                    InputsFiles = [PiRNAFile]
+                    InputsChecksums = [Index_Control.Checksum, Index_Targets.Checksum]
+                InputsHash = AlignCheckpoint.InputsHasher(InputsFiles, WeightsDict, InputsChecksums)
+                AlignOptions = {"--engine": args.Engine, "--minscore": args.MinScore, "--seedk": args.SeedLength,
+                                "--window": args.ScanWindow, "--nms": args.Distance, "--hits": args.HitNum,
+                                "--hitscore": args.HitScore}
+                Checkpoint = AlignCheckpoint.AlignCheckpoint(OutputPrefix, InputsHash, args.CheckpointInterval, AlignOptions)
+            if args.Resume == True and Checkpoint.Mismatch() != None:
+                print("Can not resume the alignment from " + Checkpoint.File + ": " + Checkpoint.Mismatch() + ".")
+                print("Run it again with the same inputs and options, or without --resume to start over.")
+                exit(1)
+            if args.Resume == True and Checkpoint.Load():
+                print(">>> Resuming the alignment from: " + Checkpoint.File)
+            else:
+                if args.Resume == True:
+                    print(">>> No usable checkpoint found, starting the alignment over")
+                MultiSequencesAligner.OutputAlignFilesFlusher(OutputPrefix)
+            FeatureCache.FeatureCacheInvalidator(OutputPrefix)
+            Accumulator_piRNA_Targets = AlignmentResultsSummarizer.AlignmentSummaryAccumulator()
+            Accumulator_piRNA_Control = AlignmentResultsSummarizer.AlignmentSummaryAccumulator()
+            AlignSet_Targets = MultiSequencesAligner.RNASet(RNATargetingFile, RNATargeting_Num, OutputPrefix + ".Targets", V_pi,
+                                                            Accumulator_piRNA_Targets, Index_Targets)
+            AlignSet_Control = MultiSequencesAligner.RNASet(RNAControlFile, RNAControl_Num, OutputPrefix + ".Control", V_con,
+                                                            Accumulator_piRNA_Control, Index_Control)
+            if args.Threads > 1:
+                # Target and Control RNAs are aligned at the same time, sharing the same worker processes
+                print(">>> Aligning piRNAs with Target and Control RNAs using " + str(args.Threads) + " workers")
+                MultiSequencesAligner.ObjectsMatricesGenerator([AlignSet_Targets, AlignSet_Control], PiRNAFile, WeightsDict,
+                                                               args.Threads, args.BackgroundWriter, KeepResults=False,
+                                                               FeatureCachePrefix=OutputPrefix, Checkpoint=Checkpoint,
+                                                               AlignCacheFile=args.AlignCacheFile, AlignCacheSize=args.AlignCacheSize,
+                                                               Engine=args.Engine, MinScore=args.MinScore, SeedLength=args.SeedLength,
+                                                               ScanWindow=args.ScanWindow, Distance=args.Distance,
+                                                               HitNum=args.HitNum, HitScore=args.HitScore)
+            else:
+                print(">>> Aligning piRNAs with Target RNAs")
+                MultiSequencesAligner.ObjectsMatricesGenerator([AlignSet_Targets], PiRNAFile, WeightsDict, 1,
+                                                               args.BackgroundWriter, KeepResults=False,
+                                                               FeatureCachePrefix=OutputPrefix, Checkpoint=Checkpoint,
+                                                               AlignCacheFile=args.AlignCacheFile, AlignCacheSize=args.AlignCacheSize,
+                                                               Engine=args.Engine, MinScore=args.MinScore, SeedLength=args.SeedLength,
+                                                               ScanWindow=args.ScanWindow, Distance=args.Distance,
+                                                               HitNum=args.HitNum, HitScore=args.HitScore)
+                print(">>> Aligning piRNAs with Control RNAs")
+                MultiSequencesAligner.ObjectsMatricesGenerator([AlignSet_Control], PiRNAFile, WeightsDict, 1,
+                                                               args.BackgroundWriter, KeepResults=False,
+                                                               FeatureCachePrefix=OutputPrefix, Checkpoint=Checkpoint,
+                                                               AlignCacheFile=args.AlignCacheFile, AlignCacheSize=args.AlignCacheSize,
+                                                               Engine=args.Engine, MinScore=args.MinScore, SeedLength=args.SeedLength,
+                                                               ScanWindow=args.ScanWindow, Distance=args.Distance,
+                                                               HitNum=args.HitNum, HitScore=args.HitScore)
+            # The binary feature cache (for Learn mode) is only valid once both sets are aligned
+            if AlignSet_Targets.FeatureCacheWritten and AlignSet_Control.FeatureCacheWritten:
+                FeatureCache.FeatureCacheHeaderWriter(OutputPrefix, WeightsDict,
+                                                      {"piRNA": PiRNAFile, "Control": RNAControlFile, "Target": RNATargetingFile})
 
             # Get summary. The result is an AlignmentSummary object, which contains patterns/matchings, sum and average values.
-            Summary_piRNA_Targets = AlignmentResultsSummarizer.SummairzeObjectsMatrix(AlignMatrix_piRNA_Targets)
-            Summary_piRNA_Control = AlignmentResultsSummarizer.SummairzeObjectsMatrix(AlignMatrix_piRNA_Control)
+            Summary_piRNA_Targets = Accumulator_piRNA_Targets.Summary()
+            Summary_piRNA_Control = Accumulator_piRNA_Control.Summary()
 
-            AlignmentResultsVisualizer.VisualizePairedSummary(Summary_piRNA_Control, Summary_piRNA_Targets, OutputPrefix)
-            PiRNAFi.close()
-            RNAControlFi.close()
-            RNATargetingFi.close()
+            if args.NoPlots == False:
+                AlignmentResultsVisualizer.VisualizePairedSummary(Summary_piRNA_Control, Summary_piRNA_Targets, OutputPrefix,
+                                                                  args.Threads, args.CombinedPlots)
             print("***********************************************************************")
 
         elif (args.Align == True) and (args.Import_Prefix != None):
@@ -205,6 +347,13 @@ else:
             print(">>> Getting pre-aligned result Prefix: " + str(OutputPrefix))
             print("***********************************************************************")
 
+    elif args.Index == True:
+        pass
+    elif args.Serve == True:
+        pass
+    elif (args.Predict == True) and (args.Model_Files != None):
+        # Predict mode with saved models, no alignment or fitting needed
+        pass
     else:
         print("At least --Demo or --Align mode needs to be set.")
         print("To check manual, please use -h, --help")
@@ -218,118 +367,125 @@ else:
         print(">>> Learn Mode parameters:")
         print("Test dataset fraction: "+str(args.TestFrac))
 
-        #All
-        (MLControl_Data_All, MLControl_Label_All) = MachineLearningDataParser.DataParserFromPatternFile(OutputPrefix + ".Control.AllAlignmentPattern.txt", "Control")
-        (MLTarget_Data_All, MLTarget_Label_All) = MachineLearningDataParser.DataParserFromPatternFile(OutputPrefix + ".Targets.AllAlignmentPattern.txt", "Target")
-        #Best
-        (MLControl_Data_Best, MLControl_Label_Best) = MachineLearningDataParser.DataParserFromPatternFile(OutputPrefix + ".Control.BestAlignmentPattern.txt", "Control")
-        (MLTarget_Data_Best, MLTarget_Label_Best) = MachineLearningDataParser.DataParserFromPatternFile(OutputPrefix + ".Targets.BestAlignmentPattern.txt", "Target")
+        # The features are loaded from the binary feature cache (memory-mapped), which is written by Align mode,
+        # or built once from the pattern files of pre-aligned data. The text files are only parsed as a fallback.
+        # The fitted classifiers are saved as Prefix.ML.*.model files, with the weights of the alignment if known.
+        LearnWeights = None
+        if FeatureCache.FeatureCacheEnsurer(OutputPrefix):
+            LearnWeights = FeatureCache.FeatureCacheHeaderReader(OutputPrefix)["Weights"]
+            (MLControl_Data_All, MLControl_Label_All) = FeatureCache.FeatureCacheLoader(OutputPrefix, "Control", "All")
+            (MLTarget_Data_All, MLTarget_Label_All) = FeatureCache.FeatureCacheLoader(OutputPrefix, "Targets", "All")
+            (MLControl_Data_Best, MLControl_Label_Best) = FeatureCache.FeatureCacheLoader(OutputPrefix, "Control", "Best")
+            (MLTarget_Data_Best, MLTarget_Label_Best) = FeatureCache.FeatureCacheLoader(OutputPrefix, "Targets", "Best")
+        else:
+            #All
+            (MLControl_Data_All, MLControl_Label_All) = MachineLearningDataParser.DataParserFromPatternFile(OutputPrefix + ".Control.AllAlignmentPattern.txt", "Control")
+            (MLTarget_Data_All, MLTarget_Label_All) = MachineLearningDataParser.DataParserFromPatternFile(OutputPrefix + ".Targets.AllAlignmentPattern.txt", "Target")
+            #Best
+            (MLControl_Data_Best, MLControl_Label_Best) = MachineLearningDataParser.DataParserFromPatternFile(OutputPrefix + ".Control.BestAlignmentPattern.txt", "Control")
+            (MLTarget_Data_Best, MLTarget_Label_Best) = MachineLearningDataParser.DataParserFromPatternFile(OutputPrefix + ".Targets.BestAlignmentPattern.txt", "Target")
 
+        # The data of each mode are concatenated and split once, then the classifiers are fitted and evaluated in turn,
+        # or at the same time with --threads N (see MachineLearningModels.LearnTasksScheduler).
+        LearnData = {}
+        LearnSplits = {}
+        if args.Mode == "All" or args.Mode == "AllBest":
+            LearnData["All"] = (MLControl_Data_All, MLTarget_Data_All)
+            LearnSplits["All"] = MachineLearningModels.LearnDataSplitter(MLControl_Data_All, MLControl_Label_All,
+                                                                         MLTarget_Data_All, MLTarget_Label_All, args.TestFrac)
+        if args.Mode == "Best" or args.Mode == "AllBest":
+            LearnData["Best"] = (MLControl_Data_Best, MLTarget_Data_Best)
+            LearnSplits["Best"] = MachineLearningModels.LearnDataSplitter(MLControl_Data_Best, MLControl_Label_Best,
+                                                                          MLTarget_Data_Best, MLTarget_Label_Best, args.TestFrac)
+        LearnTasks = []
+        # The SVM engine and sampling are part of the name of the SVM reports and model
+        SVMParams = {"Cpen": args.Cpen, "Engine": args.SVMEngine, "Components": args.SVMComponents, "SampleSize": args.SVMSampleSize}
+        SVMName = MachineLearningModels.ClassifierName("SVM", SVMParams)
         if (args.all == True) or (args.logi ==True):
-            if args.Mode == "All" or args.Mode == "AllBest":
-                #All
-                print(">>> Logistic: Model Fitting using All Alignments")
-                print("Cross Validation N: "+str(args.CVNum))
-                OutputSummaryFile_LogiA = OutputPrefix + ".ML.All.Logistic.CV" + str(args.CVNum) + ".txt"
-                OutputSummaryFig_LogiA = OutputPrefix + ".ML.All.Logistic.CV" + str(args.CVNum) + ".pdf"
-                X_train_logia, X_test_logia, y_train_logia, y_test_logia, logi_a = MachineLearningModels.FitClassifierLogistic(MLControl_Data_All,
-                        MLControl_Label_All,MLTarget_Data_All,MLTarget_Label_All,args.CVNum,args.TestFrac,OutputSummaryFile_LogiA)
-                MachineLearningModels.CompareMLResultsAndROCCurves(X_train_logia, X_test_logia, y_train_logia, y_test_logia, logi_a, "Logistic",OutputSummaryFile_LogiA, OutputSummaryFig_LogiA, V_ML)
-                if args.Mode == "All":
-                    print("***********************************************************************")
-
-            if args.Mode == "Best" or args.Mode == "AllBest":
-                #Best
-                print(">>> Logistic: Model Fitting using Best Alignments")
-                print("Cross Validation N: " + str(args.CVNum))
-                OutputSummaryFile_LogiB = OutputPrefix + ".ML.Best.Logistic.CV" + str(args.CVNum) + ".txt"
-                OutputSummaryFig_LogiB = OutputPrefix + ".ML.Best.Logistic.CV" + str(args.CVNum) + ".pdf"
-                X_train_logib, X_test_logib, y_train_logib, y_test_logib, logi_b = MachineLearningModels.FitClassifierLogistic(MLControl_Data_Best,
-                        MLControl_Label_Best, MLTarget_Data_Best, MLTarget_Label_Best, args.CVNum, args.TestFrac, OutputSummaryFile_LogiB)
-                MachineLearningModels.CompareMLResultsAndROCCurves(X_train_logib, X_test_logib, y_train_logib, y_test_logib,logi_b, "Logistic", OutputSummaryFile_LogiB,OutputSummaryFig_LogiB, V_ML)
-                print("***********************************************************************")
-
-        if args.all == True or args.rf ==True:
-            if args.Mode == "All" or args.Mode == "AllBest":
-                # All
-                print(">>> Random Forest: Model Fitting using All Alignments")
-                OutputSummaryFile_RFA = OutputPrefix + ".ML.All.RandomForest.T" + str(args.TNum) + "D" + str(args.Depth) + ".txt"
-                OutputSummaryFig_RFA = OutputPrefix + ".ML.All.RandomForest.T" + str(args.TNum) + "D" + str(args.Depth) + ".pdf"
-                X_train_rfa, X_test_rfa, y_train_rfa, y_test_rfa, rf_a = MachineLearningModels.FitClassifierRandomForest(MLControl_Data_All,
-                        MLControl_Label_All, MLTarget_Data_All, MLTarget_Label_All, args.TNum, args.Depth, args.TestFrac,OutputSummaryFile_RFA)
-                MachineLearningModels.CompareMLResultsAndROCCurves(X_train_rfa, X_test_rfa, y_train_rfa, y_test_rfa, rf_a,"Random Forest", OutputSummaryFile_RFA,OutputSummaryFig_RFA, V_ML)
-                if args.Mode == "All":
-                    print("***********************************************************************")
-
-            if args.Mode == "Best" or args.Mode == "AllBest":
-                #Best
-                print(">>> Random Forest: Model Fitting using Best Alignments")
-                OutputSummaryFile_RFB = OutputPrefix + ".ML.Best.RandomForest.T" + str(args.TNum) + "D" + str(args.Depth) + ".txt"
-                OutputSummaryFig_RFB = OutputPrefix + ".ML.Best.RandomForest.T" + str(args.TNum) + "D" + str(args.Depth) + ".pdf"
-                X_train_rfb, X_test_rfb, y_train_rfb, y_test_rfb, rf_b = MachineLearningModels.FitClassifierRandomForest(MLControl_Data_Best,
-                        MLControl_Label_Best, MLTarget_Data_Best, MLTarget_Label_Best, args.TNum, args.Depth, args.TestFrac, OutputSummaryFile_RFB)
-                MachineLearningModels.CompareMLResultsAndROCCurves(X_train_rfb, X_test_rfb, y_train_rfb, y_test_rfb, rf_b,"Random Forest", OutputSummaryFile_RFB,OutputSummaryFig_RFB, V_ML)
-                print("***********************************************************************")
-
-        if args.all == True or args.svm ==True:
-            if args.Mode == "All" or args.Mode == "AllBest":
-                #All
-                print(">>> SVM: Model Fitting using All Alignments")
-                OutputSummaryFile_SVMA = OutputPrefix + ".ML.All.SVM.C" + str(args.Cpen) + ".txt"
-                OutputSummaryFig_SVMA = OutputPrefix + ".ML.All.SVM.C" + str(args.Cpen) + ".pdf"
-                X_train_svma, X_test_svma, y_train_svma, y_test_svma, svcfig_a = MachineLearningModels.FitClassifierSVM(MLControl_Data_All,
-                        MLControl_Label_All,MLTarget_Data_All,MLTarget_Label_All, args.Cpen,args.TestFrac,OutputSummaryFile_SVMA)
-                MachineLearningModels.CompareMLResultsAndROCCurves(X_train_svma, X_test_svma, y_train_svma, y_test_svma, svcfig_a, "SVM",OutputSummaryFile_SVMA, OutputSummaryFig_SVMA, V_ML)
-                if args.Mode == "All":
-                    print("***********************************************************************")
-
-            if args.Mode == "Best" or args.Mode == "AllBest":
-                #Best
-                print(">>> SVM: Model Fitting using Best Alignments")
-                OutputSummaryFile_SVMB = OutputPrefix + ".ML.Best.SVM.C" + str(args.Cpen) + ".txt"
-                OutputSummaryFig_SVMB = OutputPrefix + ".ML.Best.SVM.C" + str(args.Cpen) + ".pdf"
-                X_train_svmb, X_test_svmb, y_train_svmb, y_test_svmb, svcfig_b = MachineLearningModels.FitClassifierSVM(MLControl_Data_Best,
-                        MLControl_Label_Best, MLTarget_Data_Best, MLTarget_Label_Best, args.Cpen, args.TestFrac, OutputSummaryFile_SVMB)
-                MachineLearningModels.CompareMLResultsAndROCCurves(X_train_svmb, X_test_svmb, y_train_svmb, y_test_svmb, svcfig_b, "SVM", OutputSummaryFile_SVMB,OutputSummaryFig_SVMB, V_ML)
+            for Mode in LearnSplits:
+                LearnTasks.append(MachineLearningModels.LearnTask("Logistic", Mode, {"CVNum": args.CVNum},
+                                  OutputPrefix + ".ML." + Mode + ".Logistic.CV" + str(args.CVNum),
+                                  [">>> Logistic: Model Fitting using " + Mode + " Alignments", "Cross Validation N: " + str(args.CVNum)], args.NoPlots == False))
+        if (args.all == True) or (args.rf ==True):
+            for Mode in LearnSplits:
+                LearnTasks.append(MachineLearningModels.LearnTask("RandomForest", Mode, {"TNum": args.TNum, "Depth": args.Depth},
+                                  OutputPrefix + ".ML." + Mode + ".RandomForest.T" + str(args.TNum) + "D" + str(args.Depth),
+                                  [">>> Random Forest: Model Fitting using " + Mode + " Alignments"], args.NoPlots == False))
+        if (args.all == True) or (args.svm ==True):
+            for Mode in LearnSplits:
+                LearnTasks.append(MachineLearningModels.LearnTask("SVM", Mode, SVMParams,
+                                  OutputPrefix + ".ML." + Mode + "." + SVMName,
+                                  [">>> SVM: Model Fitting using " + Mode + " Alignments"], args.NoPlots == False))
+        LearnClassifiers = {}
+        for Task, Classifier, Metrics in MachineLearningModels.LearnTasksScheduler(LearnTasks, LearnSplits, args.Threads, V_ML):
+            ModelStore.ModelSaver(Task.OutputSummaryFileName, OutputPrefix, Classifier, MachineLearningModels.ClassifierTypes[Task.Kind],
+                                  Task.Mode, LearnData[Task.Mode], LearnWeights)
+            LearnClassifiers[(Task.Kind, Task.Mode)] = Classifier
+            if Task.Mode == "Best" or args.Mode == "All":
                 print("***********************************************************************")
 
     if (args.Demo == True) or (args.Predict == True):
         print("3. Starting piTargetClassifier Predict mode...")
         Predict_File=args.Pre_Align
-        print("Use the learnt patterns from "+str(args.Mode)+" mode.")
-        #All
+        if args.Model_Files != None:
+            print("Use the saved models: "+", ".join(args.Model_Files))
+        else:
+            print("Use the learnt patterns from "+str(args.Mode)+" mode.")
+        # The input is streamed in chunks (--prechunk), and each chunk is predicted by all the models at once
         print(">>> Reading the input alignment patterns from: "+str(Predict_File))
-        Predict_Data = MachineLearningDataParser.DataParserFromPatternOnlyFile(Predict_File)
+        Predict_Length = MachineLearningDataParser.PatternLengthReader(Predict_File)
+        Predict_Models = []
+        Predict_Caches = None
 
-        if (args.all == True) or (args.logi ==True):
+        # Saved models (from Learn mode, see ModelStore) are used as they are, whatever the other Learn options.
+        # Their predictions are memoized in Model.model.PredictCache.npz, and reused by the next batches.
+        if args.Model_Files != None:
+            Predict_Caches = []
+            for ModelFile in args.Model_Files:
+                Model = ModelStore.ModelLoader(ModelFile)
+                if Model == None:
+                    print("Not a piTargetClassifier model file: " + ModelFile)
+                    exit()
+                if Predict_Length != Model["PatternLength"]:
+                    print("The patterns of " + str(Predict_File) + " do not have the length of the model " + ModelFile + \
+                          " (" + str(Model["PatternLength"]) + ")")
+                    exit()
+                print(">>> Model " + Model["Name"] + ": " + Model["ClassifierType"] + ", learnt from " + Model["Mode"] + " alignments")
+                PredictResult_Model = args.Pre_Out + ".Predict.ML." + Model["Name"] + ".txt"
+                Predict_Models.append((Model["Classifier"], Model["ClassifierType"], PredictResult_Model))
+                Predict_Caches.append(ModelStore.PredictionCache(ModelStore.PredictionCacheFileName(ModelFile), Model["FileChecksum"]))
+
+        if (args.Model_Files == None) and ((args.all == True) or (args.logi ==True)):
             if args.Mode == "All" or args.Mode == "AllBest":
                 #All
                 PredictResult_LogiA = args.Pre_Out + ".Predict.ML.All.Logistic.CV" + str(args.CVNum) + ".txt"
-                MachineLearningModels.PredictResultsFromModel(Predict_Data, Predict_File, logi_a, "Logistic", PredictResult_LogiA)
+                Predict_Models.append((LearnClassifiers[("Logistic", "All")], "Logistic", PredictResult_LogiA))
             if args.Mode == "Best" or args.Mode == "AllBest":
                 #Best
                 PredictResult_LogiB = args.Pre_Out + ".Predict.ML.Best.Logistic.CV" + str(args.CVNum) + ".txt"
-                MachineLearningModels.PredictResultsFromModel(Predict_Data, Predict_File, logi_b, "Logistic",PredictResult_LogiB)
+                Predict_Models.append((LearnClassifiers[("Logistic", "Best")], "Logistic", PredictResult_LogiB))
 
-        if (args.all == True) or (args.rf ==True):
+        if (args.Model_Files == None) and ((args.all == True) or (args.rf ==True)):
             if args.Mode == "All" or args.Mode == "AllBest":
                 #All
                 PredictResult_RFA = args.Pre_Out + ".Predict.ML.All.RandomForest.T" + str(args.TNum) + "D" + str(args.Depth) + ".txt"
-                MachineLearningModels.PredictResultsFromModel(Predict_Data, Predict_File, rf_a, "Random Forest",PredictResult_RFA)
+                Predict_Models.append((LearnClassifiers[("RandomForest", "All")], "Random Forest", PredictResult_RFA))
             if args.Mode == "Best" or args.Mode == "AllBest":
                 #Best
                 PredictResult_RFB = args.Pre_Out + ".Predict.ML.Best.RandomForest.T" + str(args.TNum) + "D" + str(args.Depth) + ".txt"
-                MachineLearningModels.PredictResultsFromModel(Predict_Data, Predict_File, rf_b, "Random Forest",PredictResult_RFB)
+                Predict_Models.append((LearnClassifiers[("RandomForest", "Best")], "Random Forest", PredictResult_RFB))
 
-        if (args.all == True) or (args.svm ==True):
+        if (args.Model_Files == None) and ((args.all == True) or (args.svm ==True)):
             if args.Mode == "All" or args.Mode == "AllBest":
                 #All
-                PredictResult_SVMA = args.Pre_Out + ".Predict.ML.All.SVM.C" + str(args.Cpen) + ".txt"
-                MachineLearningModels.PredictResultsFromModel(Predict_Data, Predict_File, svcfig_a, "SVM",PredictResult_SVMA)
+                PredictResult_SVMA = args.Pre_Out + ".Predict.ML.All." + SVMName + ".txt"
+                Predict_Models.append((LearnClassifiers[("SVM", "All")], "SVM", PredictResult_SVMA))
             if args.Mode == "Best" or args.Mode == "AllBest":
                 #Best
-                PredictResult_SVMB = args.Pre_Out + ".Predict.ML.Best.SVM.C" + str(args.Cpen) + ".txt"
-                MachineLearningModels.PredictResultsFromModel(Predict_Data, Predict_File, svcfig_b, "SVM",PredictResult_SVMB)
+                PredictResult_SVMB = args.Pre_Out + ".Predict.ML.Best." + SVMName + ".txt"
+                Predict_Models.append((LearnClassifiers[("SVM", "Best")], "SVM", PredictResult_SVMB))
+        MachineLearningModels.PredictResultsStreamer(Predict_File, Predict_Models, args.PredictChunkSize, args.Probability,
+                                                     args.Threads, Predict_Caches)
         print("Output file prefix: "+str(args.Pre_Out))
 
     # Finishing
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+
+"""
+test_startup.py
+This script is a part of piTargetClassifier project.
+This script checks the startup of piTargetClassifier.py (no arguments: usage), with python -X importtime:
+ the heavy packages (sklearn, matplotlib, asyncio) are only imported by the modes that use them, and the total import
+ time stays within ImportTimeBudget.
+Run: python -m pytest -q tests
+Requied packages: pytest
+Yu Sun, ysun43@ur.rochester.edu, 2018-11
+"""
+
+import os
+import sys
+import subprocess
+
+ProgramDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+#Packages which must not be imported at startup, and the budget of the total import time (ms, sum of the self times)
+LazyPackages = ("sklearn", "matplotlib", "asyncio")
+ImportTimeBudget = 500
+
+#This function runs piTargetClassifier.py with python -X importtime, and returns {module: self import time (us)}.
+def ImportTimesReader(Arguments=()):
+    Process = subprocess.run([sys.executable, "-X", "importtime", "piTargetClassifier.py"] + list(Arguments), \
+                             cwd=ProgramDir, capture_output=True, text=True)
+    ImportTimes = {}
+    for Line in Process.stderr.splitlines():
+        if Line.startswith("import time:") and "self [us]" not in Line:
+            SelfTime, Cumulative, Module = Line[len("import time:"):].split("|")
+            ImportTimes[Module.strip()] = int(SelfTime)
+    return ImportTimes
+
+def test_startup_lazy_packages():
+    ImportTimes = ImportTimesReader()
+    for Package in LazyPackages:
+        Imported = [Module for Module in ImportTimes if Module == Package or Module.startswith(Package + ".")]
+        assert Imported == [], Package + " is imported at startup: " + ", ".join(Imported[:5])
+
+def test_startup_import_time():
+    Total = sum(ImportTimesReader().values()) / 1000.0
+    assert Total <= ImportTimeBudget, "Startup imports take %.0f ms, over the budget of %d ms" % (Total, ImportTimeBudget)